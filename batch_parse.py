@@ -0,0 +1,448 @@
+#!/usr/bin/python
+
+import os
+import sys
+import glob
+import time
+import shutil
+import signal
+import argparse
+import contextlib
+import multiprocessing as mp
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+
+from libs.rss_grid import RssGrid
+from libs.rss_pool import batch_seed
+from libs.rss_pool import sampling_seed
+from libs.dataset import ShardWriter
+from libs.stage_cache import StageCache
+from libs.stage_cache import map_outputs
+from libs.pcap_reader import PCAP_READERS
+from libs.parser_post import build_map
+from libs.parser_post import dump_rss_maps
+from libs.parser_post import dump_rss_samples
+from libs.parser_post import load_rss_points
+from libs.parser_post import get_groundtruth_dict
+from libs.parser_post import PICKLE_MAP_SIZE
+from libs.parser_post import PICKLE_MAP_STEP
+from preprocessor import get_files
+from preprocessor import prepare_sig
+
+
+LOG_FILE = "batch_parse.log"
+OUTPUT_FOLDERS = [
+    'all', 'horiz', 'verti', 'floormap', 'subsampled',
+    'direction_0', 'direction_1', 'direction_2', 'direction_3'
+]
+
+
+def clear_outputs(folder):
+    '''
+    remove outputs of previous runs under `folder`
+    '''
+    for fp in glob.glob("{}/*_sig".format(folder)):
+        if os.path.isdir(fp):
+            shutil.rmtree(fp)
+    for fp in glob.glob("{}/*.pickle".format(folder)) + glob.glob("{}/*.png".format(folder)):
+        os.remove(fp)
+
+
+def dump_device_maps(
+    filepaths,
+    orientation,
+    gts,
+    output,
+    move_to_folder,
+    prefix,
+    sampling_num=50,
+    map_dim=None,
+    map_res=None,
+    output_map=True,
+    seed=None,
+    batch_sampling=True,
+    stack_samples=False,
+    writer=None
+):
+    '''
+    write normal, per-direction and subsampled maps of all device files,
+    with `batch_sampling` all samples of a device are drawn at once; maps
+    go to the shards of `writer` instead of pickles if given
+    returns the number of maps and the written filepaths
+    '''
+    num_maps = 0
+    out_files = []
+    for dev_idx, filepath in enumerate(filepaths):
+        print("parsing file: {}".format(filepath))
+        basename = os.path.basename(filepath)
+        labels = gts.get(os.path.splitext(basename)[0], None)
+        pkt_type, data = load_rss_points(filepath, orientation)
+        grid = RssGrid(data, map_dim, map_res)
+
+        # normal maps go to horizontal/vertical and all
+        out_fps = dump_rss_maps(
+            grid, filepath, pkt_type,
+            labels=labels,
+            output_map=output_map,
+            out_fp="{}/{}_{}".format(move_to_folder, prefix, basename),
+            writer=writer
+        )
+        for fp in map_outputs(out_fps):
+            shutil.copy(fp, "{}_all/".format(output))
+            out_files.append("{}_all/{}".format(output, os.path.basename(fp)))
+
+        # moving directions along the orientation
+        for fff in [orientation % 2, orientation % 2 + 2]:
+            out_fps += dump_rss_maps(
+                grid, filepath, pkt_type,
+                labels=labels,
+                output_map=output_map,
+                filters=fff,
+                out_fp="{}_direction_{}/{}_{}".format(output, fff, prefix, basename),
+                writer=writer
+            )
+
+        if batch_sampling:
+            out_fps += dump_rss_samples(
+                grid, filepath, pkt_type, sampling_num,
+                labels=labels,
+                output_map=output_map,
+                stack=stack_samples,
+                rng=np.random.RandomState(batch_seed(seed, dev_idx)),
+                out_fp="{}_subsampled/{}_{}".format(output, prefix, basename),
+                writer=writer
+            )
+        for rep in range(0 if batch_sampling else sampling_num):
+            if seed is not None:
+                np.random.seed(sampling_seed(seed, dev_idx, rep))
+            out_fps += dump_rss_maps(
+                grid, filepath, pkt_type,
+                labels=labels,
+                output_map=output_map,
+                sampling=True,
+                out_fp="{}_subsampled/{}_{}".format(output, prefix, basename),
+                writer=writer,
+                sample=rep
+            )
+        num_maps += len(out_fps)
+        out_files += map_outputs(out_fps)
+    if writer is not None:
+        num_maps = writer.count
+    return num_maps, out_files
+
+
+def process_folder(
+    folder,
+    output,
+    sampling_num=50,
+    minimalCounts=5000,
+    map_dim=None,
+    map_res=None,
+    output_map=True,
+    seed=None,
+    cache=True,
+    pcap_reader=None,
+    batch_sampling=True,
+    stack_samples=False,
+    shards=False
+):
+    '''
+    parse one experiment folder and write its floormap, normal, subsampled
+    and per-direction maps straight into the `output`_* folders; with
+    `cache`, stages whose inputs and arguments did not change get skipped;
+    with `shards`, maps go into `output`_shards instead of pickles
+    returns timing summary of the folder
+    '''
+    summary = {'folder': folder, 'status': 'done', 'devices': 0, 'maps': 0}
+    if map_dim is None:
+        map_dim = (PICKLE_MAP_SIZE, PICKLE_MAP_SIZE)
+    if map_res is None:
+        map_res = PICKLE_MAP_STEP
+    orient = os.path.basename(folder.rstrip('/')).split('_')[-1]
+    if orient in ['0', '2']:
+        move_to_folder = "{}_horiz".format(output)
+    elif orient in ['1', '3']:
+        move_to_folder = "{}_verti".format(output)
+    else:
+        summary['status'] = 'skipped'
+        return summary
+    orientation = int(orient)
+    prefix = "_".join(os.path.basename(folder.rstrip('/')).split('_')[:3])
+
+    start = time.time()
+    if not cache:
+        clear_outputs(folder)
+    stage_cache = StageCache(folder, enabled=cache)
+    f_map, f_loc, f_sig, f_gt, is_csi = get_files(folder)
+    if f_loc is None or f_sig is None:
+        summary['status'] = 'missing required files'
+        return summary
+    if is_csi:
+        summary['status'] = 'csi not supported'
+        return summary
+
+    f_sig_extracted, minmax_xys = prepare_sig(
+        stage_cache, f_sig, f_loc, is_csi,
+        minimalCounts=minimalCounts,
+        reader=pcap_reader
+    )
+    gts = get_groundtruth_dict(f_gt)
+    gt_inputs = [] if f_gt is None else [f_gt]
+    params = {
+        'orientation': orientation,
+        'output': os.path.abspath(output),
+        'output_map': output_map,
+        'dimension': list(map_dim),
+        'resolution': map_res,
+    }
+    summary['prepare'] = time.time() - start
+
+    start = time.time()
+    if f_map is not None:
+        def floormap():
+            return None, build_map(
+                f_map,
+                orientation,
+                minmax_xys,
+                markers=gts,
+                output_map=output_map,
+                map_dim=map_dim,
+                map_res=map_res,
+                out_fp="{}_floormap/{}_floormap".format(output, prefix)
+            )
+        stage_cache.run('batch_floormap', [f_map], dict(params, minmax_xys=minmax_xys), floormap)
+    summary['floormap'] = time.time() - start
+
+    start = time.time()
+
+    def maps():
+        writer = None
+        if shards:
+            session = os.path.basename(folder.rstrip('/'))
+            writer = ShardWriter(
+                "{}_shards".format(output), session,
+                session=session,
+                orientation=orientation
+            )
+        num_maps, out_files = dump_device_maps(
+            f_sig_extracted, orientation, gts, output, move_to_folder, prefix,
+            sampling_num=sampling_num,
+            map_dim=map_dim,
+            map_res=map_res,
+            output_map=output_map,
+            seed=seed,
+            batch_sampling=batch_sampling,
+            stack_samples=stack_samples,
+            writer=writer
+        )
+        if writer is not None:
+            out_files += writer.close()
+        return num_maps, out_files
+    summary['maps'] = stage_cache.run(
+        'batch_maps',
+        f_sig_extracted + gt_inputs,
+        dict(
+            params,
+            sampling_num=sampling_num,
+            seed=seed,
+            batch_sampling=batch_sampling,
+            stack_samples=stack_samples,
+            shards=shards
+        ),
+        maps
+    )
+    summary['devices'] = len(f_sig_extracted)
+    summary['maps_time'] = time.time() - start
+    return summary
+
+
+def _init_worker():
+    # Ctrl-C is handled by the parent, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _run_folder(task):
+    folder, output, kwargs, log_file = task
+    start = time.time()
+    with open(log_file, 'a') as log, contextlib.redirect_stdout(log):
+        print("processing folder: {}..".format(folder))
+        try:
+            summary = process_folder(folder, output, **kwargs)
+        except Exception as e:
+            print("Err: {}".format(e))
+            summary = {'folder': folder, 'status': 'Err: {}'.format(e)}
+    summary['total'] = time.time() - start
+    return summary
+
+
+def print_summary(summaries):
+    print("{:<40} {:>8} {:>8} {:>8} {:>8} {:>9} {:>8}  {}".format(
+        'folder', 'devices', 'maps', 'prepare', 'floor', 'maps(s)', 'total', 'status'
+    ))
+    for s in sorted(summaries, key=lambda s: s['folder']):
+        print("{:<40} {:>8} {:>8} {:>8.1f} {:>8.1f} {:>9.1f} {:>8.1f}  {}".format(
+            os.path.basename(s['folder'])[-40:],
+            s.get('devices', 0),
+            s.get('maps', 0),
+            s.get('prepare', 0.0),
+            s.get('floormap', 0.0),
+            s.get('maps_time', 0.0),
+            s.get('total', 0.0),
+            s['status']
+        ))
+
+
+def main(args):
+    if not os.path.isdir(args.folder):
+        print("cannot find directory: '{}'".format(args.folder))
+        sys.exit(2)
+    for suffix in OUTPUT_FOLDERS:
+        os.makedirs("{}_{}".format(args.output, suffix), exist_ok=True)
+
+    folders = sorted(
+        fp for fp in glob.glob("{}/*".format(args.folder.rstrip('/')))
+        if os.path.isdir(fp)
+    )
+    kwargs = {
+        'sampling_num': args.sampling_num,
+        'minimalCounts': args.minimal_counts,
+        'map_dim': args.dimension,
+        'map_res': args.resolution,
+        'output_map': not args.no_images,
+        'seed': args.seed,
+        'cache': not args.no_cache,
+        'pcap_reader': args.pcap_reader,
+        'batch_sampling': not args.sequential_sampling,
+        'stack_samples': args.stack_samples,
+        'shards': args.shards,
+    }
+    tasks = [(folder, args.output, kwargs, args.log) for folder in folders]
+
+    summaries = []
+    pool = mp.Pool(processes=args.jobs, initializer=_init_worker)
+    try:
+        for summary in pool.imap_unordered(_run_folder, tasks):
+            print("{}: {} in {:.1f}s".format(summary['folder'], summary['status'], summary['total']))
+            summaries.append(summary)
+        pool.close()
+    except KeyboardInterrupt:
+        print("KeyboardInterrupt happened")
+        pool.terminate()
+    finally:
+        pool.join()
+    print_summary(summaries)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Batch Data Pre-Processor'
+    )
+    parser.add_argument(
+        dest='folder',
+        help='Specify folder path of experiment folders, each ends with `_<orientation>`'
+    )
+    parser.add_argument(
+        dest='output',
+        help='Specify output folder path prefix, outputs go to `<output>_all`, `<output>_horiz`, ..'
+    )
+    parser.add_argument(
+        dest='sampling_num',
+        nargs='?',
+        type=int,
+        default=50,
+        help='Specify the number of random samples performed, default 50'
+    )
+    parser.add_argument(
+        '--jobs', '-j',
+        dest='jobs',
+        type=int,
+        default=os.cpu_count(),
+        help='Specify number of folders processed in parallel, default number of cpus'
+    )
+    parser.add_argument(
+        '--minimal-counts',
+        dest='minimal_counts',
+        type=int,
+        default=5000,
+        help='Specify minimal number of packets of a device to keep it'
+    )
+    parser.add_argument(
+        '--seed',
+        dest='seed',
+        type=int,
+        default=None,
+        help='Specify random seed of subsampling for reproducible maps'
+    )
+    parser.add_argument(
+        '--sequential-sampling',
+        dest='sequential_sampling',
+        action='store_true',
+        default=False,
+        help='Draw the random samples map by map like preprocessor.py does by default, instead of all at once'
+    )
+    parser.add_argument(
+        '--stack-samples',
+        dest='stack_samples',
+        action='store_true',
+        default=False,
+        help='Write the random samples of each device as one stacked `_samples<N>` pickle'
+    )
+    parser.add_argument(
+        '--shards',
+        dest='shards',
+        action='store_true',
+        default=False,
+        help='Append maps with labels and metadata into `.npy` shards under `<output>_shards` instead of writing pickles'
+    )
+    parser.add_argument(
+        '--no-images',
+        dest='no_images',
+        action='store_true',
+        default=False,
+        help='Disable dumping png images of the maps'
+    )
+    parser.add_argument(
+        '--pcap-reader',
+        dest='pcap_reader',
+        choices=PCAP_READERS,
+        default=None,
+        help='Specify how to read rss pcap files, default tshark if installed, otherwise native'
+    )
+    parser.add_argument(
+        '--no-cache',
+        dest='no_cache',
+        action='store_true',
+        default=False,
+        help='Disable skipping unchanged stages, clears previous outputs of each folder and redoes all'
+    )
+    parser.add_argument(
+        '--log',
+        dest='log',
+        default=LOG_FILE,
+        help='Specify log file path, default {}'.format(LOG_FILE)
+    )
+    parser.add_argument(
+        '--dimension',
+        dest='dimension',
+        default=None,
+        help='Specify dimension/size of the map via `--dimension="width height"`, default 64x64'
+    )
+    parser.add_argument(
+        '--resolution', '-res',
+        dest='resolution',
+        type=float,
+        default=0.1,
+        help='Specify resolution of the map, default 0.1m'
+    )
+    args, __ = parser.parse_known_args()
+
+    try:
+        if args.dimension is not None:
+            args.dimension = [int(x) for x in args.dimension.split(" ")]
+    except BaseException:
+        print("err parsing dimension..")
+        exit(2)
+
+    main(args)
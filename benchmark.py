@@ -0,0 +1,254 @@
+#!/usr/bin/python
+
+import os
+import sys
+import json
+import time
+import pickle
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import numpy as np
+
+from libs.instrument import Instrument
+from libs.synthetic import synth_session
+from libs.parser_post import build_map
+from libs.parser_post import translate_pcap
+from libs.parser_post import combine_sig_loc
+from libs.parser_post import estimate_orientation
+from libs.parser_post import convert_to_pickle_rss
+from libs.parser_post import extract_dev_from_combined
+from libs.parser_post import PICKLE_MAP_SIZE
+
+
+SIZES = [1000, 10000, 100000]  # packets per device
+THRESHOLD = 0.2  # slowdown of a stage flagged as a regression
+MIN_DELTA = 0.05  # seconds a stage has to slow down by to count, against timer noise
+
+
+def run_stages(folder, name, instrument, orientation=0):
+    '''
+    run the processing stages over the synthetic session `name` in
+    `folder` like preprocessor.py --pickle --map does, one instrument
+    stage each
+    '''
+    f_map = os.path.join(folder, "{}_map.ppm".format(name))
+    f_loc = os.path.join(folder, "{}_loc.csv".format(name))
+    f_sig = os.path.join(folder, "{}.pcap".format(name))
+    with instrument.stage('translate_pcap', [f_sig]) as stage:
+        f_sig_parsed = translate_pcap(f_sig, False, reader='native')
+        stage.outputs([f_sig_parsed])
+    with instrument.stage('combine_sig_loc', [f_sig_parsed, f_loc]) as stage:
+        f_sig_combined, minmax_xys = combine_sig_loc(f_sig_parsed, f_loc)
+        stage.outputs([f_sig_combined])
+    with instrument.stage('extract_dev_from_combined', [f_sig_combined]) as stage:
+        f_sig_extracted = extract_dev_from_combined(f_sig_combined)
+        stage.outputs(f_sig_extracted)
+    with instrument.stage('convert_to_pickle_rss', f_sig_extracted) as stage:
+        for fp in f_sig_extracted:
+            stage.outputs(
+                "{}.pickle".format(out_fp) for out_fp in convert_to_pickle_rss(fp, orientation)
+            )
+    with instrument.stage('build_map', [f_map]) as stage:
+        f_floormap = build_map(f_map, orientation, minmax_xys)
+        stage.outputs(f_floormap)
+    with open(f_floormap[0], 'rb') as f:
+        reflections = pickle.load(f)[1]
+    with instrument.stage('estimate_orientation'):
+        estimate_orientation((PICKLE_MAP_SIZE, PICKLE_MAP_SIZE), reflections)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(sizes, devices, duration, repeats, workdir):
+    '''
+    time each stage over a synthetic session of each of `sizes` packets
+    per device, keeping the fastest of `repeats` runs over a fresh copy
+    returns {size: {stage: record}} with the records of Instrument
+    '''
+    results = {}
+    for size in sizes:
+        name = "synth_{}".format(size)
+        source = os.path.join(workdir, "{}_orient_0".format(name))
+        synth_session(source, name=name, devices=devices, packets=size, duration=duration)
+        best = {}
+        for i in range(repeats):
+            folder = os.path.join(workdir, "run_orient_0")
+            shutil.rmtree(folder, ignore_errors=True)
+            shutil.copytree(source, folder)
+            instrument = Instrument(enabled=True)
+            run_stages(folder, name, instrument)
+            for record in instrument.records:
+                kept = best.get(record['stage'])
+                if kept is None or record['wall_s'] < kept['wall_s']:
+                    best[record['stage']] = record
+            shutil.rmtree(folder)
+        shutil.rmtree(source)
+        results[str(size)] = best
+        print("{} packets x {} devices:".format(size, devices))
+        for stage, record in best.items():
+            print("  {:<28} {:>8.3f}s".format(stage, record['wall_s']))
+    return results
+
+
+def compare(base, new, threshold=THRESHOLD, min_delta=MIN_DELTA):
+    '''
+    print the wall time of each stage and size of benchmark `new` against
+    `base`, flagging the ones slower by more than `threshold` and
+    `min_delta` seconds
+    returns the flagged (size, stage)
+    '''
+    regressions = []
+    print("{:>8} {:<28} {:>9} {:>9} {:>8}".format("size", "stage", "base(s)", "new(s)", "change"))
+    for size, stages in new['results'].items():
+        for stage, record in stages.items():
+            kept = base['results'].get(size, {}).get(stage)
+            if kept is None:
+                print("{:>8} {:<28} {:>9} {:>9.3f} {:>8}".format(size, stage, "-", record['wall_s'], "new"))
+                continue
+            change = record['wall_s'] / max(kept['wall_s'], 1e-9) - 1
+            slower = change > threshold and record['wall_s'] - kept['wall_s'] > min_delta
+            if slower:
+                regressions.append((size, stage))
+            print("{:>8} {:<28} {:>9.3f} {:>9.3f} {:>+7.0f}%{}".format(
+                size, stage, kept['wall_s'], record['wall_s'], change * 100,
+                "  REGRESSION" if slower else ""
+            ))
+    if base['meta'].get('machine') != new['meta'].get('machine'):
+        print("Err: benchmarks ran on different machines, {} vs {}".format(
+            base['meta'].get('machine'), new['meta'].get('machine')
+        ))
+    print("{} regression(s) over {:.0f}% and {}s".format(len(regressions), threshold * 100, min_delta))
+    return regressions
+
+
+def load(fp):
+    with open(fp) as f:
+        return json.load(f)
+
+
+def main(args):
+    if args.compare:
+        regressions = compare(load(args.compare[0]), load(args.compare[1]), args.threshold, args.min_delta)
+        sys.exit(1 if regressions else 0)
+
+    workdir = tempfile.mkdtemp(prefix="benchmark_")
+    try:
+        results = benchmark(args.sizes, args.devices, args.duration, args.repeats, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    report = {
+        'meta': {
+            'started': time.time(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': "{} {} x{}".format(platform.node(), platform.machine(), os.cpu_count()),
+            'devices': args.devices,
+            'duration': args.duration,
+            'repeats': args.repeats,
+        },
+        'results': results,
+    }
+    tmp_fp = "{}.tmp".format(args.output)
+    with open(tmp_fp, 'w') as f:
+        json.dump(report, f, indent=1)
+    os.replace(tmp_fp, args.output)
+    print("Benchmark saved to {}".format(args.output))
+
+    if args.baseline:
+        regressions = compare(load(args.baseline), report, args.threshold, args.min_delta)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the processing stages over synthetic sessions'
+    )
+
+    parser.add_argument(
+        '-o', '--output',
+        dest='output',
+        default='benchmark.json',
+        help='Specify file to save the results to'
+    )
+
+    parser.add_argument(
+        '--sizes',
+        dest='sizes',
+        type=int,
+        nargs='+',
+        default=SIZES,
+        help='Specify packets per device of each session, e.g. 1000 10000'
+    )
+
+    parser.add_argument(
+        '--devices',
+        dest='devices',
+        type=int,
+        default=4,
+        help='Specify number of access points'
+    )
+
+    parser.add_argument(
+        '--duration',
+        dest='duration',
+        type=float,
+        default=600.0,
+        help='Specify seconds of each session'
+    )
+
+    parser.add_argument(
+        '-n', '--repeats',
+        dest='repeats',
+        type=int,
+        default=3,
+        help='Specify runs of each size, the fastest is kept'
+    )
+
+    parser.add_argument(
+        '--baseline',
+        dest='baseline',
+        default=None,
+        help='Specify earlier results to compare against, exits 1 on regressions'
+    )
+
+    parser.add_argument(
+        '--compare',
+        dest='compare',
+        nargs=2,
+        default=None,
+        help='Specify base and new results to compare without running, exits 1 on regressions'
+    )
+
+    parser.add_argument(
+        '--threshold',
+        dest='threshold',
+        type=float,
+        default=THRESHOLD,
+        help='Specify slowdown flagged as a regression, e.g. 0.2 for 20%%'
+    )
+
+    parser.add_argument(
+        '--min-delta',
+        dest='min_delta',
+        type=float,
+        default=MIN_DELTA,
+        help='Specify seconds a stage has to slow down by to be flagged'
+    )
+
+    args, __ = parser.parse_known_args()
+
+    main(args)
@@ -0,0 +1,80 @@
+import asyncio
+import argparse
+
+from libs.fleet_controller import FLEET_JOBS, VIEW_INTERVAL
+from libs.fleet_controller import FleetController, load_fleet
+from libs.status_monitor import FAST_INTERVAL
+from libs.status_monitor import REDISCOVER_ERRORS
+
+
+def main(args):
+    controller = FleetController(
+        load_fleet(args.config),
+        jobs=args.jobs,
+        poll_interval=args.poll,
+        view_interval=args.view,
+        max_errors=args.max_errors
+    )
+    try:
+        if args.status:
+            asyncio.run(controller.statuses())
+            print(controller.view())
+            return
+        results = asyncio.run(controller.run(args.output))
+        print("{} of {} sessions completed".format(sum(results), len(results)))
+    except KeyboardInterrupt:
+        print("KeyboardInterrupt")
+    finally:
+        controller.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Fleet Controller'
+    )
+    parser.add_argument(
+        'config',
+        help='Specify fleet config json, a list of {"name", "ip", "token"}'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        dest='output',
+        default='./',
+        help='Specify folder for the downloads, one subfolder per vacuum'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        dest='jobs',
+        type=int,
+        default=FLEET_JOBS,
+        help='Specify number of threads for blocking calls'
+    )
+    parser.add_argument(
+        '--poll',
+        dest='poll',
+        type=float,
+        default=FAST_INTERVAL,
+        help='Specify seconds between status polls of each vacuum around state changes'
+    )
+    parser.add_argument(
+        '--view',
+        dest='view',
+        type=float,
+        default=VIEW_INTERVAL,
+        help='Specify seconds between combined status views'
+    )
+    parser.add_argument(
+        '--max-errors',
+        dest='max_errors',
+        type=int,
+        default=REDISCOVER_ERRORS,
+        help='Specify failed status polls in a row before giving up on a vacuum'
+    )
+    parser.add_argument(
+        '--status',
+        dest='status',
+        action='store_true',
+        help='Only print the status of all vacuums'
+    )
+    args, __ = parser.parse_known_args()
+    main(args)
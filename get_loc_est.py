@@ -1,7 +1,9 @@
 import argparse
 import subprocess
 
+from libs.parser import PoseStreamer
 from libs.parser import get_slam_log
+from libs.parser import parse_stream_address
 
 
 # This script supposes to run ON THE VACUUM
@@ -16,7 +18,24 @@ parser.add_argument(
     dest='filepath',
     help='Specify output file path'
 )
+parser.add_argument(
+    '--binary',
+    dest='binary',
+    action='store_true',
+    help='Write estimates as packed binary trace instead of csv'
+)
+parser.add_argument(
+    '--stream',
+    dest='stream',
+    default=None,
+    help='Specify host:port of the controller to stream estimates to'
+)
 args, __ = parser.parse_known_args()
 
 # fetch slam
-get_slam_log(outputfile=args.filepath)
+get_slam_log(
+    outputfile=args.filepath,
+    keep_data=False,
+    binary=args.binary,
+    stream=PoseStreamer(*parse_stream_address(args.stream)) if args.stream else None
+)
@@ -3,7 +3,8 @@
 REMOTE="root@${MIROBO_IP}"
 EXP_FP="/mnt/data/exp"
 REMOTE_EXP_FP="${REMOTE}:${EXP_FP}"
-REMOTE_CMD="ssh -t ${REMOTE}"
+# MIROBO_SSH_OPTS shares the connection of the controller
+REMOTE_CMD="ssh ${MIROBO_SSH_OPTS} -t ${REMOTE}"
 
 
 echo "IP: ${MIROBO_IP}"
@@ -13,9 +14,9 @@ echo "Create folder on vacuum.."
 ${REMOTE_CMD} mkdir -p ${EXP_FP}/libs
 
 echo "Push files to vacuum to run.."
-scp ./libs/__init__.py ${REMOTE_EXP_FP}/libs/
-scp ./libs/parser.py ${REMOTE_EXP_FP}/libs/
-scp ./get_loc_est.py ${REMOTE_EXP_FP}
+scp ${MIROBO_SSH_OPTS} ./libs/__init__.py ${REMOTE_EXP_FP}/libs/
+scp ${MIROBO_SSH_OPTS} ./libs/parser.py ${REMOTE_EXP_FP}/libs/
+scp ${MIROBO_SSH_OPTS} ./get_loc_est.py ${REMOTE_EXP_FP}
 
 echo "Install necessary packages"
 ${REMOTE_CMD} apt update
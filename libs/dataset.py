@@ -0,0 +1,434 @@
+import os
+import re
+import copy
+import glob
+import json
+import pickle
+from collections import OrderedDict
+
+import numpy as np
+
+
+SHARD_SIZE = 4096  # maps per shard
+INDEX_SUFFIX = ".index.json"
+MAP_INDEX_FILE = ".map_index.json"
+MAP_CACHE_SIZE = 1024  # decoded pickles kept in memory
+# `<prefix>_<mac><_s<id>|_samples<N>>_pkttype_<type>_map<_filter>.pickle`,
+# without prefix next to the device files of preprocessor.py
+MAP_NAME_PATTERN = re.compile(
+    r'^(?:(?P<prefix>.+)_)?(?P<device>[0-9a-f]{12})'
+    r'(?:_s(?P<sample>\d+)|_samples(?P<stack>\d+))?'
+    r'_pkttype_(?P<pkt_type>-?\d+)_map(?:_(?P<filters>\d+))?\.pickle$'
+)
+ORIENT_PATTERN = re.compile(r'_orient_(\d+)$')
+# metadata of each map; filters and sample are -1 for unfiltered and medians
+SHARD_META_DTYPE = np.dtype([
+    ('device', 'U32'),
+    ('pkt_type', '<i4'),
+    ('filters', '<i2'),
+    ('sample', '<i4'),
+    ('session', 'U64'),
+    ('orientation', '<i2'),
+])
+
+
+def meta_record(device, pkt_type, filters=None, sample=None, session='', orientation=-1):
+    '''
+    one row of SHARD_META_DTYPE, None filters/sample become -1
+    '''
+    return (
+        device,
+        pkt_type,
+        -1 if filters is None else filters,
+        -1 if sample is None else sample,
+        session,
+        orientation
+    )
+
+
+class MapBuffer():
+    '''
+    collects (rss_map, labels, meta) records in memory, e.g. in worker
+    processes that hand them over to the ShardWriter of the parent
+    '''
+
+    def __init__(self, session='', orientation=-1):
+        self.session = session
+        self.orientation = orientation
+        self.records = []
+        self.count = 0
+
+    def add(self, rss_map, labels, device, pkt_type, filters=None, sample=None):
+        self.count += 1
+        self.records.append((
+            rss_map, labels,
+            meta_record(device, pkt_type, filters, sample, self.session, self.orientation)
+        ))
+
+
+class ShardWriter(MapBuffer):
+    '''
+    appends maps, labels and metadata into fixed-size `.npy` shards under
+    `folder`; each writer has its own `prefix` and index, so writers of
+    several processes can share one folder
+    '''
+
+    def __init__(self, folder, prefix, session='', orientation=-1, shard_size=SHARD_SIZE, dtype='<f8'):
+        super().__init__(session=session, orientation=orientation)
+        self.folder = folder
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.dtype = np.dtype(dtype)
+        self.shards = []
+        os.makedirs(folder, exist_ok=True)
+        # start over, shards of a previous run are replaced
+        for fp in self.files():
+            os.remove(fp)
+
+    def files(self):
+        shard_pattern = "{}_{}_*.npy".format(glob.escape(self.prefix), "[0-9]" * 5)
+        return glob.glob(os.path.join(self.folder, shard_pattern)) + \
+            glob.glob(os.path.join(self.folder, glob.escape(self.prefix) + INDEX_SUFFIX))
+
+    def add(self, rss_map, labels, device, pkt_type, filters=None, sample=None):
+        super().add(rss_map, labels, device, pkt_type, filters, sample)
+        if len(self.records) >= self.shard_size:
+            self.flush()
+
+    def extend(self, records):
+        '''
+        take over records of a MapBuffer, under the session and orientation
+        of this writer
+        '''
+        for rss_map, labels, meta in records:
+            self.count += 1
+            self.records.append((rss_map, labels, meta[:-2] + (self.session, self.orientation)))
+            if len(self.records) >= self.shard_size:
+                self.flush()
+
+    def flush(self):
+        if not self.records:
+            return
+        name = "{}_{:05d}".format(self.prefix, len(self.shards))
+        maps = np.stack([np.asarray(rss_map, dtype=self.dtype) for rss_map, __, __ in self.records])
+        labels = np.full((len(self.records), 2), np.nan)
+        for i, (__, label, __) in enumerate(self.records):
+            if label is not None:
+                labels[i] = label
+        meta = np.array([meta for __, __, meta in self.records], dtype=SHARD_META_DTYPE)
+        for kind, array in [('maps', maps), ('labels', labels), ('meta', meta)]:
+            np.save(os.path.join(self.folder, "{}_{}.npy".format(name, kind)), array)
+        self.shards.append({'name': name, 'count': len(self.records)})
+        self.records = []
+
+    def close(self):
+        '''
+        write the last shard and the index
+        returns the written filepaths
+        '''
+        self.flush()
+        with open(os.path.join(self.folder, self.prefix + INDEX_SUFFIX), 'w') as f:
+            json.dump({'shards': self.shards}, f, indent=1)
+        return self.files()
+
+
+class ShardReader():
+    '''
+    random access to the maps of all shards under `folder` through memory
+    maps, shards are only opened when one of their maps is read
+    '''
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.shards = []
+        for index_fp in sorted(glob.glob(os.path.join(folder, "*" + INDEX_SUFFIX))):
+            with open(index_fp) as f:
+                self.shards += json.load(f)['shards']
+        self.offsets = np.cumsum([0] + [shard['count'] for shard in self.shards])
+        self.opened = {}
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def _shard(self, shard_idx, kind):
+        key = (shard_idx, kind)
+        if key not in self.opened:
+            self.opened[key] = np.load(
+                os.path.join(self.folder, "{}_{}.npy".format(self.shards[shard_idx]['name'], kind)),
+                mmap_mode='r'
+            )
+        return self.opened[key]
+
+    def locate(self, idx):
+        '''
+        (shard, row) of map `idx`
+        '''
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("map index out of range")
+        shard_idx = int(np.searchsorted(self.offsets, idx, side='right')) - 1
+        return shard_idx, idx - int(self.offsets[shard_idx])
+
+    def __getitem__(self, idx):
+        '''
+        (rss_map, labels, meta) of map `idx`, labels being None without
+        groundtruth like in the pickles
+        '''
+        shard_idx, row = self.locate(idx)
+        labels = np.array(self._shard(shard_idx, 'labels')[row])
+        if np.isnan(labels).all():
+            labels = None
+        return np.array(self._shard(shard_idx, 'maps')[row]), labels, self._shard(shard_idx, 'meta')[row]
+
+    def meta(self):
+        '''
+        metadata of all maps, for selecting indexes without touching maps
+        '''
+        if not self.shards:
+            return np.zeros(0, dtype=SHARD_META_DTYPE)
+        return np.concatenate([self._shard(i, 'meta') for i in range(len(self.shards))])
+
+
+def parse_map_name(dirpath, name):
+    '''
+    index fields (device, pkt_type, filters, sample, session, orientation,
+    stack size) of the map pickle `name` in `dirpath`, None if it is no map;
+    session is the file prefix of batch_parse.py or else the nearest
+    `*_orient_<n>` folder, the orientation is unknown (-1) if neither ends
+    with it
+    '''
+    match = MAP_NAME_PATTERN.match(name)
+    if match is None:
+        return None
+    session = match.group('prefix')
+    if session is None:
+        parts = dirpath.split(os.sep)
+        session = next(
+            (part for part in reversed(parts) if ORIENT_PATTERN.search(part)),
+            parts[-1]
+        )
+    orient = ORIENT_PATTERN.search(session)
+    return [
+        match.group('device'),
+        int(match.group('pkt_type')),
+        -1 if match.group('filters') is None else int(match.group('filters')),
+        -1 if match.group('sample') is None else int(match.group('sample')),
+        session,
+        -1 if orient is None else int(orient.group(1)),
+        0 if match.group('stack') is None else int(match.group('stack')),
+    ]
+
+
+def session_orientations(names):
+    '''
+    {batch_parse.py file prefix: orientation} of the experiment folders
+    among `names`, each `<prefix>_<n>` with the orientation dropped from
+    its prefix; prefixes of folders of several orientations are left out
+    '''
+    found = {}
+    for name in names:
+        orient = ORIENT_PATTERN.search(name)
+        if orient is not None:
+            prefix = "_".join(name.split('_')[:3])
+            found.setdefault(prefix, set()).add(int(orient.group(1)))
+    return {prefix: orients.pop() for prefix, orients in found.items() if len(orients) == 1}
+
+
+class MapDataset():
+    '''
+    lazy random access to the map pickles under `folder`, e.g. the parent of
+    the `<output>_*` folders of batch_parse.py; the index of the file names
+    is kept in `folder`/.map_index.json and only folders whose mtime changed
+    get listed again; stacked `_samples<N>` pickles count as N maps; decoded
+    pickles stay in a LRU cache of `cache_size` entries
+    batch outputs get the orientation of their experiment folder found
+    under `folder`, or else in `sessions` if given
+    '''
+
+    def __init__(self, folder, cache_size=MAP_CACHE_SIZE, sessions=None):
+        self.folder = folder
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.index_fp = os.path.join(folder, MAP_INDEX_FILE)
+        known = {}
+        if os.path.isfile(self.index_fp):
+            try:
+                with open(self.index_fp) as f:
+                    known = json.load(f)
+            except ValueError:
+                print("Err: ignore broken map index {}".format(self.index_fp))
+        self.index = {}
+        self._scan('', known)
+        if self.index != known:
+            self._save()
+
+        names = [subdir for record in self.index.values() for subdir in record['subdirs']]
+        if sessions is not None:
+            names += os.listdir(sessions)
+        orientations = session_orientations(names)
+
+        self.paths = []
+        self.rows = []
+        self.folders = []
+        metas = []
+        for rel_dir in sorted(self.index):
+            for entry in self.index[rel_dir]['maps']:
+                name, fields, stack = entry[0], entry[1:-1], entry[-1]
+                if fields[5] < 0:
+                    fields = fields[:5] + [orientations.get(fields[4], -1)]
+                for row in range(stack) if stack else [-1]:
+                    self.paths.append(os.path.join(rel_dir, name))
+                    self.rows.append(row)
+                    self.folders.append(os.path.basename(rel_dir))
+                    # samples of a stack are numbered by their row
+                    metas.append(tuple(fields[:3]) + (fields[3] if row < 0 else row,) + tuple(fields[4:]))
+        self._meta = np.array(metas, dtype=SHARD_META_DTYPE)
+        self.folders = np.array(self.folders, dtype=str)
+        self.idxs = np.arange(len(self.paths))
+
+    def _scan(self, rel_dir, known):
+        dirpath = os.path.join(self.folder, rel_dir)
+        mtime = os.stat(dirpath).st_mtime_ns
+        record = known.get(rel_dir)
+        if record is None or record['mtime'] != mtime:
+            record = {'mtime': mtime, 'subdirs': [], 'maps': []}
+            with os.scandir(dirpath) as it:
+                for entry in sorted(it, key=lambda x: x.name):
+                    if entry.is_dir():
+                        record['subdirs'].append(entry.name)
+                        continue
+                    fields = parse_map_name(os.path.abspath(dirpath), entry.name)
+                    if fields is not None:
+                        record['maps'].append([entry.name] + fields)
+        self.index[rel_dir] = record
+        for subdir in record['subdirs']:
+            self._scan(os.path.join(rel_dir, subdir), known)
+
+    def _save(self):
+        tmp_fp = "{}.tmp".format(self.index_fp)
+        try:
+            with open(tmp_fp, 'w') as f:
+                json.dump(self.index, f)
+            os.replace(tmp_fp, self.index_fp)
+        except OSError as e:
+            print("Err: cannot save map index {}: {}".format(self.index_fp, e))
+
+    def select(self, session=None, orientation=None, filters=None, device=None, folder=None):
+        '''
+        a view of the maps matching all given criteria, each one value or a
+        list of values; `device` is the MAC, `folder` the name of the folder
+        holding the map, e.g. `<output>_horiz`
+        '''
+        mask = np.ones(len(self.idxs), dtype=bool)
+        for column, values in [
+            (self._meta['session'], session),
+            (self._meta['orientation'], orientation),
+            (self._meta['filters'], filters),
+            (self._meta['device'], device),
+            (self.folders, folder),
+        ]:
+            if values is None:
+                continue
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+            mask &= np.isin(column[self.idxs], values)
+        view = copy.copy(self)
+        view.idxs = self.idxs[mask]
+        return view
+
+    def __len__(self):
+        return len(self.idxs)
+
+    def _load(self, path):
+        if path in self.cache:
+            self.cache.move_to_end(path)
+            return self.cache[path]
+        with open(os.path.join(self.folder, path), 'rb') as f:
+            content = pickle.load(f)
+        self.cache[path] = content
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return content
+
+    def __getitem__(self, idx):
+        '''
+        (rss_map, labels, meta) of map `idx` of this view, like ShardReader
+        '''
+        idx = self.idxs[idx]
+        rss_map, labels = self._load(self.paths[idx])
+        if self.rows[idx] >= 0:
+            rss_map = rss_map[self.rows[idx]]
+        return rss_map, labels, self._meta[idx]
+
+    def meta(self):
+        '''
+        metadata of all maps of this view, without loading any
+        '''
+        return self._meta[self.idxs]
+
+
+def test(args):
+    import time
+    start = time.time()
+    if args.pickles:
+        reader = MapDataset(args.folder, sessions=args.sessions)
+        print("indexed {} maps in {:.3f}s".format(len(reader), time.time() - start))
+    else:
+        reader = ShardReader(args.folder)
+        print("{} maps in {} shards".format(len(reader), len(reader.shards)))
+    if not len(reader):
+        return
+    meta = reader.meta()
+    for name in ['device', 'pkt_type', 'filters', 'session', 'orientation']:
+        values, counts = np.unique(meta[name], return_counts=True)
+        print("{}: {}".format(name, dict(zip(values.tolist(), counts.tolist()))))
+    unknown = int((meta['orientation'] < 0).sum())
+    if unknown:
+        print("{} maps of unknown orientation, their experiment folders are not under {}{}".format(
+            unknown, args.folder, "" if args.sessions is None else " or {}".format(args.sessions)
+        ))
+    idxs = np.random.RandomState(0).randint(0, len(reader), args.reads)
+    start = time.time()
+    for idx in idxs:
+        reader[idx]
+    print("{:.0f} random reads/s".format(len(idxs) / (time.time() - start)))
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='sharded or pickled dataset test'
+    )
+
+    parser.add_argument(
+        dest='folder',
+        help='Specify folder path of the shards, or of the map pickles with --pickles'
+    )
+
+    parser.add_argument(
+        '--pickles',
+        dest='pickles',
+        action='store_true',
+        default=False,
+        help='Enable to read the map pickles under the folder instead of shards'
+    )
+
+    parser.add_argument(
+        '--sessions',
+        dest='sessions',
+        default=None,
+        help='Specify folder of the experiment folders giving batch outputs their orientation, with --pickles'
+    )
+
+    parser.add_argument(
+        '--reads',
+        dest='reads',
+        type=int,
+        default=10000,
+        help='Specify number of random reads to time'
+    )
+
+    args, __ = parser.parse_known_args()
+
+    test(args)
@@ -0,0 +1,264 @@
+import time
+import socket
+import struct
+import binascii
+import selectors
+
+
+MIIO_PORT = 54321
+HELLO = bytes.fromhex('21310020ffffffffffffffffffffffffffffffffffffffffffffffffffffffff')
+UNICAST_TIMEOUT = 0.5  # seconds to wait for cached devices to answer
+BROADCAST_TIMEOUT = 5.0  # seconds to wait for any device to answer
+DISCOVERY_TTL = 7 * 24 * 3600  # seconds a sighting is worth probing again
+HIDDEN_TOKENS = ('f' * 32, '0' * 32)  # provisioned devices do not tell their token
+SIOCGIFADDR = 0x8915
+SIOCGIFBRDADDR = 0x8919
+
+
+def parse_hello(data):
+    '''
+    (device id, token) as hex of a hello reply, whose 32 byte header is
+    magic, length, unknown, device id, stamp and checksum, the latter being
+    the token; None if it is not one
+    '''
+    if len(data) < 32 or data[:2] != HELLO[:2]:
+        return None
+    return (
+        binascii.hexlify(data[8:12]).decode(),
+        binascii.hexlify(data[16:32]).decode()
+    )
+
+
+def broadcast_addresses():
+    '''
+    (local ip, broadcast address) of each ipv4 interface except loopback,
+    only the limited broadcast where interfaces cannot be listed
+    '''
+    try:
+        import fcntl
+    except ImportError:
+        return [('', '<broadcast>')]
+    addresses = []
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for __, name in socket.if_nameindex():
+            ifreq = struct.pack('256s', name.encode()[:15])
+            try:
+                ip = socket.inet_ntoa(fcntl.ioctl(s.fileno(), SIOCGIFADDR, ifreq)[20:24])
+                broadcast = socket.inet_ntoa(fcntl.ioctl(s.fileno(), SIOCGIFBRDADDR, ifreq)[20:24])
+            except OSError:
+                continue
+            if ip.startswith('127.') or broadcast == '0.0.0.0':
+                continue
+            addresses.append((ip, broadcast))
+    finally:
+        s.close()
+    return addresses or [('', '<broadcast>')]
+
+
+def probe(targets, timeout, expected=None, port=MIIO_PORT):
+    '''
+    send the hello handshake to each (local ip, address) of `targets` at
+    once, one socket per local ip, and collect the replies for `timeout`
+    seconds or until device `expected` answers; unicast `targets` are done
+    as soon as each address answered
+    returns [(ip, device id, token)] in the order of the replies
+    '''
+    selector = selectors.DefaultSelector()
+    sockets = {}
+    seen = []
+    pending = set(address for __, address in targets)
+    try:
+        for local_ip, address in targets:
+            if local_ip not in sockets:
+                s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                s.setblocking(False)
+                try:
+                    s.bind((local_ip, 0))
+                except OSError as e:
+                    print("Err: cannot listen on {}: {}".format(local_ip, e))
+                    s.close()
+                    continue
+                sockets[local_ip] = s
+                selector.register(s, selectors.EVENT_READ)
+            try:
+                sockets[local_ip].sendto(HELLO, (address, port))
+            except OSError as e:
+                print("Err: cannot reach {}: {}".format(address, e))
+        deadline = time.time() + timeout
+        while sockets and time.time() < deadline:
+            for key, __ in selector.select(timeout=deadline - time.time()):
+                try:
+                    data, addr = key.fileobj.recvfrom(1024)
+                except OSError:
+                    continue
+                reply = parse_hello(data)
+                if reply is None or addr[0] in [ip for ip, __, __ in seen]:
+                    continue
+                seen.append((addr[0], reply[0], reply[1]))
+                # broadcast addresses never answer themselves
+                pending.discard(addr[0])
+                if reply[0] == expected or not pending:
+                    return seen
+    finally:
+        for s in sockets.values():
+            s.close()
+        selector.close()
+    return seen
+
+
+class DiscoveryCache():
+    '''
+    sightings of devices kept in `config` under `devices` as
+    {device id: {ip, token, seen}}, worth probing for `discovery_ttl`
+    seconds (default DISCOVERY_TTL) after they were last seen
+    '''
+
+    def __init__(self, config):
+        self.config = config
+        self.devices = config.setdefault("devices", {})
+
+    def ttl(self):
+        return float(self.config.get("discovery_ttl", DISCOVERY_TTL))
+
+    def fresh(self):
+        '''
+        {device id: sighting} seen within the ttl
+        '''
+        now = time.time()
+        return {
+            device_id: sighting for device_id, sighting in self.devices.items()
+            if now - sighting.get("seen", 0) < self.ttl()
+        }
+
+    def add(self, seen):
+        '''
+        record the [(ip, device id, token)] `seen`, keeping the cached
+        token of devices that hide it
+        returns them with the known tokens
+        '''
+        now = time.time()
+        known = []
+        for ip, device_id, token in seen:
+            sighting = self.devices.get(device_id, {})
+            if token in HIDDEN_TOKENS and sighting.get("token"):
+                token = sighting["token"]
+            self.devices[device_id] = {"ip": ip, "token": token, "seen": now}
+            known.append((ip, device_id, token))
+        return known
+
+
+def discover_devices(
+    cache,
+    expected=None,
+    ips=(),
+    unicast_timeout=UNICAST_TIMEOUT,
+    broadcast_timeout=BROADCAST_TIMEOUT,
+    port=MIIO_PORT
+):
+    '''
+    devices answering the hello handshake: first the fresh ones of `cache`
+    and `ips` by unicast, then, unless device `expected` (or any device if
+    none is expected) answered, everyone by broadcast on all interfaces
+    returns [(ip, device id, token)] with `expected` first, recorded in
+    `cache`
+    '''
+    targets = set(ips)
+    targets.update(sighting["ip"] for sighting in cache.fresh().values())
+    seen = []
+    if targets:
+        seen = probe([('', ip) for ip in sorted(targets)], unicast_timeout, expected, port)
+    device_ids = [device_id for __, device_id, __ in seen]
+    if not seen or (expected is not None and expected not in device_ids):
+        print("Broadcasting to find devices..")
+        for sighting in probe(broadcast_addresses(), broadcast_timeout, expected, port):
+            if sighting[1] not in device_ids:
+                seen.append(sighting)
+    seen.sort(key=lambda sighting: sighting[1] != expected)
+    return cache.add(seen)
+
+
+class FakeDevice():
+    '''
+    answers hello handshakes on localhost like a vacuum would
+    '''
+
+    def __init__(self, device_id="0a1b2c3d", token="00112233445566778899aabbccddeeff", port=MIIO_PORT):
+        import threading
+        self.reply = (
+            HELLO[:4] + b'\x00' * 4 + bytes.fromhex(device_id) +
+            struct.pack('>I', int(time.time())) + bytes.fromhex(token)
+        )
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', port))
+        self.sock.settimeout(0.2)
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        while not self.stopping.is_set():
+            try:
+                data, addr = self.sock.recvfrom(1024)
+            except socket.timeout:
+                continue
+            if data == HELLO:
+                self.sock.sendto(self.reply, addr)
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+        self.sock.close()
+
+
+def test(args):
+    print("interfaces: {}".format(broadcast_addresses()))
+    device = FakeDevice(port=args.port)
+    config = {}
+    cache = DiscoveryCache(config)
+    try:
+        for label, expected in [("cold", None), ("cached", "0a1b2c3d")]:
+            start = time.time()
+            seen = discover_devices(
+                cache, expected, ips=['127.0.0.1'] if label == "cold" else (),
+                broadcast_timeout=args.timeout, port=args.port
+            )
+            print("{}: {} in {:.3f}s".format(label, seen, time.time() - start))
+        # a sighting past the ttl is not probed and the broadcast does not
+        # reach the fake device on localhost
+        config["discovery_ttl"] = 0
+        start = time.time()
+        seen = discover_devices(cache, "0a1b2c3d", broadcast_timeout=args.timeout, port=args.port)
+        print("expired: {} in {:.3f}s".format(seen, time.time() - start))
+    finally:
+        device.stop()
+    print("cache: {}".format(config["devices"]))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='device discovery test with a fake device on localhost'
+    )
+
+    parser.add_argument(
+        '-p', '--port',
+        dest='port',
+        type=int,
+        default=MIIO_PORT,
+        help='Specify port of the fake device'
+    )
+
+    parser.add_argument(
+        '--timeout',
+        dest='timeout',
+        type=float,
+        default=1.0,
+        help='Specify seconds to wait for broadcast replies'
+    )
+
+    args, __ = parser.parse_known_args()
+
+    test(args)
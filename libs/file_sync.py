@@ -0,0 +1,292 @@
+import os
+import zlib
+import hashlib
+import threading
+
+
+SYNC_CHUNK = 1 << 20  # bytes pulled per round trip at most
+SYNC_INTERVAL = 10.0  # seconds between pulls of a growing file
+SYNC_RETRIES = 3  # failed pulls in a row before giving up on finishing
+PART_SUFFIX = ".part"
+MISSING = b"missing\n"  # what `pull_command` prints if there is no file to pull
+
+
+def pull_command(remote_fp, offset, size):
+    '''
+    shell command printing the length and md5 of up to `size` bytes of
+    `remote_fp` from `offset`, then those bytes gzipped; MISSING if there
+    is no `remote_fp`
+    '''
+    # no single quotes, SshConnection.run quotes the command with them
+    return (
+        "[ -f {0} ] || {{ echo missing; exit 0; }}; "
+        "f=/run/shm/xv_sync_$$; tail -c +{1} {0} | head -c {2} > $f; "
+        "wc -c < $f; md5sum < $f; gzip -c $f; rm -f $f"
+    ).format(remote_fp, offset + 1, size)
+
+
+def parse_pull(output):
+    '''
+    bytes in the output of `pull_command`, None if they do not match the
+    length or md5 the vacuum gave
+    '''
+    size, __, rest = output.partition(b"\n")
+    digest, __, compressed = rest.partition(b"\n")
+    try:
+        data = zlib.decompress(compressed, 16 + zlib.MAX_WBITS)
+        size = int(size)
+    except (zlib.error, ValueError) as e:
+        print("Err: bad chunk: {}".format(e))
+        return None
+    if len(data) != size or hashlib.md5(data).hexdigest() != digest.split(b" ")[0].decode():
+        print("Err: chunk of {} bytes does not match its checksum".format(len(data)))
+        return None
+    return data
+
+
+class FileSync():
+    '''
+    keeps `local_fp` a copy of the growing `remote_fp` on the vacuum by
+    pulling only the bytes appended since the last pull, gzipped by the
+    vacuum and checked against its md5, into `local_fp`.part; the part
+    file is resumed after a broken transfer or restart and becomes
+    `local_fp` on `finish`
+    '''
+
+    def __init__(self, connection, remote_fp, local_fp, interval=SYNC_INTERVAL, chunk=SYNC_CHUNK):
+        self.connection = connection
+        self.remote_fp = remote_fp
+        self.local_fp = local_fp
+        self.part_fp = local_fp + PART_SUFFIX
+        self.interval = interval
+        self.chunk = chunk
+        self.offset = os.path.getsize(self.part_fp) if os.path.isfile(self.part_fp) else 0
+        self.verified = self.offset == 0
+        self.transferred = 0  # compressed bytes
+        self.failures = 0
+        self.missing = False  # whether the last pull found no `remote_fp`
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def _verify(self):
+        '''
+        start over if the part file is not the beginning of `remote_fp`
+        '''
+        output = self.connection.run(
+            "[ -f {1} ] && head -c {0} {1} | md5sum".format(self.offset, self.remote_fp)
+        )
+        if output is None:
+            return False
+        with open(self.part_fp, 'rb') as f:
+            digest = hashlib.md5(f.read()).hexdigest()
+        if output.split(" ")[0] != digest:
+            print("Err: {} is not part of {}, starting over".format(self.part_fp, self.remote_fp))
+            open(self.part_fp, 'wb').close()
+            self.offset = 0
+        self.verified = True
+        return True
+
+    def pull(self):
+        '''
+        append the next chunk of `remote_fp` to the part file
+        returns the number of bytes appended, None if the pull failed
+        '''
+        with self.lock:
+            if not self.verified and not self._verify():
+                self.failures += 1
+                return None
+            output = self.connection.run(
+                pull_command(self.remote_fp, self.offset, self.chunk), decode=False
+            )
+            self.missing = output == MISSING
+            if self.missing:
+                print("Err: {} does not exist".format(self.remote_fp))
+                self.failures += 1
+                return None
+            data = None if output is None else parse_pull(output)
+            if data is None:
+                self.failures += 1
+                return None
+            self.failures = 0
+            self.transferred += len(output)
+            if data:
+                with open(self.part_fp, 'ab') as f:
+                    f.write(data)
+                self.offset += len(data)
+            return len(data)
+
+    def sync(self):
+        '''
+        pull until caught up with `remote_fp`
+        returns whether it caught up
+        '''
+        while 1:
+            size = self.pull()
+            if size is None:
+                return False
+            if size < self.chunk:
+                return True
+
+    def _serve(self):
+        while not self.stopping.wait(self.interval):
+            self.sync()
+
+    def start(self):
+        '''
+        keep pulling every `interval` seconds in the background
+        '''
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+
+    def finish(self):
+        '''
+        pull the rest of `remote_fp` and move the part file to `local_fp`,
+        leaving `local_fp` alone if there is no `remote_fp`
+        returns whether it worked
+        '''
+        self.stop()
+        while not self.sync():
+            if self.missing:
+                return False
+            if self.failures >= SYNC_RETRIES:
+                print("Err: cannot finish {}, {} bytes kept in {}".format(
+                    self.remote_fp, self.offset, self.part_fp
+                ))
+                return False
+        if not os.path.isfile(self.part_fp):
+            open(self.part_fp, 'wb').close()
+        os.replace(self.part_fp, self.local_fp)
+        print("Synced {} bytes of {} into {} ({} bytes transferred)".format(
+            self.offset, self.remote_fp, self.local_fp, self.transferred
+        ))
+        return True
+
+
+def test(args):
+    import time
+    import random
+    import tempfile
+    from libs.ssh_session import SshConnection
+    connection = SshConnection(args.host, user=args.user, port=args.port, options=args.options)
+    folder = tempfile.mkdtemp()
+    # the ssh host is this machine, so the remote file is local too
+    remote_fp = os.path.join(folder, "remote.csv")
+    local_fp = os.path.join(folder, "local.csv")
+    stopping = threading.Event()
+
+    def grow():
+        i = 0
+        with open(remote_fp, 'w') as f:
+            while not stopping.is_set():
+                f.write("{},{:.3f},{},{:.4f},{:.4f},{:.6f}\n".format(
+                    i, time.time(), i * 20, random.random(), random.random(), random.random()
+                ))
+                i += 1
+                if i % 100 == 0:
+                    f.flush()
+                    time.sleep(0.01)
+
+    writer = threading.Thread(target=grow)
+    writer.start()
+    sync = FileSync(connection, remote_fp, local_fp, interval=args.interval, chunk=args.chunk).start()
+    time.sleep(args.duration / 2)
+    # a broken transfer halfway: the part file is picked up again
+    sync.stop()
+    print("interrupted at {} bytes".format(sync.offset))
+    connection.close()
+    sync = FileSync(connection, remote_fp, local_fp, interval=args.interval, chunk=args.chunk).start()
+    time.sleep(args.duration / 2)
+    stopping.set()
+    writer.join()
+    start = time.time()
+    if not sync.finish():
+        exit(1)
+    print("finished {:.3f}s after the end of the file".format(time.time() - start))
+    start = time.time()
+    connection.fetch(remote_fp, os.path.join(folder, "fetched.csv"))
+    print("fetching it whole takes {:.3f}s".format(time.time() - start))
+    with open(remote_fp, 'rb') as f:
+        remote = f.read()
+    with open(local_fp, 'rb') as f:
+        local = f.read()
+    print("{} bytes synced {} the {} byte file".format(
+        len(local), "match" if local == remote else "DIFFER from", len(remote)
+    ))
+    if local != remote:
+        exit(1)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='incremental file sync test, the ssh host being this machine'
+    )
+
+    parser.add_argument(
+        '--host',
+        dest='host',
+        default='127.0.0.1',
+        help='Specify ssh host, which has to be this machine'
+    )
+
+    parser.add_argument(
+        '--user',
+        dest='user',
+        default='root',
+        help='Specify user'
+    )
+
+    parser.add_argument(
+        '-p', '--port',
+        dest='port',
+        type=int,
+        default=None,
+        help='Specify ssh port'
+    )
+
+    parser.add_argument(
+        '-o',
+        dest='options',
+        action='append',
+        default=[],
+        help='Add ssh option, e.g. -o IdentityFile=key'
+    )
+
+    parser.add_argument(
+        '--duration',
+        dest='duration',
+        type=float,
+        default=6.0,
+        help='Specify seconds the file grows for'
+    )
+
+    parser.add_argument(
+        '--interval',
+        dest='interval',
+        type=float,
+        default=1.0,
+        help='Specify seconds between pulls'
+    )
+
+    parser.add_argument(
+        '--chunk',
+        dest='chunk',
+        type=int,
+        default=SYNC_CHUNK,
+        help='Specify bytes pulled per round trip at most'
+    )
+
+    args, __ = parser.parse_known_args()
+
+    test(args)
@@ -0,0 +1,664 @@
+import os
+import sys
+import time
+import json
+import asyncio
+import threading
+import functools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from libs.file_sync import FileSync
+from libs.file_sync import SYNC_INTERVAL
+from libs.parser import SLAM_CSV_HEADER
+from libs.ssh_session import SshConnection
+from libs.status_monitor import StatusMonitor
+from libs.status_monitor import start_cleaning
+from libs.status_monitor import BACKOFF_START, FAST_INTERVAL, SLOW_INTERVAL
+from libs.status_monitor import REDISCOVER_ERRORS
+
+
+FLEET_JOBS = 8  # threads for blocking miio and ssh calls of all devices
+VIEW_INTERVAL = 5.0  # seconds between combined status views
+MIN_BATTERY = 50  # percent to start a session
+REMOTE_FOLDER = "/mnt/data/exp"
+STATE_RETURNING = 6
+STATE_ERROR = 12
+
+
+class FleetDevice():
+    '''
+    one vacuum of the fleet, its miio device, ssh connection and the state
+    of its session; its trace is pulled every `sync_interval` seconds while
+    tracing, only at the end if 0
+    '''
+
+    def __init__(
+        self,
+        name,
+        vacuum,
+        ssh,
+        remote_folder=REMOTE_FOLDER,
+        trace_format="csv",
+        sync_interval=SYNC_INTERVAL
+    ):
+        self.name = name
+        self.vacuum = vacuum
+        self.ssh = ssh
+        self.remote_folder = remote_folder
+        self.trace_format = trace_format
+        self.sync_interval = sync_interval
+        self.sync = None
+        self.phase = "idle"
+        self.status = None
+        self.error = None
+        self.started = None
+        self.finished = None
+        self.files = []
+
+
+def load_fleet(config_fp):
+    '''
+    devices of the fleet config `config_fp`, a json list of objects with
+    name, ip, token and optionally remote_script_folder, trace_format and
+    sync_interval
+    '''
+    import miio
+    with open(config_fp) as f:
+        config = json.load(f)
+    devices = []
+    for entry in config:
+        devices.append(FleetDevice(
+            entry["name"],
+            miio.Vacuum(ip=entry["ip"], token=entry["token"]),
+            SshConnection(entry["ip"]),
+            remote_folder=entry.get("remote_script_folder", REMOTE_FOLDER),
+            trace_format=entry.get("trace_format", "csv"),
+            sync_interval=float(entry.get("sync_interval", SYNC_INTERVAL)),
+        ))
+    return devices
+
+
+class FleetController():
+    '''
+    runs cleaning sessions with trace collection on all devices at once
+    in one event loop; blocking miio and ssh calls go to a pool of `jobs`
+    threads; a session ends as failed after `max_errors` failed status
+    polls in a row
+    '''
+
+    def __init__(
+        self,
+        devices,
+        jobs=FLEET_JOBS,
+        poll_interval=FAST_INTERVAL,
+        slow_interval=SLOW_INTERVAL,
+        backoff=BACKOFF_START,
+        view_interval=VIEW_INTERVAL,
+        max_errors=REDISCOVER_ERRORS
+    ):
+        self.devices = devices
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        self.poll_interval = poll_interval
+        self.slow_interval = slow_interval
+        self.backoff = backoff
+        self.view_interval = view_interval
+        self.max_errors = max_errors
+
+    async def call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def trace_on(self, device):
+        binary = device.trace_format == "bin"
+        await self.call(
+            device.ssh.run,
+            "rm {0}/*.ppm && rm {0}/*.csv; rm -f {0}/*.bin".format(device.remote_folder)
+        )
+        # a second recorder would truncate the trace of the first
+        return await self.call(
+            functools.partial(device.ssh.run, retry=False),
+            "nohup /usr/bin/python3 {0}/get_loc_est.py {0}/{1}{2} > /dev/null 2>&1 &"
+            .format(device.remote_folder, "tmp.bin" if binary else "tmp.csv", " --binary" if binary else "")
+        ) is not None
+
+    async def trace_off(self, device):
+        # wait for the trace to be flushed before it is downloaded
+        return await self.call(
+            functools.partial(device.ssh.run, retry=False),
+            "killall python3 && for i in $(seq 20); do pidof python3 > /dev/null || break; sleep 0.2; done"
+        ) is not None
+
+    async def _sync(self, device):
+        '''
+        pull the growing trace of `device` every `sync_interval` seconds
+        '''
+        while 1:
+            await asyncio.sleep(device.sync_interval)
+            await self.call(device.sync.sync)
+
+    async def _finish(self, device, sync):
+        if not await self.call(sync.finish):
+            device.error = "cannot download {}".format(sync.remote_fp)
+            if os.path.isfile(sync.part_fp):
+                # what was pulled before the link broke
+                device.files.append(sync.part_fp)
+            return False
+        device.files.append(sync.local_fp)
+        return True
+
+    async def _download_map(self, device, local_fp):
+        # keep only the latest map, it is still updated in /run/shm
+        content = await self.call(
+            device.ssh.run,
+            "f=$(ls /run/shm/*.ppm | tail -n 1) && cp $f {0}/ && echo {0}/$(basename $f)"
+            .format(device.remote_folder)
+        )
+        if not content or not content.strip():
+            device.error = "cannot find map file"
+            return False
+        return await self._finish(device, FileSync(device.ssh, content.strip(), local_fp))
+
+    async def download(self, device, folder, prefix):
+        '''
+        pull the latest map and the rest of the trace of `device` into
+        `folder` at once
+        '''
+        return all(await asyncio.gather(
+            self._download_map(device, os.path.join(folder, "{}_map.ppm".format(prefix))),
+            self._finish(device, device.sync)
+        ))
+
+    async def run_session(self, device, output):
+        '''
+        one session of `device` like `control start`, with its downloads
+        under `output`/<device name>, also of a session aborted by an error
+        or lost to a vacuum that stopped answering
+        returns whether it completed
+        '''
+        device.phase = "checking"
+        try:
+            device.status = await self.call(device.vacuum.status)
+        except Exception as e:
+            device.phase, device.error = "failed", str(e)
+            return False
+        if device.status.battery < MIN_BATTERY:
+            device.phase, device.error = "skipped", "battery {}%".format(device.status.battery)
+            return False
+        device.phase = "trace on"
+        if not await self.trace_on(device):
+            device.phase, device.error = "failed", "cannot start trace"
+            return False
+        prefix = time.strftime("%Y%m%d_%H%M%S", time.localtime())
+        folder = os.path.join(output, device.name)
+        os.makedirs(folder, exist_ok=True)
+        device.sync = FileSync(
+            device.ssh,
+            "{}/tmp_slam.{}".format(device.remote_folder, device.trace_format),
+            os.path.join(folder, "{}_loc.{}".format(prefix, device.trace_format)),
+            interval=device.sync_interval
+        )
+        syncing = None
+        if device.sync_interval > 0:
+            syncing = asyncio.ensure_future(self._sync(device))
+        timeline_fp = os.path.join(folder, "{}_status.csv".format(prefix))
+        device.files.append(timeline_fp)
+        monitor = StatusMonitor(
+            device.vacuum,
+            timeline_fp,
+            fast=self.poll_interval,
+            slow=self.slow_interval,
+            backoff=self.backoff
+        )
+        aborted = False
+        lost = False
+        try:
+            device.phase = "starting"
+            # lowest fan speed
+            if not await self.call(start_cleaning, monitor, 1):
+                device.error = "cannot set fan speed"
+            device.started = time.time()
+            device.phase = "cleaning"
+            while 1:
+                await asyncio.sleep(monitor.next_interval())
+                try:
+                    status = await self.call(monitor.poll)
+                except Exception as e:
+                    device.error = str(e)
+                    if monitor.errors >= self.max_errors:
+                        device.error = "no answer to {} polls: {}".format(monitor.errors, e)
+                        lost = True
+                        break
+                    continue
+                device.status = status
+                device.error = None
+                if status.error_code > 0 or status.state_code == STATE_ERROR:
+                    device.error = str(status.error)
+                    aborted = True
+                    try:
+                        await self.call(monitor.call, "pause", device.vacuum.pause)
+                    except Exception as e:
+                        device.error += ", cannot pause: {}".format(e)
+                    break
+                if status.state_code == STATE_RETURNING:
+                    break
+        finally:
+            monitor.close()
+            if syncing is not None:
+                syncing.cancel()
+            device.phase = "trace off"
+            await self.trace_off(device)
+        device.phase = "download"
+        ok = await self.download(device, folder, prefix)
+        device.phase = "failed" if not ok or lost else "aborted" if aborted else "done"
+        device.finished = time.time()
+        return ok and not aborted and not lost
+
+    def view(self):
+        '''
+        one line per device of its session phase, state, battery, elapsed
+        time and last error
+        '''
+        lines = ["{:<12} {:<10} {:<16} {:>7} {:>8}  {}".format(
+            "device", "phase", "state", "battery", "elapsed", "error"
+        )]
+        for device in self.devices:
+            status = device.status
+            elapsed = 0 if device.started is None else (device.finished or time.time()) - device.started
+            lines.append("{:<12} {:<10} {:<16} {:>7} {:>7.0f}s  {}".format(
+                device.name, device.phase,
+                "-" if status is None else str(status.state),
+                "-" if status is None else "{}%".format(status.battery),
+                elapsed,
+                device.error or ""
+            ))
+        return "\n".join(lines)
+
+    async def _show(self):
+        while 1:
+            await asyncio.sleep(self.view_interval)
+            print(self.view())
+
+    async def run(self, output):
+        '''
+        sessions of all devices at once, showing their combined status
+        every `view_interval` seconds
+        returns whether each session completed
+        '''
+        viewer = asyncio.ensure_future(self._show())
+        try:
+            results = await asyncio.gather(
+                *[self.run_session(device, output) for device in self.devices],
+                return_exceptions=True
+            )
+        finally:
+            viewer.cancel()
+        for device, result in zip(self.devices, results):
+            if isinstance(result, BaseException):
+                device.phase, device.error = "failed", str(result)
+        print(self.view())
+        return [result is True for result in results]
+
+    async def statuses(self):
+        '''
+        status of all devices at once, None for the unreachable ones
+        '''
+        async def status(device):
+            try:
+                device.status = await self.call(device.vacuum.status)
+            except Exception as e:
+                device.error = str(e)
+        await asyncio.gather(*[status(device) for device in self.devices])
+        return [device.status for device in self.devices]
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+class FakeStatus():
+    '''
+    the parts of miio's VacuumStatus the controllers use
+    '''
+
+    STATES = {5: "Cleaning", 6: "Returning home", 8: "Charging", 10: "Paused", 12: "Error"}
+
+    def __init__(self, state_code, battery, error_code=0, clean_area=0.0):
+        self.state_code = state_code
+        self.state = self.STATES.get(state_code, "Unknown")
+        self.battery = battery
+        self.error_code = error_code
+        self.error = "No error" if error_code == 0 else "Error {}".format(error_code)
+        self.clean_area = clean_area
+
+
+class FakeVacuum():
+    '''
+    stands in for miio.Vacuum: each call blocks for `latency` seconds like
+    a round trip; after `start` it cleans for `clean_seconds`, or fails
+    with `error_code` then, and returns home; between the `outage` seconds
+    after its creation every call times out, so does setting the fan speed
+    if `fan_error`
+    '''
+
+    def __init__(
+        self,
+        clean_seconds=1.0,
+        latency=0.05,
+        battery=90,
+        error_code=0,
+        outage=None,
+        fan_error=False
+    ):
+        self.clean_seconds = clean_seconds
+        self.latency = latency
+        self.battery = battery
+        self.error_code = error_code
+        self.outage = outage
+        self.fan_error = fan_error
+        self.created = time.time()
+        self.state_code = 8
+        self.started = None
+        self.polls = 0
+        self.calls = 0
+
+    def _call(self):
+        self.calls += 1
+        time.sleep(self.latency)
+        if self.outage and self.outage[0] <= time.time() - self.created < self.outage[1]:
+            raise OSError("No response from the device")
+
+    def status(self):
+        self._call()
+        area = 0.0
+        if self.state_code == 5:
+            self.polls += 1
+            cleaned = time.time() - self.started
+            area = round(cleaned * 0.3, 2)
+            if cleaned >= self.clean_seconds:
+                self.state_code = 12 if self.error_code else STATE_RETURNING
+        return FakeStatus(
+            self.state_code, self.battery, self.error_code if self.state_code == 12 else 0, area
+        )
+
+    def start(self):
+        self._call()
+        self.state_code = 5
+        self.started = time.time()
+        self.polls = 0
+
+    def pause(self):
+        self._call()
+        self.state_code = 10
+
+    def home(self):
+        self._call()
+        self.state_code = STATE_RETURNING
+
+    def set_fan_speed(self, speed):
+        self._call()
+        if self.fan_error:
+            raise OSError("No response from the device")
+
+
+class FakeSsh():
+    '''
+    stands in for SshConnection to a vacuum whose remote folder is local:
+    the trace recorder appends estimates to its trace until killed, the
+    latest map is a placeholder and other commands run in a local shell;
+    `drop_after` seconds into the trace the link breaks for good
+    '''
+
+    def __init__(self, latency=0.05, drop_after=None):
+        self.latency = latency
+        self.drop_after = drop_after
+        self.commands = []
+        self.traced = None
+        self.recording = threading.Event()
+        self.recorder = None
+
+    def _record(self, trace_fp):
+        i = 0
+        with open(trace_fp, 'w') as f:
+            f.write(SLAM_CSV_HEADER)
+            while self.recording.is_set():
+                f.write("estimate,{:.3f},{},{:.4f},{:.4f},{:.6f}\n".format(
+                    i * 0.01, int(time.time() * 1000), i * 0.001, i * 0.002, 0.0
+                ))
+                f.flush()
+                i += 1
+                time.sleep(0.01)
+
+    def stop(self):
+        if self.recorder is None:
+            return
+        self.recording.clear()
+        self.recorder.join()
+        self.recorder = None
+
+    def run(self, cmd, decode=True, retry=True):
+        time.sleep(self.latency)
+        self.commands.append(cmd)
+        if self.drop_after is not None and self.traced is not None and \
+                time.time() - self.traced >= self.drop_after:
+            print("Err: Connection to fake vacuum timed out")
+            return None
+        if cmd.startswith("nohup"):
+            filename, fileext = os.path.splitext(cmd.split()[3])
+            self.stop()
+            self.recording.set()
+            self.recorder = threading.Thread(
+                target=self._record, args=("{}_slam{}".format(filename, fileext),), daemon=True
+            )
+            self.recorder.start()
+            self.traced = time.time()
+            return ""
+        if cmd.startswith("killall"):
+            self.stop()
+            return ""
+        if cmd.startswith("f=$(ls /run/shm/*.ppm"):
+            map_fp = "{}/fake_map.ppm".format(cmd.split("cp $f ")[1].split("/ ")[0])
+            with open(map_fp, 'wb') as f:
+                f.write(b"P6\n2 2 255\n" + bytes(12))
+            return map_fp + "\n"
+        try:
+            output = subprocess.check_output(cmd, shell=True, stderr=subprocess.DEVNULL)
+        except subprocess.CalledProcessError:
+            return None
+        return output.decode() if decode else output
+
+
+def test(args):
+    import tempfile
+    # the remote folders of the fake vacuums are local
+    remote = tempfile.mkdtemp()
+    for i in range(args.fake):
+        os.makedirs(os.path.join(remote, "fake{}".format(i)))
+    devices = [
+        FleetDevice(
+            "fake{}".format(i),
+            FakeVacuum(
+                clean_seconds=args.clean + i * args.poll,
+                latency=args.latency,
+                battery=40 if args.low_battery and i == 0 else 90,
+                error_code=3 if args.error and i == 1 else 0,
+                outage=(args.clean / 2, float('inf')) if args.offline and i == 2 else None,
+                fan_error=args.fan_error and i == 3
+            ),
+            FakeSsh(
+                latency=args.latency,
+                drop_after=args.clean / 2 if args.drop_link and i == args.fake - 1 else None
+            ),
+            remote_folder=os.path.join(remote, "fake{}".format(i)),
+            sync_interval=args.sync
+        )
+        for i in range(args.fake)
+    ]
+    controller = FleetController(
+        devices,
+        jobs=args.jobs,
+        poll_interval=args.poll,
+        slow_interval=args.poll * 4,
+        backoff=args.poll * 2,
+        view_interval=args.view,
+        max_errors=args.max_errors
+    )
+    output = tempfile.mkdtemp()
+    start = time.time()
+    results = asyncio.run(controller.run(output))
+    elapsed = time.time() - start
+    controller.close()
+    for device in devices:
+        device.ssh.stop()
+    # one device after the other takes at least the sum of all cleaning
+    serial = sum(
+        device.finished - device.started for device in devices if device.finished
+    )
+    print("{} of {} sessions completed in {:.2f}s, over {:.2f}s one after the other".format(
+        sum(results), len(results), elapsed, serial
+    ))
+    print("downloads under {}: {}".format(output, sorted(
+        os.path.relpath(fp, output) for device in devices for fp in device.files
+    )))
+    expected = [
+        not (args.low_battery and i == 0) and not (args.error and i == 1) and
+        not (args.offline and i == 2) and not (args.drop_link and i == args.fake - 1)
+        for i in range(args.fake)
+    ]
+    if results != expected:
+        print("Err: expected {}".format(expected))
+        sys.exit(1)
+    for device, result in zip(devices, results):
+        if device.sync is None:
+            continue
+        with open(device.sync.remote_fp, 'rb') as f:
+            trace = f.read()
+        if result:
+            with open(device.sync.local_fp, 'rb') as f:
+                if f.read() != trace:
+                    print("Err: trace of {} differs from the vacuum".format(device.name))
+                    sys.exit(1)
+        elif args.drop_link and device is devices[-1] and args.sync > 0:
+            # the trace pulled before the link broke is kept
+            if device.sync.part_fp not in device.files:
+                print("Err: trace of {} pulled so far is lost".format(device.name))
+                sys.exit(1)
+            with open(device.sync.part_fp, 'rb') as f:
+                kept = f.read()
+            if not kept or not trace.startswith(kept):
+                print("Err: kept {} bytes of {} are not the start of its trace".format(
+                    len(kept), device.name
+                ))
+                sys.exit(1)
+            print("{} kept {} of {} bytes of its trace after the link broke".format(
+                device.name, len(kept), len(trace)
+            ))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='fleet controller test with fake vacuums'
+    )
+
+    parser.add_argument(
+        '--fake',
+        dest='fake',
+        type=int,
+        default=4,
+        help='Specify number of fake vacuums'
+    )
+
+    parser.add_argument(
+        '-j', '--jobs',
+        dest='jobs',
+        type=int,
+        default=FLEET_JOBS,
+        help='Specify number of threads for blocking calls'
+    )
+
+    parser.add_argument(
+        '--clean',
+        dest='clean',
+        type=float,
+        default=1.0,
+        help='Specify seconds the first fake vacuum cleans for, the others a poll longer each'
+    )
+
+    parser.add_argument(
+        '--poll',
+        dest='poll',
+        type=float,
+        default=0.2,
+        help='Specify seconds between status polls around state changes'
+    )
+
+    parser.add_argument(
+        '--latency',
+        dest='latency',
+        type=float,
+        default=0.05,
+        help='Specify seconds each fake call blocks'
+    )
+
+    parser.add_argument(
+        '--view',
+        dest='view',
+        type=float,
+        default=0.5,
+        help='Specify seconds between combined status views'
+    )
+
+    parser.add_argument(
+        '--low-battery',
+        dest='low_battery',
+        action='store_true',
+        help='Let the first fake vacuum have too little battery'
+    )
+
+    parser.add_argument(
+        '--error',
+        dest='error',
+        action='store_true',
+        help='Let the second fake vacuum fail while cleaning'
+    )
+
+    parser.add_argument(
+        '--offline',
+        dest='offline',
+        action='store_true',
+        help='Let the third fake vacuum stop answering while cleaning'
+    )
+
+    parser.add_argument(
+        '--fan-error',
+        dest='fan_error',
+        action='store_true',
+        help='Let the fourth fake vacuum not answer setting the fan speed, its session goes on'
+    )
+
+    parser.add_argument(
+        '--drop-link',
+        dest='drop_link',
+        action='store_true',
+        help='Let the ssh link to the last fake vacuum break halfway through cleaning'
+    )
+
+    parser.add_argument(
+        '--sync',
+        dest='sync',
+        type=float,
+        default=0.2,
+        help='Specify seconds between pulls of the traces, 0 to pull them at the end only'
+    )
+
+    parser.add_argument(
+        '--max-errors',
+        dest='max_errors',
+        type=int,
+        default=REDISCOVER_ERRORS,
+        help='Specify failed status polls in a row before giving up on a vacuum'
+    )
+
+    args, __ = parser.parse_known_args()
+
+    test(args)
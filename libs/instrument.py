@@ -0,0 +1,297 @@
+import os
+import sys
+import json
+import time
+
+
+COUNT_CHUNK = 1 << 20
+ROW_EXTS = ('.csv', '.txt')  # files whose lines are counted as rows
+
+
+def file_bytes(fps):
+    return sum(os.path.getsize(fp) for fp in fps if os.path.isfile(fp))
+
+
+def file_rows(fps):
+    '''
+    lines of the text files in `fps`, None if there are none
+    '''
+    fps = [fp for fp in fps if os.path.splitext(fp)[1] in ROW_EXTS and os.path.isfile(fp)]
+    if not fps:
+        return None
+    rows = 0
+    for fp in fps:
+        with open(fp, 'rb') as f:
+            for block in iter(lambda: f.read(COUNT_CHUNK), b''):
+                rows += block.count(b'\n')
+    return rows
+
+
+def cpu_times():
+    '''
+    cpu seconds of this process and its finished children, e.g. tshark and
+    map workers
+    '''
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def reset_peak_rss():
+    '''
+    start the peak rss of this process over, on linux only
+    returns whether it did
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb(children=False):
+    '''
+    peak rss since the last `reset_peak_rss`, else of the whole run
+    '''
+    if not children:
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) / (1 << 10)
+        except OSError:
+            pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(
+        resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    ).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return rss / (1 << 20 if sys.platform == 'darwin' else 1 << 10)
+
+
+class _NoStage():
+    '''
+    stands in for a stage of a disabled Instrument
+    '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def outputs(self, fps):
+        pass
+
+
+NO_STAGE = _NoStage()
+
+
+class _Stage():
+
+    def __init__(self, instrument, name, inputs):
+        self.instrument = instrument
+        self.record = {'stage': name}
+        self.inputs = list(inputs)
+        self.output_fps = []
+        self.profiler = None
+
+    def outputs(self, fps):
+        '''
+        files the stage wrote, to count their bytes and rows
+        '''
+        self.output_fps += [fp for fp in fps if fp]
+
+    def __enter__(self):
+        self.record['bytes_in'] = file_bytes(self.inputs)
+        self.record['rows_in'] = file_rows(self.inputs)
+        reset_peak_rss()
+        if self.instrument.trace_memory:
+            import tracemalloc
+            tracemalloc.reset_peak()
+        if self.instrument.profile_dir is not None:
+            import cProfile
+            self.profiler = cProfile.Profile()
+        self.cpu = cpu_times()
+        self.start = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.profiler is not None:
+            self.profiler.disable()
+        record = self.record
+        record['wall_s'] = time.perf_counter() - self.start
+        record['cpu_s'] = cpu_times() - self.cpu
+        record['peak_rss_mb'] = peak_rss_mb()
+        record['children_peak_rss_mb'] = peak_rss_mb(children=True)
+        if self.instrument.trace_memory:
+            import tracemalloc
+            record['peak_traced_mb'] = tracemalloc.get_traced_memory()[1] / (1 << 20)
+        record['files_out'] = len(self.output_fps)
+        record['bytes_out'] = file_bytes(self.output_fps)
+        record['rows_out'] = file_rows(self.output_fps)
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        if self.profiler is not None:
+            record['profile'] = self.instrument.profile_fp(record['stage'])
+            self.profiler.dump_stats(record['profile'])
+        self.instrument.records.append(record)
+        return False
+
+
+class Instrument():
+    '''
+    records wall and cpu time, peak memory, rows and bytes in and out of
+    each stage run in `with instrument.stage(name, inputs) as stage:`,
+    dumping a cProfile of each into `profile_dir` if given and tracking
+    python allocations with tracemalloc if `trace_memory`; a disabled
+    instrument hands out a stage doing nothing
+    '''
+
+    def __init__(self, enabled=False, profile_dir=None, trace_memory=False):
+        self.enabled = enabled or profile_dir is not None or trace_memory
+        self.profile_dir = profile_dir
+        self.trace_memory = trace_memory
+        self.records = []
+        self.started = time.time()
+        if profile_dir is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+        if trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+
+    def stage(self, name, inputs=()):
+        if not self.enabled:
+            return NO_STAGE
+        return _Stage(self, name, inputs)
+
+    def profile_fp(self, name):
+        '''
+        a file per run of stage `name`
+        '''
+        runs = sum(record['stage'] == name for record in self.records)
+        return os.path.join(
+            self.profile_dir, "{}{}.prof".format(name, "" if runs == 0 else "_{}".format(runs))
+        )
+
+    def stop(self):
+        if self.trace_memory:
+            import tracemalloc
+            tracemalloc.stop()
+
+    def report(self):
+        return {
+            'argv': sys.argv,
+            'started': self.started,
+            'wall_s': time.time() - self.started,
+            'stages': self.records,
+        }
+
+    def write(self, fp):
+        tmp_fp = "{}.tmp".format(fp)
+        with open(tmp_fp, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+        os.replace(tmp_fp, fp)
+        print("Instrumentation report saved to {}".format(fp))
+
+    def summary(self):
+        def fmt(val, spec):
+            return "-" if val is None else spec.format(val)
+
+        lines = ["{:<28} {:>8} {:>8} {:>9} {:>9} {:>10} {:>10} {:>9} {:>9}".format(
+            "stage", "wall(s)", "cpu(s)", "rss(MB)", "py(MB)", "rows in", "rows out", "MB in", "MB out"
+        )]
+        for record in self.records:
+            lines.append("{:<28} {:>8.2f} {:>8.2f} {:>9} {:>9} {:>10} {:>10} {:>9.1f} {:>9.1f}{}".format(
+                record['stage'], record['wall_s'], record['cpu_s'],
+                fmt(record['peak_rss_mb'], "{:.0f}"),
+                fmt(record.get('peak_traced_mb', None), "{:.1f}"),
+                fmt(record['rows_in'], "{}"), fmt(record['rows_out'], "{}"),
+                record['bytes_in'] / (1 << 20), record['bytes_out'] / (1 << 20),
+                "  ({})".format(record['error']) if 'error' in record else ""
+            ))
+        lines.append("{:<28} {:>8.2f} {:>8.2f}".format(
+            "total",
+            sum(record['wall_s'] for record in self.records),
+            sum(record['cpu_s'] for record in self.records)
+        ))
+        return "\n".join(lines)
+
+
+NO_INSTRUMENT = Instrument()
+
+
+def test(args):
+    import tempfile
+    import numpy as np
+    folder = tempfile.mkdtemp()
+    in_fp = os.path.join(folder, "in.csv")
+    out_fp = os.path.join(folder, "out.csv")
+    np.savetxt(in_fp, np.random.rand(args.rows, 4), delimiter=',')
+    instrument = Instrument(enabled=True, profile_dir=args.profile, trace_memory=args.trace_memory)
+    with instrument.stage('load', [in_fp]):
+        data = np.loadtxt(in_fp, delimiter=',')
+    with instrument.stage('double', [in_fp]) as stage:
+        np.savetxt(out_fp, data * 2, delimiter=',')
+        stage.outputs([out_fp])
+    instrument.stop()
+    print(instrument.summary())
+    instrument.write(os.path.join(folder, "report.json"))
+    # what a disabled stage costs
+    for enabled in [False, True]:
+        instrument = Instrument(enabled=enabled)
+        start = time.perf_counter()
+        for __ in range(args.num):
+            with instrument.stage('noop'):
+                pass
+        print("{} stage: {:.2f}us each".format(
+            "enabled" if enabled else "disabled",
+            (time.perf_counter() - start) / args.num * 1e6
+        ))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='instrumentation test'
+    )
+
+    parser.add_argument(
+        '--rows',
+        dest='rows',
+        type=int,
+        default=100000,
+        help='Specify rows of the test csv'
+    )
+
+    parser.add_argument(
+        '-n', '--num',
+        dest='num',
+        type=int,
+        default=100000,
+        help='Specify number of empty stages to time'
+    )
+
+    parser.add_argument(
+        '--profile',
+        dest='profile',
+        default=None,
+        help='Specify folder to dump a cProfile of each stage into'
+    )
+
+    parser.add_argument(
+        '--trace-memory',
+        dest='trace_memory',
+        action='store_true',
+        help='Enable to track python allocations per stage'
+    )
+
+    args, __ = parser.parse_known_args()
+
+    test(args)
@@ -1,5 +1,8 @@
 import os
 import time
+import signal
+import socket
+import struct
 import subprocess
 
 from collections import OrderedDict
@@ -7,17 +10,29 @@ from collections import OrderedDict
 
 PLAYER_LOG_FILEPATH = "/run/shm/PLAYER_fprintf.log"
 SLAM_LOG_FILEPATH = "/run/shm/SLAM_fprintf.log"
-
-
-def line_parsing_player_log(log_line):
+POS2D_CSV_HEADER = "#type,robotime,epoch,p_x,p_y,yaw,v_x,v_y,v_yaw\n"
+POS3D_CSV_HEADER = "#type,robotime,epoch,p_x,p_y,p_z,roll,pitch,yaw,v_x,v_y,v_z,v_roll,v_pitch,v_yaw\n"
+SLAM_CSV_HEADER = "#type,robotime,epoch,p_x,p_y,yaw\n"
+# binary slam trace: the magic, then one record per estimate of
+# robotime, epoch (ms), p_x, p_y, yaw
+SLAM_TRACE_MAGIC = b"XVSLAM01"
+SLAM_TRACE_RECORD = struct.Struct('<dqddd')
+WRITE_BUFFER = 1 << 16  # bytes
+SYNC_INTERVAL = 5.0  # seconds between fsync of the outputs
+REPORT_INTERVAL = 30.0  # seconds between capture rate reports
+STREAM_TIMEOUT = 1.0  # seconds to connect or send to the pose receiver
+STREAM_RETRY = 5.0  # seconds between reconnecting to the pose receiver
+
+
+def line_parsing_player_log(log_line, epoch=None):
     '''
-    parse the line from player log
+    parse the line from player log, `epoch` (ms) defaults to now
     '''
     vals = log_line.split(" ")
     result = OrderedDict([
         ('type', vals[3]),
         ('robotime', float(vals[0])),
-        ('epoch', int(time.time() * 1000)),
+        ('epoch', int(time.time() * 1000) if epoch is None else epoch),
     ])
     if vals[3] == 'position2d':
         result['p_x'] = float(vals[7])      # meter
@@ -44,12 +59,216 @@ def line_parsing_player_log(log_line):
         result['ranges'] = [float(x) for x in vals[8:-1]]
     return result
 
+def player_csv_line(log_line, epoch):
+    '''
+    csv line of a position2d/3d line from player log as written by
+    get_player_log, without building the record; None for other types
+    '''
+    vals = log_line.split(" ")
+    if vals[3] == 'position2d':
+        values = vals[7:13]
+    elif vals[3] == 'position3d':
+        values = vals[7:19]
+    else:
+        return None
+    if len(values) < (6 if vals[3] == 'position2d' else 12):
+        raise IndexError("list index out of range")
+    return "{},{},{},{}\n".format(
+        vals[3], float(vals[0]), epoch, ",".join([str(float(x)) for x in values])
+    )
+
+
+def slam_csv_line(log_line, epoch):
+    '''
+    csv line of an estimate line from slam log as written by get_slam_log,
+    without building the record; None for other types
+    '''
+    vals = log_line.split(" ")
+    if vals[1] != 'estimate':
+        return None
+    return "estimate,{},{},{},{},{}\n".format(
+        float(vals[0]), epoch, float(vals[2]), float(vals[3]), float(vals[4])
+    )
+
+
+def slam_trace_record(log_line, epoch):
+    '''
+    packed SLAM_TRACE_RECORD of an estimate line from slam log; None for
+    other types
+    '''
+    vals = log_line.split(" ")
+    if vals[1] != 'estimate':
+        return None
+    return SLAM_TRACE_RECORD.pack(
+        float(vals[0]), epoch, float(vals[2]), float(vals[3]), float(vals[4])
+    )
+
+
+def cpu_time():
+    '''
+    user and system cpu seconds of this process
+    '''
+    times = os.times()
+    return times.user + times.system
+
+
+class CaptureWriter():
+    '''
+    one buffered csv output for a whole capture, flushed and fsynced every
+    `sync_interval` seconds instead of reopened for every line; binary if
+    `header` is bytes
+    '''
+
+    def __init__(self, fp, header, sync_interval=SYNC_INTERVAL):
+        self.f = open(fp, 'wb' if isinstance(header, bytes) else 'w', buffering=WRITE_BUFFER)
+        self.f.write(header)
+        self.sync_interval = sync_interval
+        self.synced = time.time()
+
+    def write(self, line, now):
+        self.f.write(line)
+        if now - self.synced >= self.sync_interval:
+            self.sync(now)
+
+    def sync(self, now=None):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.synced = time.time() if now is None else now
+
+    def close(self):
+        self.sync()
+        self.f.close()
+
+
+class CaptureStats():
+    '''
+    counts captured records and prints the record rate and cpu use of this
+    process every `interval` seconds
+    '''
+
+    def __init__(self, interval=REPORT_INTERVAL):
+        self.interval = interval
+        self.count = 0
+        self.start = self.last = time.time()
+        self.start_cpu = self.last_cpu = cpu_time()
+        self.last_count = 0
+
+    def add(self, now):
+        self.count += 1
+        if now - self.last >= self.interval:
+            self.report(now)
+
+    def report(self, now=None, total=False):
+        if now is None:
+            now = time.time()
+        cpu = cpu_time()
+        since, since_cpu, since_count = (
+            (self.start, self.start_cpu, 0) if total else
+            (self.last, self.last_cpu, self.last_count)
+        )
+        elapsed = max(now - since, 1e-9)
+        print("{}captured {} records, {:.1f} records/s, cpu {:.1f}%".format(
+            "total: " if total else "",
+            self.count,
+            (self.count - since_count) / elapsed,
+            100.0 * (cpu - since_cpu) / elapsed
+        ))
+        self.last, self.last_cpu, self.last_count = now, cpu, self.count
+
+
+class PoseStreamer():
+    '''
+    pushes csv lines to the pose receiver of the controller over one TCP
+    connection, reconnecting at most every `retry` seconds; lines are
+    dropped while it is unreachable, the local output keeps them all
+    '''
+
+    def __init__(self, host, port, timeout=STREAM_TIMEOUT, retry=STREAM_RETRY):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.retry = retry
+        self.sock = None
+        self.next_try = 0
+        self.sent = 0
+        self.dropped = 0
+
+    def _connect(self, now):
+        if now < self.next_try:
+            return False
+        try:
+            self.sock = socket.create_connection(self.address, timeout=self.timeout)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError as e:
+            print("Err: cannot stream to {}:{}: {}".format(self.address[0], self.address[1], e))
+            self.sock = None
+            self.next_try = now + self.retry
+            return False
+        return True
+
+    def send(self, line, now):
+        if self.sock is None and not self._connect(now):
+            self.dropped += 1
+            return
+        try:
+            self.sock.sendall(line.encode())
+            self.sent += 1
+        except OSError as e:
+            print("Err: stream to {}:{} broke: {}".format(self.address[0], self.address[1], e))
+            self.close()
+            self.next_try = now + self.retry
+            self.dropped += 1
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def parse_stream_address(address):
+    '''
+    (host, port) of `host:port`
+    '''
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+def _stop_capture(signum, frame):
+    # `killall` ends a capture, let it close the outputs like Ctrl-C does
+    raise KeyboardInterrupt
+
+
+def read_log_lines(filepath, live_filepath):
+    '''
+    lines of log `filepath`, or, if not specified, of the live log
+    `live_filepath` as they come after clearing it
+    '''
+    if filepath:
+        with open(filepath, "r") as f:
+            for line in f:
+                yield line.rstrip()
+        return
+    while not os.path.isfile(live_filepath):
+        time.sleep(1)
+    subprocess.call("echo '' > {}".format(live_filepath), shell=True)
+    # tail the log file
+    proc = subprocess.Popen(
+        ['tail', '-F', live_filepath],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    try:
+        while 1:
+            yield proc.stdout.readline().decode().rstrip()
+    finally:
+        proc.terminate()
+
 
 def get_player_log(
     filepath=None,
     position2d=True,
     position3d=True,
-    outputfile=None
+    outputfile=None,
+    keep_data=True
 ):
     '''
     get player log and parse them into readable results
@@ -58,10 +277,10 @@ def get_player_log(
     @param position2d:  bool flag, whether parse position2d data
     @param position3d:  bool flag, whether parse position3d data
     @param outputfile:  output file to write to
+    @param keep_data:   bool flag, whether return the parsed records,
+                        disable for long captures into `outputfile`
     '''
 
-    counter = 0
-    line_idx = 0
     pos2d_data = []
     pos3d_data = []
     data = {
@@ -69,83 +288,64 @@ def get_player_log(
         'position3d': pos3d_data
     }
 
-    filename = None
-    fileext = None
+    if filepath and not os.path.isfile(filepath):
+        print("{} does not exist".format(filepath))
+        return data
+    if not filepath:
+        signal.signal(signal.SIGTERM, _stop_capture)
+
+    writers = {}
     if outputfile:
         filename, fileext = os.path.splitext(outputfile)
-
-    lines = []
-    if filepath:
-        if not os.path.isfile(filepath):
-            print("{} does not exist".format(filepath))
-            return data
-        with open(filepath, "r") as f:
-            lines = f.readlines()
-    else:
-        while not os.path.isfile(PLAYER_LOG_FILEPATH):
-            time.sleep(1)
-        subprocess.call("echo '' > {}".format(PLAYER_LOG_FILEPATH), shell=True)
-        # tail the log file
-        proc = subprocess.Popen(
-            ['tail', '-F', PLAYER_LOG_FILEPATH],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-
-    with open("{0}_2d{1}".format(filename, fileext), 'w') as outf:
-        outf.write("#type,robotime,epoch,p_x,p_y,yaw,v_x,v_y,v_yaw\n")
-
-    with open("{0}_3d{1}".format(filename, fileext), 'w') as outf:
-        outf.write("#type,robotime,epoch,p_x,p_y,p_z,roll,pitch,yaw,v_x,v_y,v_z,v_roll,v_pitch,v_yaw\n")
-
-    while 1:
-        if filepath:
-            # if reading from a file, end it at end of file
-            if line_idx >= len(lines):
-                break
-            line = lines[line_idx].rstrip()
-            line_idx += 1
-        else:
-            line = proc.stdout.readline().decode().rstrip()
-        try:
-            result = line_parsing_player_log(line)
-        except KeyboardInterrupt:
-            break
-        except BaseException as e:
-            print("error: {}".format(e))
-            print(line)
-            continue
-        try:
-            counter += 1
-            if counter % 100 == 0:
-                print("data line counter: {}".format(counter))
-            if position2d and result['type'] == 'position2d':
-                pos2d_data.append(result)
-                if outputfile:
-                    with open("{0}_2d{1}".format(filename, fileext), 'a+') as outf:
-                        outf.write("{}\n".format(",".join([str(result[key]) for key in result])))
-            elif position3d and result['type'] == 'position3d':
-                pos3d_data.append(result)
-                if outputfile:
-                    with open("{0}_3d{1}".format(filename, fileext), 'a+') as outf:
-                        outf.write("{}\n".format(",".join([str(result[key]) for key in result])))
-        except KeyboardInterrupt:
-            break
-        except BaseException as e:
-            raise
+        writers['position2d'] = CaptureWriter("{0}_2d{1}".format(filename, fileext), POS2D_CSV_HEADER)
+        writers['position3d'] = CaptureWriter("{0}_3d{1}".format(filename, fileext), POS3D_CSV_HEADER)
+    wanted = {'position2d': position2d, 'position3d': position3d}
+    stats = CaptureStats()
+
+    lines = read_log_lines(filepath, PLAYER_LOG_FILEPATH)
+    try:
+        for line in lines:
+            now = time.time()
+            epoch = int(now * 1000)
+            try:
+                csv_line = player_csv_line(line, epoch)
+                result = line_parsing_player_log(line, epoch) if keep_data else None
+            except KeyboardInterrupt:
+                raise
+            except BaseException as e:
+                print("error: {}".format(e))
+                print(line)
+                continue
+            if csv_line is None:
+                continue
+            pkt_type = csv_line[:csv_line.index(',')]
+            if not wanted[pkt_type]:
+                continue
+            stats.add(now)
+            if keep_data:
+                data[pkt_type].append(result)
+            if pkt_type in writers:
+                writers[pkt_type].write(csv_line, now)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        lines.close()
+        for writer in writers.values():
+            writer.close()
+        stats.report(total=True)
 
     return data
 
 
-def line_parsing_slam_log(log_line):
+def line_parsing_slam_log(log_line, epoch=None):
     '''
-    parse the line from slam log
+    parse the line from slam log, `epoch` (ms) defaults to now
     '''
     vals = log_line.split(" ")
     result = OrderedDict([
         ('type', vals[1]),
         ('robotime', float(vals[0])),
-        ('epoch', int(time.time() * 1000)),
+        ('epoch', int(time.time() * 1000) if epoch is None else epoch),
     ])
     if vals[1] == 'estimate':
         result['p_x'] = float(vals[2])
@@ -156,85 +356,122 @@ def line_parsing_slam_log(log_line):
 
 def get_slam_log(
     filepath=None,
-    outputfile=None
+    outputfile=None,
+    keep_data=True,
+    binary=False,
+    stream=None,
+    live_filepath=SLAM_LOG_FILEPATH
 ):
     '''
     get SLAM log and parse them into readable results
     @param filepath:    file path of the log, if not specified,
                         directly tail from SLAM_LOG_FILEPATH
     @param outputfile:  output file to write to
+    @param keep_data:   bool flag, whether return the parsed records,
+                        disable for long captures into `outputfile`
+    @param binary:      bool flag, whether write packed SLAM_TRACE_RECORD
+                        records instead of csv lines
+    @param stream:      PoseStreamer to push csv lines to as they come
+    @param live_filepath:   file path of the log to tail
     '''
 
-    counter = 0
-    line_idx = 0
     slam_data = []
 
-    filename = None
-    fileext = None
+    if filepath and not os.path.isfile(filepath):
+        print("{} does not exist".format(filepath))
+        return slam_data
+    if not filepath:
+        signal.signal(signal.SIGTERM, _stop_capture)
+
+    writer = None
     if outputfile:
         filename, fileext = os.path.splitext(outputfile)
-
-    lines = []
-    if filepath:
-        if not os.path.isfile(filepath):
-            print("{} does not exist".format(filepath))
-            return slam_data
-        with open(filepath, "r") as f:
-            lines = f.readlines()
-    else:
-        while not os.path.isfile(SLAM_LOG_FILEPATH):
-            time.sleep(1)
-        subprocess.call("echo '' > {}".format(SLAM_LOG_FILEPATH), shell=True)
-        # tail the log file
-        proc = subprocess.Popen(
-            ['tail', '-F', SLAM_LOG_FILEPATH],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
+        writer = CaptureWriter(
+            "{0}_slam{1}".format(filename, fileext),
+            SLAM_TRACE_MAGIC if binary else SLAM_CSV_HEADER
         )
-
-    with open("{0}_slam{1}".format(filename, fileext), 'w') as outf:
-        outf.write("#type,robotime,epoch,p_x,p_y,yaw\n")
-
-    while 1:
-        if filepath:
-            # if reading from a file, end it at end of file
-            if line_idx >= len(lines):
-                break
-            line = lines[line_idx].rstrip()
-            line_idx += 1
-        else:
-            line = proc.stdout.readline().decode().rstrip()
-        try:
-            result = line_parsing_slam_log(line)
-        except KeyboardInterrupt:
-            break
-        except BaseException as e:
-            print("error: {}".format(e))
-            print(line)
-            continue
-        try:
-            if result['type'] == 'estimate':
-                counter += 1
-                if counter % 100 == 0:
-                    print("data line counter: {}".format(counter))
+    format_record = slam_trace_record if binary else slam_csv_line
+    stats = CaptureStats()
+
+    lines = read_log_lines(filepath, live_filepath)
+    try:
+        for line in lines:
+            now = time.time()
+            epoch = int(now * 1000)
+            try:
+                record = format_record(line, epoch)
+                if stream is not None and record is not None:
+                    stream.send(record if not binary else slam_csv_line(line, epoch), now)
+                result = line_parsing_slam_log(line, epoch) if keep_data else None
+            except KeyboardInterrupt:
+                raise
+            except BaseException as e:
+                print("error: {}".format(e))
+                print(line)
+                continue
+            if record is None:
+                continue
+            stats.add(now)
+            if keep_data:
                 slam_data.append(result)
-                if outputfile:
-                    with open("{0}_slam{1}".format(filename, fileext), 'a+') as outf:
-                        outf.write("{}\n".format(",".join([str(result[key]) for key in result])))
-        except KeyboardInterrupt:
-            break
-        except BaseException as e:
-            raise
+            if writer is not None:
+                writer.write(record, now)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        lines.close()
+        if writer is not None:
+            writer.close()
+        if stream is not None:
+            stream.close()
+            print("streamed {} records, dropped {}".format(stream.sent, stream.dropped))
+        stats.report(total=True)
 
     return slam_data
 
 
+def bench_capture(num):
+    '''
+    time a capture of `num` synthetic slam lines, reopening the output for
+    every line as before against one CaptureWriter
+    '''
+    import tempfile
+    folder = tempfile.mkdtemp()
+    log_fp = os.path.join(folder, "slam.log")
+    with open(log_fp, 'w') as f:
+        for i in range(num):
+            f.write("{:.3f} estimate {:.4f} {:.4f} {:.6f}\n".format(i * 0.05, i % 97 * 0.1, i % 89 * 0.1, i % 7 * 0.5))
+
+    start, start_cpu = time.time(), cpu_time()
+    with open(log_fp) as f:
+        for line in f:
+            result = line_parsing_slam_log(line.rstrip())
+            with open(os.path.join(folder, "reopen.csv"), 'a+') as outf:
+                outf.write("{}\n".format(",".join([str(result[key]) for key in result])))
+    elapsed, cpu = time.time() - start, cpu_time() - start_cpu
+    print("reopen per line: {:.0f} records/s, {:.3f}s cpu".format(num / elapsed, cpu))
+
+    for name, binary in [("writer.csv", False), ("writer.bin", True)]:
+        start, start_cpu = time.time(), cpu_time()
+        get_slam_log(filepath=log_fp, outputfile=os.path.join(folder, name), keep_data=False, binary=binary)
+        elapsed, cpu = time.time() - start, cpu_time() - start_cpu
+        print("capture writer{}: {:.0f} records/s, {:.3f}s cpu, {} bytes".format(
+            " (binary)" if binary else "", num / elapsed, cpu,
+            os.path.getsize(os.path.join(folder, name.replace("writer", "writer_slam")))
+        ))
+
 
 def test(args):
+    if args.bench:
+        bench_capture(args.bench)
     if args.slam:
         get_slam_log(
             filepath=args.filepath,
-            outputfile=args.of
+            outputfile=args.of,
+            keep_data=False,
+            binary=args.binary,
+            stream=PoseStreamer(*parse_stream_address(args.stream)) if args.stream else None,
+            live_filepath=args.live_log
         )
     if args.pos2d or args.pos3d:
         get_player_log(
@@ -282,6 +519,31 @@ if __name__ == "__main__":
         action='store_true',
         help='Get 3d positions'
     )
+    parser.add_argument(
+        '--binary',
+        dest='binary',
+        action='store_true',
+        help='Write SLAM estimates as packed binary trace'
+    )
+    parser.add_argument(
+        '--stream',
+        dest='stream',
+        default=None,
+        help='Specify host:port of a pose receiver to stream SLAM estimates to'
+    )
+    parser.add_argument(
+        '--live-log',
+        dest='live_log',
+        default=SLAM_LOG_FILEPATH,
+        help='Specify SLAM log to tail without --filepath'
+    )
+    parser.add_argument(
+        '--bench',
+        dest='bench',
+        type=int,
+        default=0,
+        help='Time capturing the given number of synthetic slam lines'
+    )
 
     args, __ = parser.parse_known_args()
 
@@ -5,6 +5,8 @@ import os
 import sys
 import pickle
 from time import sleep
+from itertools import islice
+from collections import OrderedDict
 
 from PIL import Image
 from PIL import ImageDraw
@@ -14,6 +16,19 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 from libs.tshark import Tshark
+from libs.parser import SLAM_TRACE_MAGIC
+from libs.pcap_reader import pick_pcap_reader
+from libs.pcap_reader import translate_pcap_native
+from libs.rss_grid import RssGrid
+from libs.sig_columns import macs_fp
+from libs.sig_columns import sig_dtype
+from libs.sig_columns import columns_fp
+from libs.sig_columns import parse_sig_csv
+from libs.sig_columns import load_sig_columns
+from libs.sig_columns import save_sig_columns
+from libs.sig_columns import ensure_sig_columns
+from libs.sig_columns import remove_sig_columns
+from libs.sig_columns import write_npy_header
 
 
 RED = (255, 0, 0, 255)
@@ -21,6 +36,17 @@ PICKLE_MAP_SIZE = 64   # num
 PICKLE_MAP_STEP = 0.1  # meter
 WALL_PENETRATION = -30.0  # dB
 WALL_REFLECTION = -15.0  # dB
+# colors of the scanned floorplan, black/blue/pink/red block, grey/white not
+MAP_BLOCK_COLORS = [(0, 0, 0, 255), (0, 0, 255, 255), (255, 0, 255, 255), (255, 0, 0, 255)]
+MAP_FREE_COLORS = [(125, 125, 125, 255), (255, 255, 255, 255)]
+# numpy view of libs.parser SLAM_TRACE_RECORD
+SLAM_TRACE_DTYPE = np.dtype([
+    ('robotime', '<f8'),
+    ('epoch', '<i8'),
+    ('x', '<f8'),
+    ('y', '<f8'),
+    ('yaw', '<f8'),
+])
 np.set_printoptions(threshold=sys.maxsize)
 
 
@@ -41,42 +67,46 @@ def get_groundtruth_dict(f_gt):
     return gt
 
 
+def rotate_locs(x, y, orient, orientation):
+    '''
+    rotate locations and headings at (0, 0), the dock location
+    '''
+    if (orientation % 4) == 0:
+        return x, y, orient % (2 * np.pi)
+    elif (orientation % 4) == 1:
+        return -y, x, (orient - 0.5 * np.pi) % (2 * np.pi)
+    elif (orientation % 4) == 2:
+        return -x, -y, (orient - np.pi) % (2 * np.pi)
+    return y, -x, (orient + 0.5 * np.pi) % (2 * np.pi)
+
+
 def load_rss_data_with_pkt_types(fp: str, orientation: int) -> dict:
     '''
-    split rss data into multiple types
+    split rss data into multiple types, each as Nx4 array of x, y, rss,
+    orient; reads the cached columns of `fp` if there are any
     '''
+    table, __ = load_sig_columns(fp)
+    if table is None:
+        table, __ = parse_sig_csv(fp)
+    loc_x, loc_y, orient = rotate_locs(table['x'], table['y'], table['orient'], orientation)
+    # only need to take x, y, RSS for now
+    data = np.stack([loc_x, loc_y, table['RSS'], orient], axis=1)
+    # keep types in order of appearance
+    pkt_types, first_idxs = np.unique(table['type'], return_index=True)
     result = {}
-    with open(fp, 'r') as f:
-        lines = f.readlines()
-    for line in lines:
-        if '#' in line:
-            continue
-        data = line.rstrip().split(',')
-        pkt_type = int(data[9])
-        if pkt_type not in result:
-            result[pkt_type] = []
-        # rotate at (0, 0), the dock location
-        if (orientation % 4) is 0:
-            loc_x = float(data[0])
-            loc_y = float(data[1])
-            orient = float(data[2]) % (2 * np.pi)
-        elif (orientation % 4) is 1:
-            loc_x = -float(data[1])
-            loc_y = float(data[0])
-            orient = (float(data[2]) - 0.5 * np.pi) % (2 * np.pi)
-        elif (orientation % 4) is 2:
-            loc_x = -float(data[0])
-            loc_y = -float(data[1])
-            orient = (float(data[2]) - np.pi) % (2 * np.pi)
-        elif (orientation % 4) is 3:
-            loc_x = float(data[1])
-            loc_y = -float(data[0])
-            orient = (float(data[2]) + 0.5 * np.pi) % (2 * np.pi)
-        # only need to take x, y, RSS for now
-        result[pkt_type].append([loc_x, loc_y, float(data[5]), orient])
+    for pkt_type in pkt_types[np.argsort(first_idxs)]:
+        result[int(pkt_type)] = data[table['type'] == pkt_type]
     return result
 
 
+def sort_rss_points(points) -> np.ndarray:
+    '''
+    sort [x, y, rss, orient] points by (x, y) and transpose them into 4xN
+    '''
+    data = np.transpose(np.array(points, dtype=float).reshape(-1, 4))
+    return data[:, np.lexsort((data[1, :], data[0, :]))]
+
+
 def blocking_display_rss_map(
     rss_map: np.ndarray,
     visualize: bool = False,
@@ -108,27 +138,152 @@ def blocking_display_rss_map(
     plt.close()
 
 
+def load_rss_points(fp: str, orientation: int):
+    '''
+    load the points of the most frequent packet type of `fp` as 4xN array
+    of x, y, rss, orient sorted by (x, y)
+    '''
+    # load data and split into different types
+    results = load_rss_data_with_pkt_types(fp, orientation)
+
+    # pick the most frequent type
+    pkt_types = [(key, len(results[key])) for key in results.keys()]
+    pkt_types = sorted(pkt_types, key=lambda x: x[1], reverse=True)
+    print("most frequent data type is {} with {} pkts".format(pkt_types[0][0], pkt_types[0][1]))
+    return pkt_types[0][0], sort_rss_points(results[pkt_types[0][0]])
+
+
+def dump_rss_maps(
+    grid: RssGrid,
+    fp: str,
+    pkt_type: int,
+    labels: list = None,
+    visualize: bool = False,
+    output_map: bool = False,
+    filters=None,
+    sampling: bool = False,
+    out_fp: str = None,
+    writer=None,
+    sample: int = None
+):
+    '''
+    convert binned points of device file `fp` into one map per filter and
+    pickle each next to `fp`, or named after `out_fp` if given; with a
+    `writer` (see libs.dataset) maps are added to it instead of pickled,
+    `sample` being the sample id stored along
+    returns the output paths without extension
+    '''
+    if out_fp is None:
+        out_fp = fp
+    if not isinstance(filters, (list, tuple)):
+        filters = [filters]
+
+    filepaths = []
+    for fff in filters:
+        if sampling:
+            rss_map = grid.sample_map(fff)
+        else:
+            rss_map = grid.median_map(fff)
+
+        filepath = out_fp.replace(
+            ".csv", "{}_pkttype_{}_map{}"
+            .format(
+                "_s{}".format(np.random.randint(0, 999999)) if sampling else "",
+                pkt_type,
+                "" if fff is None else "_{}".format(fff)
+            )
+        )
+
+        if visualize or output_map:
+            blocking_display_rss_map(rss_map, visualize=visualize, output_map=output_map, fp=filepath)
+
+        if writer is not None:
+            writer.add(rss_map, labels, device_name(fp), pkt_type, fff, sample)
+        else:
+            with open("{}.pickle".format(filepath), "wb") as f:
+                pickle.dump([rss_map, labels], f)
+        filepaths.append(filepath)
+    return filepaths
+
+
+def device_name(fp):
+    '''
+    device MAC of a per-device file, its name without extension
+    '''
+    return os.path.splitext(os.path.basename(fp))[0]
+
+
+def dump_rss_samples(
+    grid: RssGrid,
+    fp: str,
+    pkt_type: int,
+    sampling_num: int,
+    labels: list = None,
+    output_map: bool = False,
+    filters=None,
+    stack: bool = False,
+    rng=None,
+    out_fp: str = None,
+    writer=None
+):
+    '''
+    draw `sampling_num` random maps per filter at once from `rng` and pickle
+    them named like dump_rss_maps does, or as one `_samples<N>` pickle of
+    the stacked maps if `stack`, whose image shows the first sample; with
+    a `writer` each sample is added to it instead
+    returns the output paths without extension
+    '''
+    if rng is None:
+        rng = np.random
+    if out_fp is None:
+        out_fp = fp
+    if not isinstance(filters, (list, tuple)):
+        filters = [filters]
+
+    filepaths = []
+    for fff in filters:
+        rss_maps = grid.sample_maps(sampling_num, fff, rng=rng)
+        suffix = "_pkttype_{}_map{}".format(pkt_type, "" if fff is None else "_{}".format(fff))
+        if writer is not None:
+            for sample, rss_map in enumerate(rss_maps):
+                writer.add(rss_map, labels, device_name(fp), pkt_type, fff, sample)
+            stack = True
+        if stack:
+            names = ["_samples{}".format(sampling_num)]
+            rss_maps = [rss_maps]
+        else:
+            names = ["_s{}".format(x) for x in rng.randint(0, 999999, sampling_num)]
+        for name, rss_map in zip(names, rss_maps):
+            filepath = out_fp.replace(".csv", name + suffix)
+            if output_map:
+                blocking_display_rss_map(rss_map[0] if stack else rss_map, output_map=output_map, fp=filepath)
+            if writer is None:
+                with open("{}.pickle".format(filepath), "wb") as f:
+                    pickle.dump([rss_map, labels], f)
+            filepaths.append(filepath)
+    return filepaths
+
+
 def convert_to_pickle_rss(
-    fp: str, 
+    fp: str,
     orientation: int,
     labels: list = None,  # the right groundtruth in rss map pixels
-    visualize: bool = False, 
+    visualize: bool = False,
     output_map: bool = False,
-    filters: int = None,
+    filters=None,
     sampling: bool = False,
     map_dim: tuple = None,
-    map_res: float = None
+    map_res: float = None,
+    writer=None,
+    sample: int = None
 ):
     '''
     modified from Zhuolin
+    `filters` is one filter or a list of them (None for unfiltered), all
+    maps of a list share one load and one binning of the points; maps go
+    to `writer` instead of pickles if given, see dump_rss_maps
+    returns the output paths without extension
     '''
-
-    def find_index(array, lower, upper):
-        return np.where((array >= lower) & (array <= upper))[0]
-
-    # load data and split into different types
-    results = load_rss_data_with_pkt_types(fp, orientation)
-
     # define map dimension
     if map_dim is None:
         map_dim = (PICKLE_MAP_SIZE, PICKLE_MAP_SIZE)
@@ -136,90 +291,126 @@ def convert_to_pickle_rss(
     if map_res is None:
         map_res = PICKLE_MAP_STEP
 
-    # pick the most frequent type
-    pkt_types = [(key, len(results[key])) for key in results.keys()]
-    pkt_types = sorted(pkt_types, key=lambda x: x[1], reverse=True)
-    print("most frequent data type is {} with {} pkts".format(pkt_types[0][0], pkt_types[0][1]))
-    data = results[pkt_types[0][0]]
-
-    # sort it and transpose it
-    data = np.transpose(np.array(sorted(data, key = lambda x: (x[0], x[1]))))
-    loc_x_min = min(data[0, :])
-    loc_x_max = max(data[0, :])
-    loc_y_min = min(data[1, :])
-    loc_y_max = max(data[1, :])
-    loc_x_center = (loc_x_min + loc_x_max) / 2.0
-    loc_y_center = (loc_y_min + loc_y_max) / 2.0
-    
-    # convert it to a map
-    rss_map = np.ones(map_dim) * -85.0
-    factor = 0.75
-
-    for i in range(map_dim[0]):
-        # if i not in rss_map_dict:
-        #     rss_map_dict[i] = {}
-        # search for x_idx
-        upper_bound_x = loc_x_center + map_res * (i - (map_dim[0] / 2) + 0.5)
-        lower_bound_x = upper_bound_x - map_res
-        data_x_idxs = find_index(
-            data[0, :],
-            lower_bound_x - factor * map_res,
-            upper_bound_x + factor * map_res
-        )
-        data_part = data[:, data_x_idxs]
-        if data_part.size is 0:
-            continue
-        data_y_idx = 0
-        for j in range(map_dim[1]):
-            # search for y_idx
-            upper_bound_y = loc_y_center + map_res * (j - (map_dim[1] / 2) + 0.5)
-            lower_bound_y = upper_bound_y - map_res
-            data_y_idxs = find_index(
-                data_part[1, :],
-                lower_bound_y - factor * map_res,
-                upper_bound_y + factor * map_res
-            )
-            data_fullfilled = data_part[2, data_y_idxs]
-            orientation_fullfilled = data_part[3, data_y_idxs]
-            if filters is 0:
-                data_fullfilled = data_fullfilled[(orientation_fullfilled > 1.75 * np.pi) | (orientation_fullfilled < 0.25 * np.pi)]
-            elif filters is 1:
-                data_fullfilled = data_fullfilled[(orientation_fullfilled > 1.25 * np.pi) & (orientation_fullfilled < 1.75 * np.pi)]
-            elif filters is 2:
-                data_fullfilled = data_fullfilled[(orientation_fullfilled > 0.75 * np.pi) & (orientation_fullfilled < 1.25 * np.pi)]
-            elif filters is 3:
-                data_fullfilled = data_fullfilled[(orientation_fullfilled > 0.25 * np.pi) & (orientation_fullfilled < 0.75 * np.pi)]
-            elif filters is 4:
-                data_fullfilled = data_fullfilled[(orientation_fullfilled > 1.5 * np.pi) | (orientation_fullfilled < 0.5 * np.pi)]
-            elif filters is 5:
-                data_fullfilled = data_fullfilled[(orientation_fullfilled > 0.5 * np.pi) & (orientation_fullfilled < 1.5 * np.pi)]
-            if data_fullfilled.size:
-                if sampling:
-                    rss_map[i, j] = max(np.random.choice(data_fullfilled, 1)[0], -85.0)
-                else:
-                    rss_map[i, j] = max(np.median(data_fullfilled), -85.0)
-
-    filepath = fp.replace(
-        ".csv", "{}_pkttype_{}_map{}"
-        .format(
-            "_s{}".format(np.random.randint(0, 999999)) if sampling else "",
-            pkt_types[0][0], 
-            "" if filters is None else "_{}".format(filters)
-        )
+    pkt_type, data = load_rss_points(fp, orientation)
+
+    # bin it once, then convert it to a map per filter
+    grid = RssGrid(data, map_dim, map_res)
+    return dump_rss_maps(
+        grid, fp, pkt_type,
+        labels=labels,
+        visualize=visualize,
+        output_map=output_map,
+        filters=filters,
+        sampling=sampling,
+        writer=writer,
+        sample=sample
     )
 
-    if visualize or output_map:
-        blocking_display_rss_map(rss_map, visualize=visualize, output_map=output_map, fp=filepath)
 
-    with open("{}.pickle".format(filepath), "wb") as f:
-        pickle.dump([rss_map, labels], f)
+def convert_to_pickle_samples(
+    fp: str,
+    orientation: int,
+    sampling_num: int,
+    labels: list = None,
+    output_map: bool = False,
+    filters=None,
+    stack: bool = False,
+    map_dim: tuple = None,
+    map_res: float = None,
+    rng=None,
+    writer=None
+):
+    '''
+    load and bin device file `fp` once, then draw all `sampling_num`
+    random maps per filter in one go, see dump_rss_samples
+    returns the output paths without extension
+    '''
+    if map_dim is None:
+        map_dim = (PICKLE_MAP_SIZE, PICKLE_MAP_SIZE)
+    if map_res is None:
+        map_res = PICKLE_MAP_STEP
+    pkt_type, data = load_rss_points(fp, orientation)
+    grid = RssGrid(data, map_dim, map_res)
+    return dump_rss_samples(
+        grid, fp, pkt_type, sampling_num,
+        labels=labels,
+        output_map=output_map,
+        filters=filters,
+        stack=stack,
+        rng=rng,
+        writer=writer
+    )
+
 
+class _FilePool():
+    '''
+    bounded pool of buffered binary files opened for appending, the least
+    recently used one gets closed when the pool is full
+    '''
 
-def extract_dev_from_combined(fp, minimalCounts=100, cleanup=True):
+    def __init__(self, max_open=64, buffering=1 << 18):
+        self.max_open = max_open
+        self.buffering = buffering
+        self.files = OrderedDict()
+        self.created = set()
+
+    def get(self, fp, on_create=None):
+        '''
+        file handle of `fp`, truncated the first time the pool sees it and
+        passed to `on_create` for writing a header
+        '''
+        if fp in self.files:
+            self.files.move_to_end(fp)
+            return self.files[fp]
+        if len(self.files) >= self.max_open:
+            __, f = self.files.popitem(last=False)
+            f.close()
+        if fp in self.created:
+            f = open(fp, 'ab', buffering=self.buffering)
+        else:
+            f = open(fp, 'wb', buffering=self.buffering)
+            self.created.add(fp)
+            if on_create is not None:
+                on_create(f)
+        self.files[fp] = f
+        return f
+
+    def close(self):
+        while self.files:
+            __, f = self.files.popitem(last=False)
+            f.close()
+
+
+def _count_macs(fp, table, chunk):
+    '''
+    packets per MAC of combined file `fp` in order of appearance, from its
+    cached columns if given, otherwise by streaming the csv
+    '''
+    counts = OrderedDict()
+    if table is not None:
+        total = np.zeros(0, dtype=int)
+        for start in range(0, len(table), chunk):
+            part = np.bincount(table['txMAC'][start:start + chunk])
+            total = np.pad(total, (0, max(part.size - total.size, 0)))
+            total[:part.size] += part
+        for code, count in enumerate(total.tolist()):
+            counts[code] = count
+        return counts
+    with open(fp, 'rb') as f:
+        f.readline()
+        for line in f:
+            addr = line.split(b",", 4)[3]
+            counts[addr] = counts.get(addr, 0) + 1
+    return counts
+
+
+def extract_dev_from_combined(fp, minimalCounts=100, cleanup=True, chunk=65536, max_open=64):
     '''
     extract each device data from combined file `fp`
+    streams `fp` twice, counting packets per device and then appending
+    the qualified ones through at most `max_open` files, so memory stays
+    bounded by `chunk` lines whatever the size of `fp`
     '''
-    files = {}
     folderpath, ext = os.path.splitext(fp)
 
     try:
@@ -229,98 +420,191 @@ def extract_dev_from_combined(fp, minimalCounts=100, cleanup=True):
     except BaseException:
         raise
 
-    with open(fp) as f:
-        lines = f.readlines()
-
-    for line in lines[1:]:
-        tmp = line.rstrip().split(",")
-        addr = tmp[3].replace(":", "")
-        if addr not in files:
-            files[addr] = []
-        files[addr].append(",".join(tmp[:3] + tmp[4:]))
-
-    for addr in list(files.keys()):
-        if len(files[addr]) < minimalCounts:
-            del files[addr]
-
-    title = lines[0].rstrip().split(",")
-    headline = ",".join(title[:3] + title[4:]) + "\n"
-    filepaths = []
-
-    for addr in files.keys():
-        filepath = "{}/{}.csv".format(folderpath, addr)
-        filepaths.append(filepath)
-        with open(filepath, "w") as f:
-            f.write(headline)
-            for line in files[addr]:
-                f.write("{}\n".format(line))
+    table, macs = load_sig_columns(fp)
+    counts = _count_macs(fp, table, chunk)
+    keys = [key for key, count in counts.items() if count >= minimalCounts]
+    if table is not None:
+        addrs = {code: macs[code] for code in keys}
+    else:
+        addrs = {key: key.decode() for key in keys}
+    filepaths = {key: "{}/{}.csv".format(folderpath, addrs[key].replace(":", "")) for key in keys}
 
-    if len(files) > 0 and cleanup:
+    pool = _FilePool(max_open=max_open)
+    try:
+        with open(fp, 'rb') as f:
+            title = f.readline().rstrip().split(b",")
+            headline = b",".join(title[:3] + title[4:]) + b"\n"
+            start = 0
+            while True:
+                lines = list(islice(f, chunk))
+                if not lines:
+                    break
+                if table is not None:
+                    rows = np.array(table[start:start + len(lines)])
+                    line_keys = rows['txMAC'].tolist()
+                else:
+                    line_keys = [line.split(b",", 4)[3] for line in lines]
+                start += len(lines)
+                # group lines of the chunk by device, keeping their order
+                groups = OrderedDict()
+                for i, key in enumerate(line_keys):
+                    if key in filepaths:
+                        groups.setdefault(key, []).append(i)
+                for key, idxs in groups.items():
+                    out = pool.get(filepaths[key], lambda out: out.write(headline))
+                    parts = [lines[i].rstrip().split(b",", 4) for i in idxs]
+                    out.write(b"".join(b",".join(tmp[:3] + tmp[4:]) + b"\n" for tmp in parts))
+                    if table is None:
+                        continue
+                    dev_rows = rows[idxs]
+                    dev_rows['txMAC'] = 0
+                    out = pool.get(
+                        columns_fp(filepaths[key]),
+                        lambda out: write_npy_header(out, rows.dtype, counts[key])
+                    )
+                    out.write(dev_rows.tobytes())
+    finally:
+        pool.close()
+
+    if table is not None:
+        for key in keys:
+            with open(macs_fp(filepaths[key]), 'w') as f:
+                f.write("{}\n".format(addrs[key]))
+
+    if len(keys) > 0 and cleanup:
         os.remove(fp)
+        remove_sig_columns(fp)
 
-    return filepaths
+    return [filepaths[key] for key in keys]
 
 
-def combine_sig_loc(sig_fp, loc_fp):
+def load_slam_trace(loc_fp):
     '''
-    append location to signal data
+    load slam estimates of `loc_fp`, csv or binary trace of get_loc_est.py,
+    as arrays of epoch (second), x, y, yaw
+    '''
+    with open(loc_fp, 'rb') as f:
+        content = f.read()
+    if content.startswith(SLAM_TRACE_MAGIC):
+        # a record cut off by stopping the recorder is dropped
+        num = (len(content) - len(SLAM_TRACE_MAGIC)) // SLAM_TRACE_DTYPE.itemsize
+        trace = np.frombuffer(content, dtype=SLAM_TRACE_DTYPE, count=num, offset=len(SLAM_TRACE_MAGIC))
+        if not num:
+            raise ValueError("no slam estimates in {}".format(loc_fp))
+        return trace['epoch'] / 1000.0, trace['x'].copy(), trace['y'].copy(), trace['yaw'].copy()
+    loc_data = [line.rstrip().split(',') for line in content.decode().splitlines()[1:]]
+    if not loc_data:
+        raise ValueError("no slam estimates in {}".format(loc_fp))
+    epochs = np.array([float(tmp[2]) / 1000.0 for tmp in loc_data])
+    xs = np.array([float(tmp[3]) for tmp in loc_data])
+    ys = np.array([float(tmp[4]) for tmp in loc_data])
+    yaws = np.array([float(tmp[5]) for tmp in loc_data])
+    return epochs, xs, ys, yaws
+
+
+def join_sig_loc(sig_epochs, loc_epochs, interpolate=False):
+    '''
+    match each packet to the first slam estimate at or after it (the last
+    one for packets after the trace), never going back in the trace;
+    `loc_epochs` must be non-decreasing
+    returns matched estimate indexes and, if `interpolate`, the weight of
+    each match against its previous estimate
+    '''
+    idxs = np.searchsorted(loc_epochs, sig_epochs, side='left')
+    idxs = np.minimum(idxs, loc_epochs.size - 1)
+    idxs = np.maximum.accumulate(idxs) if idxs.size else idxs
+    if not interpolate:
+        return idxs, None
+    prev_idxs = np.maximum(idxs - 1, 0)
+    spans = loc_epochs[idxs] - loc_epochs[prev_idxs]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weights = (sig_epochs - loc_epochs[prev_idxs]) / spans
+    weights[~(spans > 0)] = 1.0
+    return idxs, np.clip(weights, 0.0, 1.0)
+
+
+def combine_sig_loc(sig_fp, loc_fp, interpolate=False, chunk=65536):
+    '''
+    append location to signal data, either of the next slam estimate or,
+    if `interpolate`, linearly interpolated between the two around it
     '''
     filename, ext = os.path.splitext(loc_fp)
-    with open(sig_fp) as f:
-        sig_data = f.readlines()
-    with open(loc_fp) as f:
-        loc_data = f.readlines()
-    i_s = 1  # remove first line on info
-    i_l = 1  # remove first line on info
-    len_sig = len(sig_data)
-    len_loc = len(loc_data)
-    min_x = float('inf')
-    max_x = float('-inf')
-    min_y = float('inf')
-    max_y = float('-inf')
+    sig_table, macs = ensure_sig_columns(sig_fp)
+    loc_epochs, loc_xs, loc_ys, loc_yaws = load_slam_trace(loc_fp)
+    idxs, weights = join_sig_loc(sig_table['time'], loc_epochs, interpolate)
+
+    # extents of the estimates the join walked through
+    if idxs.size:
+        last = idxs[-1] + 1
+        min_x, max_x = float(loc_xs[:last].min()), float(loc_xs[:last].max())
+        min_y, max_y = float(loc_ys[:last].min()), float(loc_ys[:last].max())
+    else:
+        min_x = min_y = float('inf')
+        max_x = max_y = float('-inf')
+
+    if interpolate:
+        prev_idxs = np.maximum(idxs - 1, 0)
+        xs = loc_xs[prev_idxs] + weights * (loc_xs[idxs] - loc_xs[prev_idxs])
+        ys = loc_ys[prev_idxs] + weights * (loc_ys[idxs] - loc_ys[prev_idxs])
+        # turn along the shorter arc between the two headings
+        turns = (loc_yaws[idxs] - loc_yaws[prev_idxs] + np.pi) % (2 * np.pi) - np.pi
+        yaws = loc_yaws[prev_idxs] + weights * turns
+    else:
+        xs = loc_xs[idxs]
+        ys = loc_ys[idxs]
+        yaws = loc_yaws[idxs]
+
+    names = ['x', 'y', 'orient'] + list(sig_table.dtype.names)
+    table = np.empty(len(sig_table), dtype=sig_dtype(names))
+    for name in sig_table.dtype.names:
+        table[name] = sig_table[name]
+    table['x'] = xs
+    table['y'] = ys
+    table['orient'] = yaws
+
     outfile = "{0}_sig.csv".format(filename.rstrip("_loc"))
-    with open(outfile, 'w') as f:
-        f.write("#x,y,orient," + sig_data[0][1:])
-        prev_i_s = 0
-        prev_i_l = 0
-        while i_s < len_sig:
-            if prev_i_s != i_s:
-                sig_tmp = sig_data[i_s].rstrip().split(',')
-                prev_i_s = i_s
-            if prev_i_l != i_l:
-                loc_tmp = loc_data[i_l].rstrip().split(',')
-                prev_i_l = i_l
-            epoch_sig = float(sig_tmp[1])
-            epoch_loc = float(loc_tmp[2]) / 1000.0
-            x = float(loc_tmp[3])
-            y = float(loc_tmp[4])
-            if x > max_x:
-                max_x = x
-            if x < min_x:
-                min_x = x
-            if y > max_y:
-                max_y = y
-            if y < min_y:
-                min_y = y
-            orientation = float(loc_tmp[5])
-            if epoch_sig > epoch_loc and i_l < len_loc - 1:
-                i_l += 1
-                continue
-            f.write("{},{},{},{}\n".format(x, y, orientation, ",".join(sig_tmp)))
-            i_s += 1
+    with open(sig_fp) as sig_f, open(outfile, 'w') as f:
+        f.write("#x,y,orient," + sig_f.readline()[1:])
+        if not interpolate:
+            prefixes = [
+                "{},{},{},".format(x, y, yaw)
+                for x, y, yaw in zip(loc_xs.tolist(), loc_ys.tolist(), loc_yaws.tolist())
+            ]
+        for start in range(0, len(table), chunk):
+            end = min(start + chunk, len(table))
+            if interpolate:
+                rows = zip(xs[start:end].tolist(), ys[start:end].tolist(), yaws[start:end].tolist())
+                prefix_part = ["{},{},{},".format(x, y, yaw) for x, y, yaw in rows]
+            else:
+                prefix_part = [prefixes[i] for i in idxs[start:end].tolist()]
+            f.write("".join(
+                "{}{}\n".format(prefix, sig_f.readline().rstrip()) for prefix in prefix_part
+            ))
+
+    save_sig_columns(outfile, table, macs)
     return outfile, ((min_x, min_y), (max_x, max_y))
 
 
-def translate_pcap(pcap_fp, is_csi):
+def translate_pcap(pcap_fp, is_csi, reader=None):
+    '''
+    `reader` of rss captures is `tshark` or `native`, by default tshark if
+    it is installed
+    '''
     tshark = Tshark()
     filepath, ext = os.path.splitext(pcap_fp)
     outputfp = "{}.csv".format(filepath)
     if os.path.isfile(outputfp):
+        if not is_csi:
+            ensure_sig_columns(outputfp)
         return outputfp
     if is_csi:
         tshark.translateCSI(pcap_fp, outputfp)
     else:
-        tshark.translatePcap(pcap_fp, outputfp)
+        if pick_pcap_reader(reader) == 'native':
+            translate_pcap_native(pcap_fp, outputfp)
+        else:
+            tshark.translatePcap(pcap_fp, outputfp)
+        ensure_sig_columns(outputfp)
     return outputfp
 
 
@@ -365,32 +649,119 @@ def get_locs_from_slam_data(slam_data):
     return locs_data
 
 
+ORIENT_OFFSETS = np.arange(-4, 5, 2)  # window of 5x5 pixels with stride 2
+
+
 def estimate_orientation(map_dim, reflections):
-    orientations = np.empty(map_dim, dtype=float) * float('nan')
-    for i in range(map_dim[0]):
-        for j in range(map_dim[1]):
-            if reflections[i, j] < -80.0:
-                continue
-            xs = []
-            ys = []
-            for off_i in range(-4, 5, 2):
-                end_i = min(max(i + off_i, 0), map_dim[0]-1)
-                for off_j in range(-4, 5, 2):
-                    end_j = min(max(j + off_j, 0), map_dim[1]-1)
-                    if reflections[end_i, end_j] > -100.0:
-                        if end_i not in xs or end_j not in ys:
-                            xs.append(end_i)
-                            ys.append(end_j)
-            if len(xs) is 0:
-                continue
-            if len(set(xs)) == 1:
-                coefs = [None, 999.0]
-            else:
-                coefs = np.polynomial.polynomial.polyfit(xs, ys, 1)
-            orientations[i, j] = round(np.arctan2(coefs[1], 1.0) * 180 / np.pi, 1)
+    '''
+    orientation in degree of the wall through each pixel not below -80,
+    from a line fit over the wall pixels of its window, clipped at the map
+    borders; 89.9 for vertical walls, nan elsewhere
+    all pixels go at once: a window pixel joins the fit unless both its row
+    and its column were taken already, scanning the window row by row like
+    the original loop, and the slope comes from the sums of the fit
+    '''
+    orientations = np.full(map_dim, np.nan)
+    centers = np.argwhere(~(reflections < -80.0))
+    if not centers.size:
+        return orientations
+    size = ORIENT_OFFSETS.size
+    span = 2 * ORIENT_OFFSETS[-1] + 1
+    win_rows = np.clip(centers[:, :1] + ORIENT_OFFSETS, 0, map_dim[0] - 1)
+    win_cols = np.clip(centers[:, 1:] + ORIENT_OFFSETS, 0, map_dim[1] - 1)
+    valid = reflections[win_rows[:, :, None], win_cols[:, None, :]] > -100.0
+    # window coordinates relative to the center, small exact integers
+    rel_rows = win_rows - centers[:, :1]
+    rel_cols = win_cols - centers[:, 1:]
+
+    idxs = np.arange(len(centers))
+    row_taken = np.zeros((len(centers), span), dtype=bool)
+    col_taken = np.zeros((len(centers), span), dtype=bool)
+    taken = np.zeros((len(centers), size, size), dtype=bool)
+    for a in range(size):
+        row_slot = rel_rows[:, a] - ORIENT_OFFSETS[0]
+        for b in range(size):
+            col_slot = rel_cols[:, b] - ORIENT_OFFSETS[0]
+            take = valid[:, a, b] & ~(row_taken[idxs, row_slot] & col_taken[idxs, col_slot])
+            row_taken[idxs, row_slot] |= take
+            col_taken[idxs, col_slot] |= take
+            taken[:, a, b] = take
+
+    # least squares sums of cols over rows
+    xs = np.broadcast_to(rel_rows[:, :, None], taken.shape)
+    ys = np.broadcast_to(rel_cols[:, None, :], taken.shape)
+    num = taken.sum(axis=(1, 2))
+    sum_x = (xs * taken).sum(axis=(1, 2))
+    sum_y = (ys * taken).sum(axis=(1, 2))
+    sum_xy = (xs * ys * taken).sum(axis=(1, 2))
+    sum_xx = (xs * xs * taken).sum(axis=(1, 2))
+    denom = num * sum_xx - sum_x * sum_x
+    slopes = np.full(len(centers), 999.0)
+    fitted = denom != 0
+    slopes[fitted] = (num * sum_xy - sum_x * sum_y)[fitted] / denom[fitted]
+    angles = np.round(np.arctan2(slopes, 1.0) * 180 / np.pi, 1)
+    angles[num == 0] = np.nan
+    orientations[centers[:, 0], centers[:, 1]] = angles
     return orientations
 
 
+def pack_colors(rgba):
+    '''
+    rgba tuples, or an array with rgba last, packed into one uint32 each
+    '''
+    rgba = np.asarray(rgba, dtype=np.uint32)
+    return (rgba[..., 0] << 24) | (rgba[..., 1] << 16) | (rgba[..., 2] << 8) | rgba[..., 3]
+
+
+def pixel_indexes(idxs, size):
+    '''
+    integer pixel indexes of float `idxs` along an image axis of `size`,
+    truncated and wrapped if negative like PIL pixel access does
+    '''
+    idxs = np.trunc(idxs).astype(int)
+    if idxs.size and (idxs.min() < -size or idxs.max() >= size):
+        raise IndexError("image index out of range")
+    return idxs
+
+
+def sample_floor_map(map_image, orientation, center_x_val, center_y_val, map_dim, map_res):
+    '''
+    1 for each cell of the `map_dim` map around the measurement center
+    whose 2x2 sampled pixels of the rgba `map_image` hit a wall, rotated
+    along the orientation
+    '''
+    floor_map = np.zeros(map_dim)
+    map_pixels = pack_colors(np.asarray(map_image))
+
+    # calculate center of the measurement
+    center_x = int(map_image.size[0] / 2 + center_x_val * 20)
+    center_y = int(map_image.size[1] / 2 - center_y_val * 20)
+
+    # 2x2 pixels sampled for each cell, colors[i, j, kk, ll]
+    idx_x = center_x + map_res * 20 * (np.arange(map_dim[0]) - (map_dim[0] / 2))
+    idx_y = center_y - map_res * 20 * (np.arange(map_dim[1]) - (map_dim[1] / 2))
+    xs = pixel_indexes(idx_x[:, None] + np.arange(2), map_image.size[0])
+    ys = pixel_indexes(idx_y[:, None] + np.arange(2), map_image.size[1])
+    colors = map_pixels[ys[None, :, None, :], xs[:, None, :, None]]
+    is_blocked = np.isin(colors, pack_colors(MAP_BLOCK_COLORS)).any(axis=(2, 3))
+    # free cells are told apart by their last sampled pixel
+    unknown = ~is_blocked & ~np.isin(colors[:, :, 1, 1], pack_colors(MAP_FREE_COLORS))
+    if unknown.any():
+        print("unknown color in {} cells".format(np.count_nonzero(unknown)))
+
+    # rotate blocked cells along the orientation
+    ii, jj = np.nonzero(is_blocked)
+    if orientation % 4 == 0:
+        floor_map[ii, jj] = 1
+    elif orientation % 4 == 1:
+        floor_map[map_dim[1] - jj - 1, ii] = 1
+    elif orientation % 4 == 2:
+        floor_map[map_dim[0] - ii - 1, map_dim[1] - jj - 1] = 1
+    elif orientation % 4 == 3:
+        floor_map[jj, map_dim[1] - ii - 1] = 1
+    return floor_map
+
+
 def build_map(
     f_map,
     orientation,
@@ -399,25 +770,22 @@ def build_map(
     visualize=False,
     output_map=False,
     map_dim=None,
-    map_res=None
+    map_res=None,
+    out_fp=None
 ):
     '''
     draws the path into the map. Returns the new map as a BytesIO
     modded from https://github.com/dgiese/dustcloud/blob/71f7af3e2b9607548bcd845aca251326128f742c/dustcloud/build_map.py
+    `out_fp` is the output path without extension, by default the image
+    goes next to `f_map` and the pickle as `_floormap.pickle` in place of
+    `_map.ppm`
+    returns the written filepaths
     '''
-    grey = (125, 125, 125, 255)
-    white = (255, 255, 255, 255)
-    blue = (0, 0, 255, 255)
-    pink = (255, 0, 255, 255)
-    red = (255, 0, 0, 255)
-    black = (0, 0, 0, 255)
-
     # define map dimension
     if map_dim is None:
         map_dim = (PICKLE_MAP_SIZE, PICKLE_MAP_SIZE)
     if map_res is None:
         map_res = PICKLE_MAP_STEP
-    floor_map = np.zeros(map_dim)
 
     # define map center x,y
     center_x_val = (minmax_xys[1][0] + minmax_xys[0][0]) / 2
@@ -429,34 +797,13 @@ def build_map(
 
     map_image = Image.open(io.BytesIO(map_image_data))
     map_image = map_image.convert('RGBA')
-    map_pix = map_image.load()
-
-    # calculate center of the measurement
-    center_x = int(map_image.size[0] / 2 + center_x_val * 20)
-    center_y = int(map_image.size[1] / 2 - center_y_val * 20)
-
-    for i in range(map_dim[0]):
-        idx_x = center_x + map_res * 20 * (i - (map_dim[0] / 2))
-        for j in range(map_dim[1]):
-            idx_y = center_y - map_res * 20 * (j - (map_dim[1] / 2))
-            is_blocked = False
-            for kk in range(2):
-                for ll in range(2):
-                    color = map_pix[idx_x + kk, idx_y + ll]
-                    is_blocked = is_blocked or (color in [black, blue, pink, red])
-            if is_blocked:
-                if orientation % 4 == 0:
-                    floor_map[i, j] = 1
-                elif orientation % 4 == 1:
-                    floor_map[map_dim[1] - j - 1, i] = 1
-                elif orientation % 4 == 2:
-                    floor_map[map_dim[0] - i - 1, map_dim[1] - j - 1] = 1
-                elif orientation % 4 == 3:
-                    floor_map[j, map_dim[1] - i - 1] = 1
-            elif color not in [grey, white]:
-                print("unknown color: {}".format(color))
+    floor_map = sample_floor_map(map_image, orientation, center_x_val, center_y_val, map_dim, map_res)
 
     filepath, ext = os.path.splitext(f_map)
+    pickle_fp = filepath.replace("_map", "_floormap.pickle")
+    if out_fp is not None:
+        filepath = out_fp
+        pickle_fp = "{}.pickle".format(out_fp)
 
     if visualize or output_map:
         blocking_display_rss_map(
@@ -481,16 +828,17 @@ def build_map(
     #     vmax=100
     # )
 
-    with open(filepath.replace("_map", "_floormap.pickle"), "wb") as f:
+    with open(pickle_fp, "wb") as f:
         pickle.dump([penetrations, reflections, orientations], f)
+    if output_map:
+        return [pickle_fp, "{}.png".format(filepath)]
+    return [pickle_fp]
 
 
 def test(args):
     if args.loc and args.map:
-        with open(args.loc) as f:
-            # skip the first line which is coumn names
-            slam_data = f.readlines()[1:]
-        locs_data = get_locs_from_slam_data(slam_data)
+        __, xs, ys, __ = load_slam_trace(args.loc)
+        locs_data = [(x, y, RED) for x, y in zip(xs.tolist(), ys.tolist())]
         with open(args.map, 'rb') as f:
             map_image_data = f.read()
         augmented_map = build_map(locs_data, map_image_data)
@@ -0,0 +1,627 @@
+import os
+import sys
+import mmap
+import time
+import shutil
+import struct
+import tempfile
+
+
+SIG_CSV_HEADER = "#txMAC,time,time_rel,RSS,noise,frameLen,channelFreq,type,fragNum\n"
+
+LINKTYPE_IEEE802_11 = 105
+LINKTYPE_IEEE802_11_RADIOTAP = 127
+
+PCAP_MAGIC_US = 0xa1b2c3d4
+PCAP_MAGIC_NS = 0xa1b23c4d
+PCAPNG_SHB = 0x0a0d0d0a
+PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+PCAPNG_IDB = 1
+PCAPNG_OPB = 2
+PCAPNG_EPB = 6
+PCAPNG_IF_TSRESOL = 9
+PCAPNG_IF_TSOFFSET = 14
+
+# radiotap field bit: (alignment, size), fields we read are
+# dBm antenna signal, dBm antenna noise and channel
+RADIOTAP_FIELDS = {
+    0: (8, 8),  # tsft
+    1: (1, 1),  # flags
+    2: (1, 1),  # rate
+    3: (2, 4),  # channel
+    4: (1, 2),  # fhss
+    5: (1, 1),  # dbm antenna signal
+    6: (1, 1),  # dbm antenna noise
+    7: (2, 2),  # lock quality
+    8: (2, 2),  # tx attenuation
+    9: (2, 2),  # db tx attenuation
+    10: (1, 1),  # dbm tx power
+    11: (1, 1),  # antenna
+    12: (1, 1),  # db antenna signal
+    13: (1, 1),  # db antenna noise
+    14: (2, 2),  # rx flags
+    15: (2, 2),  # tx flags
+    16: (1, 1),  # rts retries
+    17: (1, 1),  # data retries
+    18: (4, 8),  # xchannel
+    19: (1, 3),  # mcs
+    20: (4, 8),  # a-mpdu status
+    21: (2, 12),  # vht
+    22: (8, 12),  # timestamp
+    23: (2, 12),  # he
+    24: (2, 12),  # he-mu
+    25: (2, 6),  # he-mu-other-user
+    26: (1, 1),  # 0-length-psdu
+    27: (2, 4),  # l-sig
+}
+RT_CHANNEL = 3
+RT_DBM_ANTSIGNAL = 5
+RT_DBM_ANTNOISE = 6
+RT_TLV = 28
+RT_RADIOTAP_NS = 29
+RT_VENDOR_NS = 30
+RT_EXT = 31
+
+# control frame subtypes carrying a transmitter address: beamforming
+# report poll, ndp announcement, block ack req, block ack, ps-poll, rts,
+# cf-end, cf-end + cf-ack; cts and ack only have a receiver address
+CTRL_SUBTYPES_WITH_TA = {4, 5, 8, 9, 10, 11, 14, 15}
+
+WRITE_BATCH = 65536  # lines written at a time
+PCAP_READERS = ['tshark', 'native']
+
+
+def pick_pcap_reader(reader=None):
+    '''
+    `reader` if given, otherwise tshark if it is installed
+    '''
+    if reader is not None:
+        return reader
+    return 'tshark' if shutil.which('tshark') is not None else 'native'
+
+
+def radiotap_layout(buf, start, rt_len):
+    '''
+    walk the radiotap header at `start` of `rt_len` bytes
+    returns offsets relative to `start` of the first channel, dBm signal and
+    dBm noise fields (None if absent), and whether the offsets only depend
+    on the present words, i.e. no vendor namespace is in between
+    '''
+    end = start + rt_len
+    words = []
+    pos = start + 4
+    while pos + 4 <= end:
+        word = struct.unpack_from('<I', buf, pos)[0]
+        words.append(word)
+        pos += 4
+        if not word & (1 << RT_EXT):
+            break
+    found = {RT_CHANNEL: None, RT_DBM_ANTSIGNAL: None, RT_DBM_ANTNOISE: None}
+    fixed = True
+    in_radiotap = True
+    bit_base = 0
+    vendor_skip = 0
+    for word in words:
+        if in_radiotap:
+            for bit in range(RT_TLV):
+                if not word & (1 << bit):
+                    continue
+                field = RADIOTAP_FIELDS.get(bit + bit_base)
+                if field is None:
+                    # unknown field size, nothing after it can be located
+                    return found, fixed
+                align, size = field
+                pos += -(pos - start) % align
+                if bit + bit_base in found and found[bit + bit_base] is None:
+                    found[bit + bit_base] = pos - start
+                pos += size
+            if word & (1 << RT_TLV):
+                return found, fixed
+        else:
+            pos += vendor_skip
+        if word & (1 << RT_RADIOTAP_NS):
+            in_radiotap = True
+            bit_base = 0
+        elif word & (1 << RT_VENDOR_NS):
+            # oui, sub namespace and skip length of the vendor data
+            pos += -(pos - start) % 2
+            if pos + 6 > end:
+                return found, fixed
+            vendor_skip = struct.unpack_from('<H', buf, pos + 4)[0]
+            pos += 6
+            in_radiotap = False
+            fixed = False
+        else:
+            bit_base += 32
+    return found, fixed
+
+
+def wlan_fields(buf, start, length):
+    '''
+    transmitter address, type_subtype and fragment number of the 802.11
+    frame at `start`, None if the frame has no transmitter address
+    '''
+    if length < 2:
+        return None
+    fc = buf[start]
+    fc_type = (fc >> 2) & 0x3
+    subtype = fc >> 4
+    if fc_type == 1:
+        if subtype not in CTRL_SUBTYPES_WITH_TA or length < 16:
+            return None
+        return buf[start + 10:start + 16], (fc_type << 4) | subtype, ''
+    if fc_type == 3 or length < 16:
+        return None
+    frag = str(buf[start + 22] & 0xf) if length >= 24 else ''
+    return buf[start + 10:start + 16], (fc_type << 4) | subtype, frag
+
+
+def _iter_pcap(buf):
+    '''
+    yields (timestamp ns, linktype, offset, captured length, original length)
+    of each record of a pcap file
+    '''
+    magic = struct.unpack_from('<I', buf, 0)[0]
+    if magic in (PCAP_MAGIC_US, PCAP_MAGIC_NS):
+        endian = '<'
+    else:
+        endian = '>'
+        magic = struct.unpack_from('>I', buf, 0)[0]
+    ts_scale = 1 if magic == PCAP_MAGIC_NS else 1000
+    linktype = struct.unpack_from(endian + 'I', buf, 20)[0] & 0xffff
+    record = struct.Struct(endian + 'IIII')
+    pos = 24
+    size = len(buf)
+    while pos + 16 <= size:
+        ts_sec, ts_frac, cap_len, orig_len = record.unpack_from(buf, pos)
+        pos += 16
+        if pos + cap_len > size:
+            break
+        yield ts_sec * 1000000000 + ts_frac * ts_scale, linktype, pos, cap_len, orig_len
+        pos += cap_len
+
+
+def _pcapng_options(buf, pos, end, endian):
+    '''
+    (code, offset, length) of each option in [pos, end)
+    '''
+    while pos + 4 <= end:
+        code, length = struct.unpack_from(endian + 'HH', buf, pos)
+        if code == 0:
+            break
+        yield code, pos + 4, length
+        pos += 4 + length + (-length % 4)
+
+
+def _iter_pcapng(buf):
+    '''
+    yields (timestamp ns, linktype, offset, captured length, original length)
+    of each packet block of a pcapng file
+    '''
+    size = len(buf)
+    pos = 0
+    endian = '<'
+    interfaces = []
+    while pos + 12 <= size:
+        block_type = struct.unpack_from(endian + 'I', buf, pos)[0]
+        if block_type == PCAPNG_SHB:
+            # a new section may switch byte order and resets interfaces
+            if struct.unpack_from('<I', buf, pos + 8)[0] == PCAPNG_BYTE_ORDER_MAGIC:
+                endian = '<'
+            else:
+                endian = '>'
+            interfaces = []
+        block_len = struct.unpack_from(endian + 'I', buf, pos + 4)[0]
+        if block_len < 12 or pos + block_len > size:
+            break
+        body = pos + 8
+        end = pos + block_len - 4
+        if block_type == PCAPNG_IDB:
+            linktype = struct.unpack_from(endian + 'H', buf, body)[0]
+            # ticks per second and offset in seconds of the timestamps
+            tsresol = 1000000
+            tsoffset = 0
+            for code, offset, length in _pcapng_options(buf, body + 8, end, endian):
+                if code == PCAPNG_IF_TSRESOL and length >= 1:
+                    value = buf[offset]
+                    tsresol = 2 ** (value & 0x7f) if value & 0x80 else 10 ** value
+                elif code == PCAPNG_IF_TSOFFSET and length >= 8:
+                    tsoffset = struct.unpack_from(endian + 'q', buf, offset)[0]
+            interfaces.append((linktype, tsresol, tsoffset))
+        elif block_type in (PCAPNG_EPB, PCAPNG_OPB):
+            if block_type == PCAPNG_EPB:
+                if_id, ts_high, ts_low, cap_len, orig_len = struct.unpack_from(endian + 'IIIII', buf, body)
+            else:
+                if_id, __, ts_high, ts_low, cap_len, orig_len = struct.unpack_from(endian + 'HHIIII', buf, body)
+            if if_id < len(interfaces):
+                linktype, tsresol, tsoffset = interfaces[if_id]
+                ticks = (ts_high << 32) | ts_low
+                ts_ns = (ticks * 1000000000) // tsresol + tsoffset * 1000000000
+                yield ts_ns, linktype, body + 20, min(cap_len, end - body - 20), orig_len
+        pos += block_len
+
+
+def iter_packets(buf):
+    '''
+    packet records of a pcap or pcapng file in `buf`
+    '''
+    if len(buf) < 24:
+        return iter(())
+    if struct.unpack_from('<I', buf, 0)[0] == PCAPNG_SHB:
+        return _iter_pcapng(buf)
+    return _iter_pcap(buf)
+
+
+def format_ns(ns):
+    '''
+    seconds with 9 decimals of `ns` nanoseconds, like tshark prints times
+    '''
+    if ns < 0:
+        return "-%d.%09d" % divmod(-ns, 1000000000)
+    return "%d.%09d" % divmod(ns, 1000000000)
+
+
+def read_frames(buf):
+    '''
+    yields the fields of each 802.11 frame with a transmitter address as
+    (txMAC, time ns, time_rel ns, RSS, noise, frameLen, channelFreq, type,
+    fragNum), absent radiotap fields being ''
+    '''
+    layouts = {}
+    macs = {}
+    first_ns = None
+    for ts_ns, linktype, pos, cap_len, orig_len in iter_packets(buf):
+        if first_ns is None:
+            first_ns = ts_ns
+        signal = noise = freq = ''
+        if linktype == LINKTYPE_IEEE802_11_RADIOTAP:
+            if cap_len < 8:
+                continue
+            rt_len = buf[pos + 2] | (buf[pos + 3] << 8)
+            if rt_len > cap_len:
+                continue
+            # fast path, fixed layouts are walked once per present words
+            end = pos + 8
+            while buf[end - 1] & 0x80 and end + 4 <= pos + rt_len:
+                end += 4
+            key = bytes(buf[pos + 4:end])
+            layout = layouts.get(key)
+            if layout is None:
+                layout, fixed = radiotap_layout(buf, pos, rt_len)
+                if fixed:
+                    layouts[key] = layout
+            offset = layout[RT_DBM_ANTSIGNAL]
+            if offset is not None:
+                signal = buf[pos + offset]
+                signal = str(signal - 256 if signal > 127 else signal)
+            offset = layout[RT_DBM_ANTNOISE]
+            if offset is not None:
+                noise = buf[pos + offset]
+                noise = str(noise - 256 if noise > 127 else noise)
+            offset = layout[RT_CHANNEL]
+            if offset is not None:
+                freq = str(buf[pos + offset] | (buf[pos + offset + 1] << 8))
+            wlan = wlan_fields(buf, pos + rt_len, cap_len - rt_len)
+        elif linktype == LINKTYPE_IEEE802_11:
+            wlan = wlan_fields(buf, pos, cap_len)
+        else:
+            continue
+        if wlan is None:
+            continue
+        ta, type_subtype, frag = wlan
+        mac = macs.get(ta)
+        if mac is None:
+            mac = bytes(ta).hex(':')
+            macs[bytes(ta)] = mac
+        yield mac, ts_ns, ts_ns - first_ns, signal, noise, orig_len, freq, type_subtype, frag
+
+
+def translate_pcap_native(ifp, ofp):
+    '''
+    translate pcap/pcapng `ifp` into the csv `Tshark.translatePcap` writes,
+    without tshark; returns the number of frames written
+    '''
+    count = 0
+    with open(ifp, 'rb') as f, open(ofp, 'w') as out:
+        out.write(SIG_CSV_HEADER)
+        if os.fstat(f.fileno()).st_size == 0:
+            return count
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            lines = []
+            for mac, ts_ns, rel_ns, signal, noise, frame_len, freq, type_subtype, frag in read_frames(buf):
+                lines.append("%s,%s,%s,%s,%s,%d,%s,%d,%s\n" % (
+                    mac, format_ns(ts_ns), format_ns(rel_ns),
+                    signal, noise, frame_len, freq, type_subtype, frag
+                ))
+                if len(lines) >= WRITE_BATCH:
+                    out.write("".join(lines))
+                    count += len(lines)
+                    lines = []
+            out.write("".join(lines))
+            count += len(lines)
+    return count
+
+
+def _radiotap_header(layout, signal, noise, freq):
+    '''
+    radiotap header of one of the test `layout`s
+    '''
+    channel = struct.pack('<HH', freq, 0x00a0)
+    if layout == 'basic':
+        present = [(1 << 1) | (1 << 2) | (1 << 3) | (1 << 5) | (1 << 6) | (1 << 11)]
+        fields = [
+            (1, b'\x00'), (1, b'\x0c'), (2, channel),
+            (1, struct.pack('<b', signal)), (1, struct.pack('<b', noise)), (1, b'\x01')
+        ]
+    elif layout == 'tsft':
+        # 8 byte aligned tsft, no noise, mcs behind the signal
+        present = [(1 << 0) | (1 << 1) | (1 << 3) | (1 << 5) | (1 << 19)]
+        fields = [
+            (8, struct.pack('<Q', 123456789)), (1, b'\x00'), (2, channel),
+            (1, struct.pack('<b', signal)), (1, b'\x07\x00\x05')
+        ]
+    elif layout == 'antennas':
+        # combined signal first, then a radiotap namespace per antenna
+        ext = (1 << RT_RADIOTAP_NS) | (1 << RT_EXT)
+        present = [
+            (1 << 0) | (1 << 1) | (1 << 3) | (1 << 5) | (1 << 6) | ext,
+            (1 << 5) | (1 << 11) | ext,
+            (1 << 5) | (1 << 11),
+        ]
+        fields = [
+            (8, struct.pack('<Q', 123456789)), (1, b'\x00'), (2, channel),
+            (1, struct.pack('<b', signal)), (1, struct.pack('<b', noise)),
+            (1, struct.pack('<bB', signal - 3, 0)), (1, struct.pack('<bB', signal - 6, 1)),
+        ]
+    else:
+        # vendor data of varying length before the signal and noise
+        skip = (signal % 5) + 1
+        present = [
+            (1 << 1) | (1 << 3) | (1 << RT_VENDOR_NS) | (1 << RT_EXT),
+            (1 << 0) | (1 << RT_RADIOTAP_NS) | (1 << RT_EXT),
+            (1 << 5) | (1 << 6),
+        ]
+        fields = [
+            (1, b'\x00'), (2, channel), (2, b'\x00\x11\x22\x00' + struct.pack('<H', skip)),
+            (1, b'\xee' * skip), (1, struct.pack('<bb', signal, noise)),
+        ]
+    data = b''.join(struct.pack('<I', word) for word in present)
+    for align, blob in fields:
+        data += b'\x00' * (-(4 + len(data)) % align) + blob
+    return struct.pack('<BBH', 0, 0, 4 + len(data)) + data
+
+
+def write_test_pcap(fp, frames, pcapng=False, nanosecond=False):
+    '''
+    write radiotap `frames` of (time ns, layout, signal, noise, freq,
+    type_subtype, ta bytes, frag) into a pcap or pcapng file
+    '''
+    packets = []
+    for ts_ns, layout, signal, noise, freq, type_subtype, ta, frag in frames:
+        fc = bytes([((type_subtype & 0xf) << 4) | ((type_subtype >> 4) << 2), 0])
+        wlan = fc + b'\x00\x00' + b'\xff' * 6 + ta
+        if type_subtype >> 4 != 1:
+            wlan += b'\x00' * 6 + struct.pack('<H', frag)
+        wlan += b'\x00' * 8
+        packets.append((ts_ns, _radiotap_header(layout, signal, noise, freq) + wlan))
+    with open(fp, 'wb') as f:
+        if not pcapng:
+            magic = PCAP_MAGIC_NS if nanosecond else PCAP_MAGIC_US
+            f.write(struct.pack('<IHHiIII', magic, 2, 4, 0, 0, 65535, LINKTYPE_IEEE802_11_RADIOTAP))
+            for ts_ns, packet in packets:
+                sec, frac = divmod(ts_ns, 1000000000)
+                frac = frac if nanosecond else frac // 1000
+                f.write(struct.pack('<IIII', sec, frac, len(packet), len(packet)) + packet)
+            return
+        f.write(struct.pack('<IIIHHqI', PCAPNG_SHB, 28, PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1, 28))
+        options = struct.pack('<HHB3x', PCAPNG_IF_TSRESOL, 1, 9 if nanosecond else 6) + b'\x00' * 4
+        f.write(struct.pack('<IIHHI', PCAPNG_IDB, 20 + len(options), LINKTYPE_IEEE802_11_RADIOTAP, 0, 0))
+        f.write(options + struct.pack('<I', 20 + len(options)))
+        for ts_ns, packet in packets:
+            ticks = ts_ns if nanosecond else ts_ns // 1000
+            padded = packet + b'\x00' * (-len(packet) % 4)
+            block_len = 32 + len(padded)
+            f.write(struct.pack(
+                '<IIIIIII', PCAPNG_EPB, block_len, 0, ticks >> 32, ticks & 0xffffffff,
+                len(packet), len(packet)
+            ) + padded + struct.pack('<I', block_len))
+
+
+def _test_frames(num_frames, seed=0):
+    '''
+    random radiotap frames over all test layouts and frame types, with
+    ack and cts frames that carry no transmitter address
+    '''
+    import random
+    rng = random.Random(seed)
+    layouts = ['basic', 'tsft', 'antennas', 'vendor']
+    # beacon, probe req, data, qos data, block ack, rts, cts, ack
+    types = [8, 4, 32, 40, 25, 27, 28, 29]
+    macs = [bytes([0x10, 0xa4, 0xbe, 0, 0, i]) for i in range(8)]
+    ts_ns = 1557092017416023731
+    frames = []
+    for i in range(num_frames):
+        ts_ns += rng.randint(1000, 5000000)
+        frames.append((
+            ts_ns, rng.choice(layouts), rng.randint(-95, -20), rng.randint(-100, -85),
+            rng.choice([2412, 2437, 5180, 5745]), rng.choice(types), rng.choice(macs),
+            (rng.randint(0, 4095) << 4) | (i % 7)
+        ))
+    return frames
+
+
+def _expected_lines(frames, nanosecond):
+    '''
+    the csv lines tshark prints for `write_test_pcap` frames
+    '''
+    lines = []
+    first_ns = None
+    for ts_ns, layout, signal, noise, freq, type_subtype, ta, frag in frames:
+        if not nanosecond:
+            ts_ns = ts_ns // 1000 * 1000
+        if first_ns is None:
+            first_ns = ts_ns
+        if type_subtype in (28, 29):
+            continue
+        frame_len = len(_radiotap_header(layout, signal, noise, freq)) + 16 + 8
+        if type_subtype >> 4 != 1:
+            frame_len += 8
+        lines.append("%s,%s,%s,%d,%s,%d,%d,%d,%s\n" % (
+            ta.hex(':'), format_ns(ts_ns), format_ns(ts_ns - first_ns), signal,
+            "" if layout == 'tsft' else noise, frame_len, freq, type_subtype,
+            "" if type_subtype >> 4 == 1 else frag & 0xf
+        ))
+    return lines
+
+
+def check_pcap_reader(num_frames=2000):
+    '''
+    translate synthetic pcap and pcapng captures and compare against the
+    lines built from the known field values
+    '''
+    frames = _test_frames(num_frames)
+    ok = True
+    with tempfile.TemporaryDirectory() as folder:
+        for pcapng in [False, True]:
+            for nanosecond in [False, True]:
+                ifp = os.path.join(folder, "test.pcap")
+                ofp = os.path.join(folder, "test.csv")
+                write_test_pcap(ifp, frames, pcapng=pcapng, nanosecond=nanosecond)
+                translate_pcap_native(ifp, ofp)
+                with open(ofp) as f:
+                    lines = f.readlines()
+                expected = [SIG_CSV_HEADER] + _expected_lines(frames, nanosecond)
+                bad = [i for i, (a, b) in enumerate(zip(lines, expected)) if a != b]
+                same = not bad and len(lines) == len(expected)
+                print("{} {}: {} lines, {}".format(
+                    "pcapng" if pcapng else "pcap",
+                    "ns" if nanosecond else "us",
+                    len(lines) - 1,
+                    "identical" if same else "DIFFERENT"
+                ))
+                for i in bad[:3]:
+                    print("  got      {}  expected {}".format(lines[i], expected[i]), end='')
+                ok = ok and same
+    return ok
+
+
+def compare_tshark(pcap_fp):
+    '''
+    translate `pcap_fp` with tshark and natively, print the differences
+    '''
+    from libs.tshark import Tshark
+    with tempfile.TemporaryDirectory() as folder:
+        tshark_fp = os.path.join(folder, "tshark.csv")
+        native_fp = os.path.join(folder, "native.csv")
+        start = time.time()
+        Tshark().translatePcap(pcap_fp, tshark_fp)
+        tshark_time = time.time() - start
+        start = time.time()
+        translate_pcap_native(pcap_fp, native_fp)
+        native_time = time.time() - start
+        with open(tshark_fp) as f:
+            tshark_lines = f.readlines()
+        with open(native_fp) as f:
+            native_lines = f.readlines()
+    bad = [
+        i for i, (a, b) in enumerate(zip(tshark_lines, native_lines)) if a != b
+    ]
+    print("tshark {} lines in {:.2f}s, native {} lines in {:.2f}s ({:.1f}x), {} different lines".format(
+        len(tshark_lines) - 1, tshark_time,
+        len(native_lines) - 1, native_time,
+        tshark_time / max(native_time, 1e-9), len(bad)
+    ))
+    for i in bad[:5]:
+        print("  tshark {}  native {}".format(tshark_lines[i], native_lines[i]), end='')
+    return not bad and len(tshark_lines) == len(native_lines)
+
+
+def bench_pcap_reader(num_frames=200000):
+    '''
+    frames per second of the native reader on a synthetic capture, and of
+    tshark if it is installed
+    '''
+    frames = _test_frames(num_frames)
+    with tempfile.TemporaryDirectory() as folder:
+        ifp = os.path.join(folder, "bench.pcap")
+        ofp = os.path.join(folder, "bench.csv")
+        for layouts in [['basic'], ['antennas'], ['vendor']]:
+            write_test_pcap(ifp, [frame[:1] + (layouts[0],) + frame[2:] for frame in frames])
+            start = time.time()
+            translate_pcap_native(ifp, ofp)
+            native_time = time.time() - start
+            result = "{} layout: native {:.0f} frames/s".format(layouts[0], num_frames / native_time)
+            if shutil.which('tshark') is not None:
+                from libs.tshark import Tshark
+                start = time.time()
+                Tshark().translatePcap(ifp, ofp)
+                tshark_time = time.time() - start
+                result += ", tshark {:.0f} frames/s ({:.1f}x)".format(
+                    num_frames / tshark_time, tshark_time / native_time
+                )
+            print(result)
+
+
+def test(args):
+    if args.check:
+        if not check_pcap_reader(args.check):
+            sys.exit(1)
+    if args.compare:
+        if not compare_tshark(args.compare):
+            sys.exit(1)
+    if args.bench:
+        bench_pcap_reader(args.bench)
+    if args.rss:
+        if args.outf is None:
+            print("Must specify output filepath")
+            return
+        translate_pcap_native(args.rss, args.outf)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='native pcap reader test'
+    )
+
+    parser.add_argument(
+        '-rss', '--rss',
+        dest='rss',
+        default=None,
+        help='Specify RSS pcap file path to translate'
+    )
+
+    parser.add_argument(
+        '-o', '--outf',
+        dest='outf',
+        default=None,
+        help='Specify output filepath'
+    )
+
+    parser.add_argument(
+        '--check',
+        dest='check',
+        type=int,
+        default=None,
+        help='Check the reader on the given number of synthetic frames'
+    )
+
+    parser.add_argument(
+        '--compare',
+        dest='compare',
+        default=None,
+        help='Specify a pcap file to compare the reader against tshark with'
+    )
+
+    parser.add_argument(
+        '--bench',
+        dest='bench',
+        type=int,
+        default=None,
+        help='Benchmark the reader with the given number of synthetic frames'
+    )
+
+    args, __ = parser.parse_known_args()
+
+    test(args)
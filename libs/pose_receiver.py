@@ -0,0 +1,253 @@
+import os
+import time
+import socket
+import selectors
+import threading
+from collections import deque
+
+from libs.parser import SLAM_CSV_HEADER
+
+
+POSE_STREAM_PORT = 9999
+RATE_WINDOW = 5.0  # seconds of records the rate is averaged over
+RECV_SIZE = 1 << 16
+
+
+def local_ip_towards(ip):
+    '''
+    ip address of this machine on the route to `ip`, which the vacuum can
+    reach it by
+    '''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # no packet is sent for udp, only the route gets picked
+        sock.connect((ip, 9))
+        return sock.getsockname()[0]
+    finally:
+        sock.close()
+
+
+class PoseReceiver():
+    '''
+    receives slam estimates streamed by `get_loc_est.py --stream` and
+    appends them to the csv `out_fp` as they come, keeping the latest pose
+    and the record rate; the vacuum may reconnect any time, an incomplete
+    line of a broken connection is dropped
+    '''
+
+    def __init__(self, out_fp, port=POSE_STREAM_PORT, host='0.0.0.0'):
+        self.out_fp = out_fp
+        self.address = (host, port)
+        self.count = 0
+        self.latest = None
+        self.first = None
+        self.times = deque()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.server = None
+        self.f = None
+
+    def start(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(self.address)
+        self.server.listen(1)
+        self.address = self.server.getsockname()
+        self.f = open(self.out_fp, 'w')
+        self.f.write(SLAM_CSV_HEADER)
+        self.f.flush()
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+        print("receiving poses on port {} into {}".format(self.address[1], self.out_fp))
+        return self
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+        self.server.close()
+        self.f.close()
+        print("received {} poses into {}".format(self.count, self.out_fp))
+
+    def _serve(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.server, selectors.EVENT_READ)
+        pending = {}
+        while not self.stopping.is_set():
+            for key, __ in selector.select(timeout=0.2):
+                if key.fileobj is self.server:
+                    conn, addr = self.server.accept()
+                    conn.setblocking(False)
+                    selector.register(conn, selectors.EVENT_READ)
+                    pending[conn] = b''
+                    print("pose stream from {}:{}".format(addr[0], addr[1]))
+                    continue
+                conn = key.fileobj
+                try:
+                    data = conn.recv(RECV_SIZE)
+                except OSError:
+                    data = b''
+                if not data:
+                    selector.unregister(conn)
+                    conn.close()
+                    del pending[conn]
+                    continue
+                lines = (pending[conn] + data).split(b'\n')
+                pending[conn] = lines.pop()
+                self._add(lines)
+        for conn in pending:
+            conn.close()
+        selector.close()
+
+    def _add(self, lines):
+        now = time.time()
+        poses = []
+        for line in lines:
+            line = line.decode(errors='replace')
+            vals = line.split(',')
+            try:
+                poses.append((float(vals[1]), int(vals[2]), float(vals[3]), float(vals[4]), float(vals[5])))
+            except (IndexError, ValueError):
+                print("Err: bad pose line {}".format(line))
+                continue
+            self.f.write(line + "\n")
+        self.f.flush()
+        if not poses:
+            return
+        with self.lock:
+            self.count += len(poses)
+            self.latest = poses[-1]
+            if self.first is None:
+                self.first = now
+            self.times.extend([now] * len(poses))
+            while self.times and self.times[0] < now - RATE_WINDOW:
+                self.times.popleft()
+
+    def rate(self):
+        '''
+        received records per second over the last RATE_WINDOW seconds
+        '''
+        now = time.time()
+        with self.lock:
+            if self.first is None:
+                return 0.0
+            while self.times and self.times[0] < now - RATE_WINDOW:
+                self.times.popleft()
+            return len(self.times) / max(min(RATE_WINDOW, now - self.first), 1e-3)
+
+    def summary(self):
+        with self.lock:
+            latest = self.latest
+            count = self.count
+        if latest is None:
+            return "no pose received yet"
+        return "pose x {:.3f} y {:.3f} yaw {:.3f} ({} poses, {:.1f}/s)".format(
+            latest[2], latest[3], latest[4], count, self.rate()
+        )
+
+
+def simulate(args):
+    '''
+    stream a synthetic slam log through `libs.parser --stream`, tailing the
+    log like on the vacuum, into a receiver, then compare the received csv
+    with the one written by the feeder
+    '''
+    import sys
+    import signal
+    import tempfile
+    import subprocess
+    folder = tempfile.mkdtemp()
+    log_fp = os.path.join(folder, "SLAM_fprintf.log")
+    open(log_fp, 'w').close()
+    receiver = PoseReceiver(os.path.join(folder, "live_loc.csv"), port=args.port, host='127.0.0.1').start()
+    feeder = subprocess.Popen([
+        sys.executable, '-m', 'libs.parser', '-slam',
+        '--live-log', log_fp,
+        '-o', os.path.join(folder, "feeder.csv"),
+        '--stream', '127.0.0.1:{}'.format(receiver.address[1]),
+    ], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    # the feeder clears the log once it is there
+    time.sleep(1)
+    start = time.time()
+    with open(log_fp, 'a') as f:
+        for i in range(args.simulate):
+            f.write("{:.3f} estimate {:.4f} {:.4f} {:.6f}\n".format(
+                time.time() - start, i % 97 * 0.1, i % 89 * 0.1, i % 7 * 0.5
+            ))
+            f.flush()
+            if i % args.rate == 0:
+                print(receiver.summary())
+            time.sleep(1.0 / args.rate)
+    time.sleep(1)
+    feeder.send_signal(signal.SIGTERM)
+    feeder.wait()
+    receiver.stop()
+    with open(os.path.join(folder, "feeder_slam.csv")) as f:
+        sent = f.read()
+    with open(receiver.out_fp) as f:
+        received = f.read()
+    print("received csv {} the feeder csv ({} lines)".format(
+        "matches" if sent == received else "DIFFERS from", received.count("\n") - 1
+    ))
+    return sent == received
+
+
+def test(args):
+    if args.simulate:
+        if not simulate(args):
+            exit(1)
+        return
+    receiver = PoseReceiver(args.of, port=args.port).start()
+    try:
+        while 1:
+            time.sleep(1)
+            print(receiver.summary())
+    except KeyboardInterrupt:
+        pass
+    receiver.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='pose receiver test'
+    )
+
+    parser.add_argument(
+        '-o', '--output',
+        dest='of',
+        default='live_loc.csv',
+        help='Specify output file path of the received poses'
+    )
+
+    parser.add_argument(
+        '-p', '--port',
+        dest='port',
+        type=int,
+        default=POSE_STREAM_PORT,
+        help='Specify port to listen on, 0 for any free port'
+    )
+
+    parser.add_argument(
+        '--simulate',
+        dest='simulate',
+        type=int,
+        default=0,
+        help='Feed the given number of synthetic slam estimates through a local feeder'
+    )
+
+    parser.add_argument(
+        '--rate',
+        dest='rate',
+        type=int,
+        default=50,
+        help='Specify estimates per second of the simulated feeder'
+    )
+
+    args, __ = parser.parse_known_args()
+
+    test(args)
@@ -0,0 +1,312 @@
+import io
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+from libs.rss_grid import RssGrid
+from libs.rss_grid import RSS_FLOOR
+from libs.rss_grid import WINDOW_FACTOR
+from libs.parser_post import sort_rss_points
+from libs.parser_post import sample_floor_map
+from libs.parser_post import estimate_orientation
+from libs.parser_post import WALL_REFLECTION
+
+
+def _estimate_orientation_reference(map_dim, reflections):
+    '''
+    the original per-pixel loop of estimate_orientation, kept as the
+    regression reference
+    '''
+    orientations = np.empty(map_dim, dtype=float) * float('nan')
+    for i in range(map_dim[0]):
+        for j in range(map_dim[1]):
+            if reflections[i, j] < -80.0:
+                continue
+            xs = []
+            ys = []
+            for off_i in range(-4, 5, 2):
+                end_i = min(max(i + off_i, 0), map_dim[0]-1)
+                for off_j in range(-4, 5, 2):
+                    end_j = min(max(j + off_j, 0), map_dim[1]-1)
+                    if reflections[end_i, end_j] > -100.0:
+                        if end_i not in xs or end_j not in ys:
+                            xs.append(end_i)
+                            ys.append(end_j)
+            if len(xs) == 0:
+                continue
+            if len(set(xs)) == 1:
+                coefs = [None, 999.0]
+            else:
+                coefs = np.polynomial.polynomial.polyfit(xs, ys, 1)
+            orientations[i, j] = round(np.arctan2(coefs[1], 1.0) * 180 / np.pi, 1)
+    return orientations
+
+
+def _build_floor_map_reference(map_image, orientation, center_x_val, center_y_val, map_dim, map_res):
+    '''
+    the original per-pixel loop of build_map, kept as the regression
+    reference
+    '''
+    grey = (125, 125, 125, 255)
+    white = (255, 255, 255, 255)
+    blue = (0, 0, 255, 255)
+    pink = (255, 0, 255, 255)
+    red = (255, 0, 0, 255)
+    black = (0, 0, 0, 255)
+    floor_map = np.zeros(map_dim)
+    map_pix = map_image.load()
+
+    # calculate center of the measurement
+    center_x = int(map_image.size[0] / 2 + center_x_val * 20)
+    center_y = int(map_image.size[1] / 2 - center_y_val * 20)
+
+    for i in range(map_dim[0]):
+        idx_x = center_x + map_res * 20 * (i - (map_dim[0] / 2))
+        for j in range(map_dim[1]):
+            idx_y = center_y - map_res * 20 * (j - (map_dim[1] / 2))
+            is_blocked = False
+            for kk in range(2):
+                for ll in range(2):
+                    color = map_pix[idx_x + kk, idx_y + ll]
+                    is_blocked = is_blocked or (color in [black, blue, pink, red])
+            if is_blocked:
+                if orientation % 4 == 0:
+                    floor_map[i, j] = 1
+                elif orientation % 4 == 1:
+                    floor_map[map_dim[1] - j - 1, i] = 1
+                elif orientation % 4 == 2:
+                    floor_map[map_dim[0] - i - 1, map_dim[1] - j - 1] = 1
+                elif orientation % 4 == 3:
+                    floor_map[j, map_dim[1] - i - 1] = 1
+            elif color not in [grey, white]:
+                print("unknown color: {}".format(color))
+
+    return floor_map
+
+
+def _rss_map_reference(data, map_dim, map_res, filters=None, sampling=False):
+    '''
+    the original per-cell loop of convert_to_pickle_rss, kept as the
+    regression reference for RssGrid
+    '''
+
+    def find_index(array, lower, upper):
+        return np.where((array >= lower) & (array <= upper))[0]
+
+    loc_x_center = (min(data[0, :]) + max(data[0, :])) / 2.0
+    loc_y_center = (min(data[1, :]) + max(data[1, :])) / 2.0
+    rss_map = np.ones(map_dim) * RSS_FLOOR
+    factor = WINDOW_FACTOR
+    for i in range(map_dim[0]):
+        upper_bound_x = loc_x_center + map_res * (i - (map_dim[0] / 2) + 0.5)
+        lower_bound_x = upper_bound_x - map_res
+        data_x_idxs = find_index(
+            data[0, :],
+            lower_bound_x - factor * map_res,
+            upper_bound_x + factor * map_res
+        )
+        data_part = data[:, data_x_idxs]
+        if data_part.size == 0:
+            continue
+        for j in range(map_dim[1]):
+            upper_bound_y = loc_y_center + map_res * (j - (map_dim[1] / 2) + 0.5)
+            lower_bound_y = upper_bound_y - map_res
+            data_y_idxs = find_index(
+                data_part[1, :],
+                lower_bound_y - factor * map_res,
+                upper_bound_y + factor * map_res
+            )
+            data_fullfilled = data_part[2, data_y_idxs]
+            orientation_fullfilled = data_part[3, data_y_idxs]
+            if filters == 0:
+                data_fullfilled = data_fullfilled[(orientation_fullfilled > 1.75 * np.pi) | (orientation_fullfilled < 0.25 * np.pi)]
+            elif filters == 1:
+                data_fullfilled = data_fullfilled[(orientation_fullfilled > 1.25 * np.pi) & (orientation_fullfilled < 1.75 * np.pi)]
+            elif filters == 2:
+                data_fullfilled = data_fullfilled[(orientation_fullfilled > 0.75 * np.pi) & (orientation_fullfilled < 1.25 * np.pi)]
+            elif filters == 3:
+                data_fullfilled = data_fullfilled[(orientation_fullfilled > 0.25 * np.pi) & (orientation_fullfilled < 0.75 * np.pi)]
+            elif filters == 4:
+                data_fullfilled = data_fullfilled[(orientation_fullfilled > 1.5 * np.pi) | (orientation_fullfilled < 0.5 * np.pi)]
+            elif filters == 5:
+                data_fullfilled = data_fullfilled[(orientation_fullfilled > 0.5 * np.pi) & (orientation_fullfilled < 1.5 * np.pi)]
+            if data_fullfilled.size:
+                if sampling:
+                    rss_map[i, j] = max(np.random.choice(data_fullfilled, 1)[0], RSS_FLOOR)
+                else:
+                    rss_map[i, j] = max(np.median(data_fullfilled), RSS_FLOOR)
+    return rss_map
+
+
+def _rss_points_along_trace(loc_fp, orientation=0, dev_xy=(1.0, 1.0), pkts_per_pose=3, seed=0):
+    '''
+    fake rss points of one device along a slam trace, for regression runs
+    on sessions that come without their pcap
+    '''
+    rng = np.random.RandomState(seed)
+    trace = np.loadtxt(loc_fp, delimiter=',', comments='#', usecols=(3, 4, 5), ndmin=2)
+    trace = np.repeat(trace, pkts_per_pose, axis=0)
+    dist = np.hypot(trace[:, 0] - dev_xy[0], trace[:, 1] - dev_xy[1])
+    rss = np.round(-40.0 - 25.0 * np.log10(dist + 0.5) + rng.normal(0, 4.0, dist.size))
+    points = []
+    for (x, y, yaw), val in zip(trace, rss):
+        # same rotation as load_rss_data_with_pkt_types
+        if orientation % 4 == 0:
+            points.append([x, y, val, yaw % (2 * np.pi)])
+        elif orientation % 4 == 1:
+            points.append([-y, x, val, (yaw - 0.5 * np.pi) % (2 * np.pi)])
+        elif orientation % 4 == 2:
+            points.append([-x, -y, val, (yaw - np.pi) % (2 * np.pi)])
+        else:
+            points.append([y, -x, val, (yaw + 0.5 * np.pi) % (2 * np.pi)])
+    return sort_rss_points(points)
+
+
+def regress_rss_grid(loc_fp, map_dims=((64, 64), (40, 72)), map_reses=(0.1, 0.05)):
+    '''
+    check RssGrid is bit-exact against the original loop for every filter,
+    both median and sampling (same global random state)
+    '''
+    ok = True
+    for orientation in range(4):
+        data = _rss_points_along_trace(loc_fp, orientation=orientation)
+        for map_dim in map_dims:
+            for map_res in map_reses:
+                grid = RssGrid(data, map_dim, map_res)
+                for filters in [None, 0, 1, 2, 3, 4, 5]:
+                    expected = _rss_map_reference(data, map_dim, map_res, filters)
+                    same = np.array_equal(grid.median_map(filters), expected)
+                    np.random.seed(orientation)
+                    expected = _rss_map_reference(data, map_dim, map_res, filters, sampling=True)
+                    np.random.seed(orientation)
+                    same = same and np.array_equal(grid.sample_map(filters), expected)
+                    if not same:
+                        print(
+                            "mismatch: orient {} dim {} res {} filters {}"
+                            .format(orientation, map_dim, map_res, filters)
+                        )
+                    ok = ok and same
+    print("RssGrid regression {}".format("passed" if ok else "FAILED"))
+    return ok
+
+
+def regress_orientation(f_map=None, num_random=20, seed=0):
+    '''
+    check estimate_orientation is exact against the original loop on random
+    wall maps of several densities and sizes, and on the floormap of
+    `f_map` if given
+    '''
+    rng = np.random.RandomState(seed)
+    maps = []
+    for i in range(num_random):
+        map_dim = (64, 64) if i % 2 else (rng.randint(1, 40), rng.randint(1, 40))
+        walls = rng.rand(*map_dim) < rng.choice([0.02, 0.1, 0.3, 0.7, 1.0])
+        reflections = walls * WALL_REFLECTION
+        reflections[reflections == 0] = -100.0
+        maps.append(reflections)
+    if f_map is not None:
+        with open(f_map, 'rb') as f:
+            floor_map = np.asarray(Image.open(f).convert('L')) < 100
+        reflections = floor_map * WALL_REFLECTION
+        reflections[reflections == 0] = -100.0
+        maps.append(reflections)
+    ok = True
+    for reflections in maps:
+        start = time.time()
+        expected = _estimate_orientation_reference(reflections.shape, reflections)
+        loop_time = time.time() - start
+        start = time.time()
+        result = estimate_orientation(reflections.shape, reflections)
+        vector_time = time.time() - start
+        same = np.array_equal(result, expected, equal_nan=True)
+        if not same:
+            print("mismatch: map {} with {} walls".format(reflections.shape, (reflections > -100).sum()))
+        ok = ok and same
+    print("orientation regression {}, last map {} loop {:.3f}s vectorized {:.3f}s".format(
+        "passed" if ok else "FAILED", reflections.shape, loop_time, vector_time
+    ))
+    return ok
+
+
+def regress_floor_map(f_map, num_centers=5, seed=0):
+    '''
+    check sample_floor_map is exact against the original loop of build_map
+    on the floorplan `f_map`, for all orientations and several dimensions,
+    resolutions and measurement centers
+    '''
+    rng = np.random.RandomState(seed)
+    with open(f_map, 'rb') as f:
+        map_image = Image.open(io.BytesIO(f.read())).convert('RGBA')
+    ok = True
+    for map_dim, map_res in [((64, 64), 0.1), ((64, 64), 0.05), ((128, 128), 0.05), ((256, 256), 0.02)]:
+        for center in [(0.0, 0.0)] + [tuple(rng.uniform(-3, 3, 2)) for __ in range(num_centers)]:
+            for orientation in range(4):
+                start = time.time()
+                expected = _build_floor_map_reference(map_image, orientation, center[0], center[1], map_dim, map_res)
+                loop_time = time.time() - start
+                start = time.time()
+                result = sample_floor_map(map_image, orientation, center[0], center[1], map_dim, map_res)
+                vector_time = time.time() - start
+                same = np.array_equal(result, expected)
+                if not same:
+                    print("mismatch: dim {} res {} center {} orient {}".format(map_dim, map_res, center, orientation))
+                ok = ok and same
+    print("floor map regression {}, last map {} loop {:.3f}s vectorized {:.3f}s".format(
+        "passed" if ok else "FAILED", map_dim, loop_time, vector_time
+    ))
+    return ok
+
+
+def test(args):
+    if args.regress_floor_map:
+        if not regress_floor_map(args.regress_floor_map):
+            sys.exit(1)
+    if args.regress:
+        if not regress_rss_grid(args.regress):
+            sys.exit(1)
+    if args.regress_orientation:
+        if not regress_orientation(args.map):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='regression of the vectorized processing against the original loops'
+    )
+
+    parser.add_argument(
+        '-r', '--regress',
+        dest='regress',
+        default=None,
+        help='Specify location file path to run regression of rss map binning'
+    )
+
+    parser.add_argument(
+        '--regress-floor-map',
+        dest='regress_floor_map',
+        default=None,
+        help='Specify map file path to run regression of floor map sampling'
+    )
+
+    parser.add_argument(
+        '--regress-orientation',
+        dest='regress_orientation',
+        action='store_true',
+        default=False,
+        help='Run regression of wall orientation estimation, on `--map` too if given'
+    )
+
+    parser.add_argument(
+        '-m', '--map',
+        dest='map',
+        default=None,
+        help='Specify map file path'
+    )
+
+    args, __ = parser.parse_known_args()
+
+    test(args)
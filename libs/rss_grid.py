@@ -0,0 +1,142 @@
+import numpy as np
+
+
+RSS_FLOOR = -85.0  # dBm, value of empty cells and lower bound of each cell
+WINDOW_FACTOR = 0.75  # each cell window extends `factor * map_res` per side
+
+
+def heading_mask(orient, filters=None):
+    '''
+    mask the points whose heading `orient` (radian in [0, 2pi)) passes
+    `filters`: `0: >`, `1: v`, `2: <`, `3: ^`, `4: <^>`, `5: <v>`,
+    anything else keeps all points
+    '''
+    if filters == 0:
+        return (orient > 1.75 * np.pi) | (orient < 0.25 * np.pi)
+    elif filters == 1:
+        return (orient > 1.25 * np.pi) & (orient < 1.75 * np.pi)
+    elif filters == 2:
+        return (orient > 0.75 * np.pi) & (orient < 1.25 * np.pi)
+    elif filters == 3:
+        return (orient > 0.25 * np.pi) & (orient < 0.75 * np.pi)
+    elif filters == 4:
+        return (orient > 1.5 * np.pi) | (orient < 0.5 * np.pi)
+    elif filters == 5:
+        return (orient > 0.5 * np.pi) & (orient < 1.5 * np.pi)
+    return np.ones(orient.shape, dtype=bool)
+
+
+def window_bounds(center, size, map_res, factor=WINDOW_FACTOR):
+    '''
+    inclusive lower/upper bounds of the overlapping window of each of the
+    `size` cells along one axis, evaluated exactly like the original loop
+    '''
+    upper_bound = center + map_res * (np.arange(size) - (size / 2) + 0.5)
+    lower_bound = upper_bound - map_res
+    return lower_bound - factor * map_res, upper_bound + factor * map_res
+
+
+class RssGrid():
+    '''
+    bins rss points into overlapping map cells once, so each map (median
+    or random sample, any heading filter) is a cheap reduction over the
+    shared (cell, point) pairs instead of a scan over all points per cell
+    '''
+
+    def __init__(self, data, map_dim, map_res, factor=WINDOW_FACTOR):
+        '''
+        @param data:    4xN array of x, y, rss, orient sorted by (x, y)
+        @param map_dim: (width, height) of the map in cells
+        @param map_res: size of each cell in meter
+        '''
+        self.data = data
+        self.map_dim = tuple(map_dim)
+        self.map_res = map_res
+
+        loc_x_center = (min(data[0, :]) + max(data[0, :])) / 2.0
+        loc_y_center = (min(data[1, :]) + max(data[1, :])) / 2.0
+        lower_x, upper_x = window_bounds(loc_x_center, self.map_dim[0], map_res, factor)
+        lower_y, upper_y = window_bounds(loc_y_center, self.map_dim[1], map_res, factor)
+
+        # bounds are non-decreasing, so the cells covering a point along
+        # each axis form a contiguous range [start, end)
+        row_start = np.searchsorted(upper_x, data[0, :], side='left')
+        row_end = np.searchsorted(lower_x, data[0, :], side='right')
+        col_start = np.searchsorted(upper_y, data[1, :], side='left')
+        col_end = np.searchsorted(lower_y, data[1, :], side='right')
+        num_rows = np.maximum(row_end - row_start, 0)
+        num_cols = np.maximum(col_end - col_start, 0)
+
+        # expand every point into each (row, col) cell of its window
+        counts = num_rows * num_cols
+        points = np.repeat(np.arange(data.shape[1]), counts)
+        offsets = np.arange(points.size) - np.repeat(np.cumsum(counts) - counts, counts)
+        num_cols = num_cols[points]
+        rows = row_start[points] + offsets // num_cols
+        cols = col_start[points] + offsets % num_cols
+        cells = rows * self.map_dim[1] + cols
+
+        # pairs in (cell, point) order keep the original per-cell point
+        # order for sampling, pairs in (cell, rss) order serve the medians
+        order = np.argsort(cells, kind='stable')
+        self.cells = cells[order]
+        self.points = points[order]
+        order = np.lexsort((data[2, self.points], self.cells))
+        self.cells_by_rss = self.cells[order]
+        self.rss_by_rss = data[2, self.points[order]]
+        self.points_by_rss = self.points[order]
+
+    def _empty_map(self):
+        return np.ones(self.map_dim) * RSS_FLOOR
+
+    def median_map(self, filters=None):
+        '''
+        median rss of each cell, RSS_FLOOR if empty
+        '''
+        rss_map = self._empty_map()
+        keep = heading_mask(self.data[3, :], filters)[self.points_by_rss]
+        cells = self.cells_by_rss[keep]
+        rss = self.rss_by_rss[keep]
+        if not cells.size:
+            return rss_map
+        cell_ids, starts, counts = np.unique(cells, return_index=True, return_counts=True)
+        medians = (rss[starts + (counts - 1) // 2] + rss[starts + counts // 2]) / 2
+        rss_map.flat[cell_ids] = np.maximum(medians, RSS_FLOOR)
+        return rss_map
+
+    def sample_map(self, filters=None):
+        '''
+        one random rss of each cell, RSS_FLOOR if empty; draws from the
+        global numpy random state cell by cell in row-major order
+        '''
+        rss_map = self._empty_map()
+        keep = heading_mask(self.data[3, :], filters)[self.points]
+        cells = self.cells[keep]
+        rss = self.data[2, self.points[keep]]
+        if not cells.size:
+            return rss_map
+        cell_ids, starts, counts = np.unique(cells, return_index=True, return_counts=True)
+        for cell_id, start, count in zip(cell_ids, starts, counts):
+            rss_map.flat[cell_id] = max(
+                np.random.choice(rss[start:start + count], 1)[0], RSS_FLOOR
+            )
+        return rss_map
+
+    def sample_maps(self, num, filters=None, rng=None):
+        '''
+        `num` maps of one random rss of each cell, RSS_FLOOR if empty; all
+        draws come from one batched call of `rng` (a numpy RandomState,
+        the global random state by default)
+        '''
+        if rng is None:
+            rng = np.random
+        rss_maps = np.ones((num,) + self.map_dim) * RSS_FLOOR
+        keep = heading_mask(self.data[3, :], filters)[self.points]
+        cells = self.cells[keep]
+        rss = self.data[2, self.points[keep]]
+        if not cells.size:
+            return rss_maps
+        cell_ids, starts, counts = np.unique(cells, return_index=True, return_counts=True)
+        picks = starts + rng.randint(0, counts, size=(num, counts.size))
+        rss_maps.reshape(num, -1)[:, cell_ids] = np.maximum(rss[picks], RSS_FLOOR)
+        return rss_maps
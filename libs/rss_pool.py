@@ -0,0 +1,198 @@
+import os
+import signal
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from libs.rss_grid import RssGrid
+from libs.dataset import MapBuffer
+from libs.parser_post import dump_rss_maps
+from libs.parser_post import dump_rss_samples
+from libs.parser_post import load_rss_points
+from libs.parser_post import PICKLE_MAP_SIZE
+from libs.parser_post import PICKLE_MAP_STEP
+
+
+# state of each worker process, set up once by `_init_worker`
+_worker = {}
+
+
+def _init_worker(shm_name, layouts, map_dim, map_res, output_map, to_buffer):
+    # Ctrl-C is handled by the parent, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker['shm'] = shm
+    _worker['data'] = [
+        np.ndarray((4, num), dtype=np.float64, buffer=shm.buf, offset=offset)
+        for offset, num in layouts
+    ]
+    _worker['map_dim'] = map_dim
+    _worker['map_res'] = map_res
+    _worker['output_map'] = output_map
+    _worker['to_buffer'] = to_buffer
+    _worker['grid'] = (None, None)
+
+
+def _run_task(task):
+    '''
+    dump the maps of one (device, sampling repetition, filters) task, or
+    all `batch_num` samples of the device at once
+    returns the output paths and, if maps go to a buffer, its records
+    '''
+    dev_idx, fp, pkt_type, labels, filters, sampling, seed, batch_num, stack, sample = task
+    buffer = MapBuffer() if _worker['to_buffer'] else None
+    if _worker['grid'][0] != dev_idx:
+        # tasks come device by device, so one binned grid gets reused
+        grid = RssGrid(_worker['data'][dev_idx], _worker['map_dim'], _worker['map_res'])
+        _worker['grid'] = (dev_idx, grid)
+    if batch_num:
+        out_fps = dump_rss_samples(
+            _worker['grid'][1], fp, pkt_type, batch_num,
+            labels=labels,
+            output_map=_worker['output_map'],
+            filters=filters,
+            stack=stack,
+            rng=np.random.RandomState(seed),
+            writer=buffer
+        )
+    else:
+        if sampling:
+            # forked workers start from one random state, reseed them
+            np.random.seed(seed)
+        out_fps = dump_rss_maps(
+            _worker['grid'][1], fp, pkt_type,
+            labels=labels,
+            output_map=_worker['output_map'],
+            filters=filters,
+            sampling=sampling,
+            writer=buffer,
+            sample=sample
+        )
+    return out_fps, None if buffer is None else buffer.records
+
+
+def sampling_seed(seed, dev_idx, rep):
+    '''
+    random state seed of one sampling repetition, shared with serial runs
+    '''
+    if seed is None:
+        return None
+    return [seed, dev_idx, rep]
+
+
+def batch_seed(seed, dev_idx):
+    '''
+    random state seed of all batched samples of one device, shared with
+    serial runs
+    '''
+    if seed is None:
+        return None
+    return [seed, dev_idx]
+
+
+def convert_to_pickle_parallel(
+    filepaths,
+    orientation,
+    groundtruth=None,
+    filters=None,
+    output_map=False,
+    sampling=False,
+    sampling_num=5,
+    map_dim=None,
+    map_res=None,
+    jobs=None,
+    seed=None,
+    batch_sampling=False,
+    stack_samples=False,
+    writer=None
+):
+    '''
+    dump rss maps of all device files across `jobs` processes, with the
+    loaded points shared through one shared memory block; file names
+    match the serial run, so does the content given the same `seed`;
+    with `batch_sampling` each device draws all its samples in one task;
+    maps go to `writer` of the parent instead of pickles if given
+    returns the output paths without extension, None if interrupted
+    '''
+    if groundtruth is None:
+        groundtruth = {}
+    if map_dim is None:
+        map_dim = (PICKLE_MAP_SIZE, PICKLE_MAP_SIZE)
+    if map_res is None:
+        map_res = PICKLE_MAP_STEP
+    if not sampling:
+        sampling_num = 1
+    if not isinstance(filters, (list, tuple)):
+        filters = [filters]
+
+    pool = None
+    shm = None
+    out_fps = []
+    try:
+        # load all devices once into shared memory
+        pkt_types = []
+        datas = []
+        for filepath in filepaths:
+            print("parsing file: {}".format(filepath))
+            pkt_type, data = load_rss_points(filepath, orientation)
+            pkt_types.append(pkt_type)
+            datas.append(data)
+        layouts = []
+        offset = 0
+        for data in datas:
+            layouts.append((offset, data.shape[1]))
+            offset += data.nbytes
+        shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for data, (start, num) in zip(datas, layouts):
+            np.ndarray((4, num), dtype=np.float64, buffer=shm.buf, offset=start)[:] = data
+        del datas, data
+
+        tasks = []
+        for dev_idx, filepath in enumerate(filepaths):
+            labels = groundtruth.get(os.path.splitext(os.path.basename(filepath))[0], None)
+            if sampling and batch_sampling:
+                tasks.append((
+                    dev_idx, filepath, pkt_types[dev_idx], labels, filters,
+                    sampling, batch_seed(seed, dev_idx), sampling_num, stack_samples, None
+                ))
+                continue
+            for rep in range(sampling_num):
+                # samples of one repetition share the random state like the
+                # serial run, medians can go filter by filter
+                for fffs in ([filters] if sampling else [[fff] for fff in filters]):
+                    tasks.append((
+                        dev_idx, filepath, pkt_types[dev_idx], labels, fffs,
+                        sampling, sampling_seed(seed, dev_idx, rep), 0, False,
+                        rep if sampling else None
+                    ))
+
+        pool = mp.Pool(
+            processes=jobs,
+            initializer=_init_worker,
+            initargs=(shm.name, layouts, tuple(map_dim), map_res, output_map, writer is not None)
+        )
+        for task_out_fps, records in pool.imap(_run_task, tasks):
+            out_fps += task_out_fps
+            if writer is not None:
+                writer.extend(records)
+        pool.close()
+    except KeyboardInterrupt:
+        print("KeyboardInterrupt happened")
+        if pool is not None:
+            pool.terminate()
+        out_fps = None
+    except BaseException:
+        # a failing worker leaves the pool running, which join() refuses
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        try:
+            if pool is not None:
+                pool.join()
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+    return out_fps
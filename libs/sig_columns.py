@@ -0,0 +1,144 @@
+import os
+
+import numpy as np
+
+
+# typed columns of the csv files along the pipeline, by header name;
+# txMAC is dictionary-encoded into codes indexing the `.macs` file
+SIG_COLUMN_TYPES = {
+    'x': '<f8',
+    'y': '<f8',
+    'orient': '<f8',
+    'txMAC': '<i4',
+    'time': '<f8',
+    'time_rel': '<f8',
+    'RSS': '<f8',
+    'noise': '<f8',
+    'frameLen': '<f8',
+    'channelFreq': '<f8',
+    'type': '<i4',
+    'fragNum': '<f8',
+}
+MISSING_INT = -1
+
+
+def columns_fp(csv_fp):
+    return "{}.npy".format(os.path.splitext(csv_fp)[0])
+
+
+def macs_fp(csv_fp):
+    return "{}.macs".format(os.path.splitext(csv_fp)[0])
+
+
+def sig_dtype(names):
+    return np.dtype([(name, SIG_COLUMN_TYPES.get(name, '<f8')) for name in names])
+
+
+def read_header(csv_fp):
+    '''
+    column names from the `#name,name,..` first line of a csv
+    '''
+    with open(csv_fp) as f:
+        return f.readline().rstrip().lstrip('#').split(',')
+
+
+def _to_int(val):
+    if not val:
+        return MISSING_INT
+    try:
+        return int(val)
+    except ValueError:
+        return int(val, 0)
+
+
+def _to_float(val):
+    return float(val) if val else float('nan')
+
+
+def parse_sig_lines(names, lines, macs=None):
+    '''
+    parse csv `lines` (without header) into a structured array of `names`
+    columns, one row per line; new MACs get appended to `macs`
+    '''
+    if macs is None:
+        macs = []
+    mac_codes = {mac: code for code, mac in enumerate(macs)}
+    dtype = sig_dtype(names)
+    table = np.empty(len(lines), dtype=dtype)
+    # short lines leave their trailing columns missing
+    padding = [''] * len(names)
+    cols = zip(*[(line.rstrip().split(',') + padding)[:len(names)] for line in lines])
+    for name, col in zip(names, cols):
+        if name == 'txMAC':
+            codes = []
+            for mac in col:
+                if mac not in mac_codes:
+                    mac_codes[mac] = len(macs)
+                    macs.append(mac)
+                codes.append(mac_codes[mac])
+            table[name] = codes
+        elif dtype[name].kind == 'i':
+            table[name] = [_to_int(val) for val in col]
+        else:
+            table[name] = [_to_float(val) for val in col]
+    return table, macs
+
+
+def parse_sig_csv(csv_fp):
+    '''
+    parse a csv of the pipeline into a structured array and its MAC list
+    '''
+    with open(csv_fp) as f:
+        names = f.readline().rstrip().lstrip('#').split(',')
+        lines = f.readlines()
+    return parse_sig_lines(names, lines)
+
+
+def save_sig_columns(csv_fp, table, macs):
+    with open(macs_fp(csv_fp), 'w') as f:
+        f.write("".join("{}\n".format(mac) for mac in macs))
+    np.save(columns_fp(csv_fp), table)
+
+
+def write_npy_header(f, dtype, count):
+    '''
+    start a `.npy` file of `count` rows of `dtype`, so the rows can be
+    appended as raw bytes afterwards
+    '''
+    np.lib.format.write_array_header_1_0(f, {
+        'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+        'fortran_order': False,
+        'shape': (count,),
+    })
+
+
+def load_sig_columns(csv_fp):
+    '''
+    memory-map the columns cached next to `csv_fp`,
+    (None, None) if there is no cache or it is older than the csv
+    '''
+    cache_fp = columns_fp(csv_fp)
+    if not os.path.isfile(cache_fp) or not os.path.isfile(macs_fp(csv_fp)):
+        return None, None
+    if os.path.isfile(csv_fp) and os.path.getmtime(cache_fp) < os.path.getmtime(csv_fp):
+        return None, None
+    with open(macs_fp(csv_fp)) as f:
+        macs = f.read().split()
+    return np.load(cache_fp, mmap_mode='r'), macs
+
+
+def ensure_sig_columns(csv_fp):
+    '''
+    load the cached columns of `csv_fp`, parsing the csv once if needed
+    '''
+    table, macs = load_sig_columns(csv_fp)
+    if table is None:
+        table, macs = parse_sig_csv(csv_fp)
+        save_sig_columns(csv_fp, table, macs)
+    return table, macs
+
+
+def remove_sig_columns(csv_fp):
+    for fp in [columns_fp(csv_fp), macs_fp(csv_fp)]:
+        if os.path.isfile(fp):
+            os.remove(fp)
@@ -0,0 +1,231 @@
+import os
+import time
+import tempfile
+import subprocess
+
+
+SSH_CONNECT_TIMEOUT = 10  # seconds
+SSH_CONTROL_PERSIST = 600  # seconds the shared connection outlives its last use
+SSH_ALIVE_INTERVAL = 5  # seconds between keepalives, a dead link closes after 2
+# %C is the hash of local host, remote host, port and user
+SSH_CONTROL_PATH = os.path.join(tempfile.gettempdir(), "xvacuum_ssh_%C")
+SSH_ERROR = 255  # exit status of ssh itself failing, not the remote command
+
+
+class SshConnection():
+    '''
+    runs remote commands and fetches files of one host through a single
+    multiplexed OpenSSH connection (ControlMaster), set up by the first use
+    and kept open for SSH_CONTROL_PERSIST seconds after the last; when ssh
+    itself fails the shared connection is closed and the call retried once
+    over a new one, unless the call has side effects and opts out with
+    `retry=False`: then a dead shared connection is replaced beforehand
+    and a failure is final, as the command may have run already
+    '''
+
+    def __init__(self, host, user='root', port=None, options=None, multiplex=True):
+        self.host = host
+        self.user = user
+        self.port = port
+        self.options = list(options or [])
+        self.multiplex = multiplex
+
+    def target(self):
+        return "{}@{}".format(self.user, self.host)
+
+    def ssh_options(self):
+        '''
+        options shared by ssh and scp, as one string for a shell command
+        '''
+        options = ["-o ConnectTimeout={}".format(SSH_CONNECT_TIMEOUT)]
+        if self.multiplex:
+            options += [
+                "-o ControlMaster=auto",
+                "-o ControlPath={}".format(SSH_CONTROL_PATH),
+                "-o ControlPersist={}".format(SSH_CONTROL_PERSIST),
+                "-o ServerAliveInterval={}".format(SSH_ALIVE_INTERVAL),
+                "-o ServerAliveCountMax=2",
+            ]
+        options += ["-o {}".format(option) for option in self.options]
+        return " ".join(options)
+
+    def _call(self, cmd, retry=True):
+        if not retry and self.multiplex and not self.check():
+            self.close()
+        try:
+            return subprocess.check_output(cmd, shell=True)
+        except subprocess.CalledProcessError as e:
+            if e.returncode != SSH_ERROR or not self.multiplex or not retry:
+                raise
+        # the shared connection may have died with the link, start over
+        print("Err: ssh connection failed, reconnecting..")
+        self.close()
+        return subprocess.check_output(cmd, shell=True)
+
+    def run(self, cmd, decode=True, retry=True):
+        '''
+        output of `cmd` on the host, bytes unless `decode`, None if it failed;
+        `retry` only if running `cmd` twice does no harm
+        '''
+        try:
+            output = self._call(
+                "ssh {} {}{} '{}'"
+                .format(
+                    self.ssh_options(),
+                    "" if self.port is None else "-p {} ".format(self.port),
+                    self.target(), cmd
+                ),
+                retry
+            )
+        except BaseException as e:
+            print("Err: {}".format(e))
+            return None
+        return output.decode() if decode else output
+
+    def fetch(self, remote_fp, local_fp="./"):
+        '''
+        copy `remote_fp` of the host to `local_fp`
+        returns whether it worked
+        '''
+        try:
+            self._call(
+                "scp {} {}{}:{} {}"
+                .format(
+                    self.ssh_options(),
+                    "" if self.port is None else "-P {} ".format(self.port),
+                    self.target(), remote_fp, local_fp
+                )
+            )
+            return True
+        except BaseException as e:
+            print("Err: {}".format(e))
+        return False
+
+    def check(self):
+        '''
+        whether the shared connection is up
+        '''
+        if not self.multiplex:
+            return False
+        return subprocess.call(
+            "ssh {} -O check {}{} > /dev/null 2>&1".format(
+                self.ssh_options(),
+                "" if self.port is None else "-p {} ".format(self.port),
+                self.target()
+            ),
+            shell=True
+        ) == 0
+
+    def close(self):
+        '''
+        close the shared connection, the next use opens a new one
+        '''
+        if not self.multiplex:
+            return
+        subprocess.call(
+            "ssh {} -O exit {}{} > /dev/null 2>&1".format(
+                self.ssh_options(),
+                "" if self.port is None else "-p {} ".format(self.port),
+                self.target()
+            ),
+            shell=True
+        )
+
+
+def measure_latency(connection, num=10, remote_fp=None):
+    '''
+    seconds of each of `num` runs of `true`, and of fetching `remote_fp`
+    if given, through `connection`
+    '''
+    timings = {'run': []}
+    if remote_fp:
+        timings['fetch'] = []
+    local_fp = os.path.join(tempfile.mkdtemp(), "fetched")
+    for __ in range(num):
+        start = time.time()
+        if connection.run("true") is None:
+            return None
+        timings['run'].append(time.time() - start)
+        if remote_fp:
+            start = time.time()
+            if not connection.fetch(remote_fp, local_fp):
+                return None
+            timings['fetch'].append(time.time() - start)
+    return timings
+
+
+def test(args):
+    for multiplex in [False, True]:
+        connection = SshConnection(
+            args.host, user=args.user, port=args.port, options=args.options, multiplex=multiplex
+        )
+        connection.close()
+        timings = measure_latency(connection, args.num, args.fetch)
+        if timings is None:
+            print("Err: cannot reach {}".format(connection.target()))
+            return
+        for kind, seconds in sorted(timings.items()):
+            print("{} {}: first {:.3f}s, mean of the rest {:.3f}s".format(
+                "multiplexed" if multiplex else "new connection", kind,
+                seconds[0], sum(seconds[1:]) / max(len(seconds) - 1, 1)
+            ))
+        if multiplex:
+            print("shared connection up: {}".format(connection.check()))
+            connection.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='ssh connection reuse test'
+    )
+
+    parser.add_argument(
+        '--host',
+        dest='host',
+        default=os.environ.get("MIROBO_IP", None),
+        help='Specify host, default using $MIROBO_IP'
+    )
+
+    parser.add_argument(
+        '--user',
+        dest='user',
+        default='root',
+        help='Specify user'
+    )
+
+    parser.add_argument(
+        '-p', '--port',
+        dest='port',
+        type=int,
+        default=None,
+        help='Specify ssh port'
+    )
+
+    parser.add_argument(
+        '-o',
+        dest='options',
+        action='append',
+        default=[],
+        help='Add ssh option, e.g. -o IdentityFile=key'
+    )
+
+    parser.add_argument(
+        '-n', '--num',
+        dest='num',
+        type=int,
+        default=10,
+        help='Specify number of commands to time'
+    )
+
+    parser.add_argument(
+        '--fetch',
+        dest='fetch',
+        default=None,
+        help='Specify remote file to time fetching too'
+    )
+
+    args, __ = parser.parse_known_args()
+
+    test(args)
@@ -0,0 +1,117 @@
+import os
+import json
+import hashlib
+
+
+STAGE_CACHE_FILE = ".stage_cache.json"
+HASH_CHUNK = 1 << 20
+
+
+class StageCache():
+    '''
+    remembers each pipeline stage run on a session folder, keyed by a hash
+    of the stage input file contents and its parameters, so re-running
+    only redoes the stages whose inputs or parameters changed; runs of a
+    stage with other parameters are kept alongside unless a later run
+    overwrote their outputs
+    '''
+
+    def __init__(self, folder, enabled=True):
+        self.fp = os.path.join(folder, STAGE_CACHE_FILE)
+        self.enabled = enabled
+        self.manifest = {'files': {}, 'stages': {}}
+        if enabled and os.path.isfile(self.fp):
+            try:
+                with open(self.fp) as f:
+                    self.manifest = json.load(f)
+            except ValueError:
+                print("Err: ignore broken stage cache {}".format(self.fp))
+
+    def save(self):
+        if not self.enabled:
+            return
+        tmp_fp = "{}.tmp".format(self.fp)
+        with open(tmp_fp, 'w') as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_fp, self.fp)
+
+    def file_hash(self, fp):
+        '''
+        sha1 of the content of `fp`, only re-read when its size or mtime
+        changed since the last time
+        '''
+        fp = os.path.abspath(fp)
+        stat = os.stat(fp)
+        known = self.manifest['files'].get(fp)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+        sha1 = hashlib.sha1()
+        with open(fp, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_CHUNK), b''):
+                sha1.update(block)
+        self.manifest['files'][fp] = [stat.st_size, stat.st_mtime_ns, sha1.hexdigest()]
+        return sha1.hexdigest()
+
+    def key(self, inputs, params):
+        sha1 = hashlib.sha1()
+        for fp in inputs:
+            sha1.update(self.file_hash(fp).encode())
+        sha1.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return sha1.hexdigest()
+
+    def params_key(self, params):
+        return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+    def run(self, stage, inputs, params, func):
+        '''
+        result of `stage`, from the last run if it had the same inputs and
+        params and its outputs still exist, otherwise of `func()`, which
+        returns (result, output filepaths); result must fit into json,
+        output filepaths of None leave an incomplete run unrecorded
+        '''
+        if not self.enabled:
+            return func()[0]
+        key = self.key(inputs, params)
+        slot = self.params_key(params)
+        records = self.manifest['stages'].get(stage)
+        if not isinstance(records, dict) or 'key' in records:
+            # none yet, or one run of an older cache
+            records = {}
+        self.manifest['stages'][stage] = records
+        record = records.get(slot)
+        if record is not None:
+            if record['key'] == key and all(os.path.exists(fp) for fp in record['outputs']):
+                print("stage {} unchanged, skipped".format(stage))
+                return record['result']
+            # outputs of other inputs with these params are stale
+            for fp in record['outputs']:
+                if os.path.isfile(fp):
+                    os.remove(fp)
+            del records[slot]
+        result, outputs = func()
+        if outputs is None:
+            return result
+        outputs = sorted(set(
+            os.path.abspath(fp) for fp in outputs if os.path.exists(fp)
+        ))
+        # runs with other params whose outputs were just overwritten
+        for other in list(records):
+            if set(records[other]['outputs']).intersection(outputs):
+                del records[other]
+        records[slot] = {
+            'key': key,
+            'outputs': outputs,
+            'result': result,
+        }
+        self.save()
+        return result
+
+
+def map_outputs(out_fps, exts=('.pickle', '.png')):
+    '''
+    existing files of the map paths `out_fps` given without extension
+    '''
+    return [
+        out_fp + ext for out_fp in out_fps for ext in exts
+        if os.path.isfile(out_fp + ext)
+    ]
@@ -0,0 +1,234 @@
+import time
+
+
+FAST_INTERVAL = 1.0  # seconds between status polls around state changes
+SLOW_INTERVAL = 8.0  # longest seconds between status polls of a steady state
+STEADY_POLLS = 3  # unchanged polls before the interval doubles
+BACKOFF_START = 2.0  # seconds to wait after a failed miio call, doubling
+BACKOFF_MAX = 60.0
+REDISCOVER_ERRORS = 5  # failed calls in a row before looking for the vacuum again
+STATUS_TIMELINE_HEADER = "epoch,call,rtt_ms,state,battery,area,error,note\n"
+
+
+class StatusMonitor():
+    '''
+    polls the status of a miio vacuum at an adaptive rate: every `fast`
+    seconds after a change of state or error, doubling up to `slow` seconds
+    while nothing changes, and backing off exponentially from `backoff`
+    seconds after failed calls; every call with its round trip time goes to
+    the csv timeline `timeline_fp` if given
+    '''
+
+    def __init__(
+        self,
+        vacuum,
+        timeline_fp=None,
+        fast=FAST_INTERVAL,
+        slow=SLOW_INTERVAL,
+        backoff=BACKOFF_START
+    ):
+        self.vacuum = vacuum
+        self.fast = fast
+        self.slow = slow
+        self.backoff = backoff
+        self.interval = fast
+        self.steady = 0
+        self.errors = 0  # failed calls in a row
+        self.status = None
+        self.changed = False  # whether the last poll changed state or error
+        self.calls = 0
+        self.failures = 0
+        self.rtt_sum = 0.0
+        self.rtt_max = 0.0
+        self.f = None
+        if timeline_fp:
+            self.f = open(timeline_fp, 'w')
+            self.f.write(STATUS_TIMELINE_HEADER)
+
+    def _record(self, epoch, name, rtt, status=None, note=""):
+        self.calls += 1
+        self.rtt_sum += rtt
+        self.rtt_max = max(self.rtt_max, rtt)
+        if self.f is None:
+            return
+        if status is None:
+            fields = ",,,"
+        else:
+            fields = "{},{},{:.2f},{}".format(
+                status.state_code, status.battery, status.clean_area, status.error_code
+            )
+        self.f.write("{:.3f},{},{:.1f},{},{}\n".format(
+            epoch, name, rtt * 1000, fields, note.replace(",", ";").replace("\n", " ")
+        ))
+        self.f.flush()
+
+    def call(self, name, func, *args):
+        '''
+        result of the miio call `func`, timed into the timeline as `name`;
+        a failure counts towards the backoff and is raised again
+        '''
+        start = time.time()
+        try:
+            result = func(*args)
+        except Exception as e:
+            self.errors += 1
+            self.failures += 1
+            self._record(start, name, time.time() - start, note=str(e))
+            raise
+        self.errors = 0
+        self._record(start, name, time.time() - start, result if name == "status" else None)
+        return result
+
+    def poll(self):
+        '''
+        status of the vacuum, raising like `call`
+        '''
+        status = self.call("status", self.vacuum.status)
+        self.changed = (
+            self.status is None or
+            (status.state_code, status.error_code) !=
+            (self.status.state_code, self.status.error_code)
+        )
+        if self.changed:
+            self.steady = 0
+            self.interval = self.fast
+        else:
+            self.steady += 1
+            if self.steady % STEADY_POLLS == 0:
+                self.interval = min(self.interval * 2, self.slow)
+        self.status = status
+        return status
+
+    def next_interval(self):
+        '''
+        seconds to wait before the next poll
+        '''
+        if self.errors:
+            return min(self.backoff * 2 ** (self.errors - 1), BACKOFF_MAX)
+        return self.interval
+
+    def summary(self):
+        return "{} miio calls, {} failed, rtt mean {:.1f}ms max {:.1f}ms".format(
+            self.calls, self.failures,
+            self.rtt_sum * 1000 / max(self.calls, 1), self.rtt_max * 1000
+        )
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+def start_cleaning(monitor, fan_speed=1):
+    '''
+    start the vacuum of `monitor` at `fan_speed`, raising like `call` only
+    if it does not start; a failed fan speed is logged, it is in the
+    timeline already, as the vacuum cleans anyway
+    returns whether the fan speed was set
+    '''
+    monitor.call("start", monitor.vacuum.start)
+    try:
+        monitor.call("set_fan_speed", monitor.vacuum.set_fan_speed, fan_speed)
+    except Exception as e:
+        print("Err: cannot set fan speed: {}".format(e))
+        return False
+    return True
+
+
+def test(args):
+    import os
+    import tempfile
+    from libs.fleet_controller import FakeVacuum
+    vacuum = FakeVacuum(
+        clean_seconds=args.clean, latency=args.latency,
+        outage=(args.outage[0], args.outage[1]) if args.outage else None,
+        fan_error=args.fan_error
+    )
+    timeline_fp = os.path.join(tempfile.mkdtemp(), "status.csv")
+    monitor = StatusMonitor(
+        vacuum, timeline_fp, fast=args.fast, slow=args.slow, backoff=args.fast * 2
+    )
+    start = time.time()
+    fan_set = start_cleaning(monitor)
+    while 1:
+        try:
+            status = monitor.poll()
+        except Exception as e:
+            print("Err: {}, retrying in {:.2f}s".format(e, monitor.next_interval()))
+        else:
+            if monitor.changed:
+                print("{:.2f}s {}".format(time.time() - start, status.state))
+            if status.state_code == 6:
+                break
+        time.sleep(monitor.next_interval())
+    elapsed = time.time() - start
+    monitor.close()
+    print(monitor.summary())
+    print("fan speed set: {}, cleaned until {}".format(fan_set, monitor.status.state))
+    print("polled {} times in {:.2f}s, polling every {}s would take {}".format(
+        vacuum.polls, elapsed, args.fast, int(elapsed / args.fast)
+    ))
+    with open(timeline_fp) as f:
+        lines = f.readlines()
+    print("timeline {} ({} bytes):".format(timeline_fp, sum(len(line) for line in lines)))
+    print("".join(lines[:3] + ["...\n"] + lines[-2:]), end='')
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='adaptive status monitor test with a fake vacuum'
+    )
+
+    parser.add_argument(
+        '--clean',
+        dest='clean',
+        type=float,
+        default=10.0,
+        help='Specify seconds the fake vacuum cleans for'
+    )
+
+    parser.add_argument(
+        '--fast',
+        dest='fast',
+        type=float,
+        default=0.1,
+        help='Specify seconds between polls around state changes'
+    )
+
+    parser.add_argument(
+        '--slow',
+        dest='slow',
+        type=float,
+        default=0.8,
+        help='Specify longest seconds between polls'
+    )
+
+    parser.add_argument(
+        '--latency',
+        dest='latency',
+        type=float,
+        default=0.02,
+        help='Specify seconds each fake call blocks'
+    )
+
+    parser.add_argument(
+        '--outage',
+        dest='outage',
+        type=float,
+        nargs=2,
+        default=None,
+        help='Specify start and end seconds the fake vacuum does not answer'
+    )
+
+    parser.add_argument(
+        '--fan-error',
+        dest='fan_error',
+        action='store_true',
+        help='Let the fake vacuum not answer setting the fan speed'
+    )
+
+    args, __ = parser.parse_known_args()
+
+    test(args)
@@ -0,0 +1,229 @@
+import os
+
+import numpy as np
+
+from libs.parser import SLAM_CSV_HEADER
+from libs.pcap_reader import write_test_pcap
+
+
+MAP_IMAGE_SIZE = 1024  # pixels, the vacuum map is 20 pixels per meter around the dock
+MAP_PIXELS_PER_METER = 20
+SLAM_RATE = 5.0  # estimates per second
+ROBOT_SPEED = 0.3  # m/s
+LANE_WIDTH = 0.3  # m between the lanes of the cleaning path
+START_ROBOTIME = 48066.865  # s
+START_EPOCH = 1557092022398  # ms
+TX_POWER = -35.0  # dBm at 1m
+PATH_LOSS_EXPONENT = 2.5
+RSS_NOISE = 3.0  # dB
+WALL_COLOR = (0, 0, 0)
+FLOOR_COLOR = (255, 255, 255)
+UNKNOWN_COLOR = (125, 125, 125)
+
+
+def synth_trace(duration, room=(6.0, 4.0)):
+    '''
+    (robotimes, epochs, xs, ys, yaws) of a vacuum cleaning the `room`
+    (width, height in meters) lane by lane from the dock at the origin,
+    going back and forth along the path for `duration` seconds
+    '''
+    lanes = np.arange(0.0, room[1] + 1e-9, LANE_WIDTH)
+    waypoints = []
+    for i, y in enumerate(lanes):
+        xs = [0.0, room[0]] if i % 2 == 0 else [room[0], 0.0]
+        waypoints += [(xs[0], y), (xs[1], y)]
+    waypoints = np.array(waypoints)
+    seg_lens = np.hypot(*np.diff(waypoints, axis=0).T)
+    dists = np.concatenate([[0.0], np.cumsum(seg_lens)])
+    ts = np.arange(0.0, duration, 1.0 / SLAM_RATE)
+    # back and forth once the path is done
+    s = np.mod(ts * ROBOT_SPEED, 2 * dists[-1])
+    s = np.where(s > dists[-1], 2 * dists[-1] - s, s)
+    xs = np.interp(s, dists, waypoints[:, 0])
+    ys = np.interp(s, dists, waypoints[:, 1])
+    yaws = np.arctan2(np.gradient(ys), np.gradient(xs))
+    return START_ROBOTIME + ts, START_EPOCH + np.round(ts * 1000).astype(np.int64), xs, ys, yaws
+
+
+def write_trace(fp, trace):
+    robotimes, epochs, xs, ys, yaws = trace
+    with open(fp, 'w') as f:
+        f.write(SLAM_CSV_HEADER)
+        f.writelines(
+            "estimate,{:.3f},{},{:.4f},{:.4f},{:.6f}\n".format(*vals)
+            for vals in zip(robotimes, epochs, xs, ys, yaws)
+        )
+
+
+def synth_map(room=(6.0, 4.0), margin=0.3):
+    '''
+    rgb floorplan of the `room` like the vacuum draws it: walls around the
+    floor and across the middle with a door, unknown elsewhere
+    '''
+    image = np.empty((MAP_IMAGE_SIZE, MAP_IMAGE_SIZE, 3), dtype=np.uint8)
+    image[:] = UNKNOWN_COLOR
+
+    def px(x):
+        return int(MAP_IMAGE_SIZE / 2 + x * MAP_PIXELS_PER_METER)
+
+    def py(y):
+        return int(MAP_IMAGE_SIZE / 2 - y * MAP_PIXELS_PER_METER)
+
+    left, right = px(-margin), px(room[0] + margin)
+    top, bottom = py(room[1] + margin), py(-margin)
+    image[top:bottom, left:right] = WALL_COLOR
+    image[top + 2:bottom - 2, left + 2:right - 2] = FLOOR_COLOR
+    # inner wall with a door of a meter
+    middle = px(room[0] / 2)
+    image[top:bottom, middle - 1:middle + 1] = WALL_COLOR
+    door = py(room[1] / 2)
+    image[door - MAP_PIXELS_PER_METER // 2:door + MAP_PIXELS_PER_METER // 2, middle - 1:middle + 1] = FLOOR_COLOR
+    return image
+
+
+def write_map(fp, image):
+    with open(fp, 'wb') as f:
+        f.write("P6\n{} {} 255\n".format(image.shape[1], image.shape[0]).encode())
+        f.write(image.tobytes())
+
+
+def synth_frames(trace, devices=4, packets=10000, room=(6.0, 4.0), seed=0):
+    '''
+    radiotap frames for `write_test_pcap` of `packets` beacons of each of
+    `devices` access points in and around the `room`, spread over the
+    trace, with rss falling off with the distance to the vacuum
+    returns the frames sorted by time and the device positions by mac
+    '''
+    rng = np.random.RandomState(seed)
+    robotimes, epochs, xs, ys, __ = trace
+    positions = {}
+    times, macs, rsss = [], [], []
+    for dev in range(devices):
+        mac = bytes([0x02, 0x5e, 0x00, 0x00, dev >> 8, dev & 0xff])
+        pos = rng.uniform([-1.0, -1.0], [room[0] + 1.0, room[1] + 1.0])
+        positions[mac.hex()] = tuple(pos)
+        ts = np.sort(rng.uniform(epochs[0], epochs[-1], packets))
+        # where the vacuum was at each packet
+        dists = np.hypot(np.interp(ts, epochs, xs) - pos[0], np.interp(ts, epochs, ys) - pos[1])
+        rss = TX_POWER - 10 * PATH_LOSS_EXPONENT * np.log10(np.maximum(dists, 0.5))
+        rss += rng.normal(0.0, RSS_NOISE, packets)
+        times.append(ts)
+        macs += [mac] * packets
+        rsss.append(np.clip(np.round(rss), -95, -20).astype(int))
+    times = np.concatenate(times)
+    rsss = np.concatenate(rsss)
+    order = np.argsort(times, kind='stable')
+    frames = []
+    for seq, i in enumerate(order):
+        frames.append((
+            int(times[i]) * 1000000 + int(rng.randint(0, 1000000)), 'basic', int(rsss[i]), -95,
+            2437, 8, macs[i], (seq & 0xfff) << 4
+        ))
+    frames.sort(key=lambda frame: frame[0])
+    return frames, positions
+
+
+def synth_session(
+    folder,
+    name="20190505_170223",
+    devices=4,
+    packets=10000,
+    duration=300.0,
+    room=(6.0, 4.0),
+    seed=0
+):
+    '''
+    write a session into `folder` as collected by the vacuum and the
+    phone: `<name>_loc.csv`, `<name>_map.ppm` and `<name>.pcap` with
+    `packets` frames of each of `devices` access points over `duration`
+    seconds
+    returns the paths of the map, trace and pcap, and the device positions
+    '''
+    os.makedirs(folder, exist_ok=True)
+    trace = synth_trace(duration, room)
+    loc_fp = os.path.join(folder, "{}_loc.csv".format(name))
+    write_trace(loc_fp, trace)
+    map_fp = os.path.join(folder, "{}_map.ppm".format(name))
+    write_map(map_fp, synth_map(room))
+    frames, positions = synth_frames(trace, devices, packets, room, seed)
+    pcap_fp = os.path.join(folder, "{}.pcap".format(name))
+    write_test_pcap(pcap_fp, frames)
+    return map_fp, loc_fp, pcap_fp, positions
+
+
+def test(args):
+    import time
+    start = time.time()
+    map_fp, loc_fp, pcap_fp, positions = synth_session(
+        args.folder,
+        devices=args.devices,
+        packets=args.packets,
+        duration=args.duration,
+        room=tuple(args.room),
+        seed=args.seed
+    )
+    print("session of {} devices x {} packets written in {:.2f}s:".format(
+        args.devices, args.packets, time.time() - start
+    ))
+    for fp in [map_fp, loc_fp, pcap_fp]:
+        print("  {} ({:.1f} MB)".format(fp, os.path.getsize(fp) / (1 << 20)))
+    for mac, pos in sorted(positions.items()):
+        print("  device {} at ({:.2f}, {:.2f})".format(mac, pos[0], pos[1]))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='synthetic session generator'
+    )
+
+    parser.add_argument(
+        dest='folder',
+        help='Specify folder to write the session into, e.g. synth_orient_0'
+    )
+
+    parser.add_argument(
+        '--devices',
+        dest='devices',
+        type=int,
+        default=4,
+        help='Specify number of access points'
+    )
+
+    parser.add_argument(
+        '--packets',
+        dest='packets',
+        type=int,
+        default=10000,
+        help='Specify packets of each access point'
+    )
+
+    parser.add_argument(
+        '--duration',
+        dest='duration',
+        type=float,
+        default=300.0,
+        help='Specify seconds of the session'
+    )
+
+    parser.add_argument(
+        '--room',
+        dest='room',
+        type=float,
+        nargs=2,
+        default=[6.0, 4.0],
+        help='Specify width and height of the room in meters'
+    )
+
+    parser.add_argument(
+        '--seed',
+        dest='seed',
+        type=int,
+        default=0,
+        help='Specify random seed'
+    )
+
+    args, __ = parser.parse_known_args()
+
+    test(args)
@@ -6,19 +6,82 @@ from subprocess import Popen
 from subprocess import PIPE
 
 
+CSI_FFT_LENGTH = {20: 64, 40: 128, 80: 256}
+CSI_NULL_CARRIERS = {
+    20: [slice(0, 4), 32, slice(61, 64)],
+    40: [slice(0, 6), slice(63, 66), slice(123, 128)],
+    80: [slice(0, 6), slice(127, 130), slice(251, 256)],
+}
+CSI_BATCH_SIZE = 1024  # frames decoded and written at a time
+
+
+def split_csi_payload(data):
+    '''
+    split `data.data` hex of a Nexmon frame into transmitter address and
+    raw csi bytes
+    '''
+    payload = bytes.fromhex(data.replace(':', ''))
+    if len(payload) == 1058:
+        return payload[32:38].hex(':'), payload[42:]
+    return payload[8:14].hex(':'), payload[18:]
+
+
+def decode_csi(csi_payloads, bw=20):
+    '''
+    decode raw csi bytes of many frames at once, each subcarrier being
+    little-endian int16 (imag, real), into amplitude and phase arrays with
+    the null carriers of `bw` MHz zeroed
+    '''
+    FFTlength = CSI_FFT_LENGTH.get(bw, 64)
+    raw = np.frombuffer(b''.join(csi_payloads), dtype='<i2')
+    raw = raw.reshape(len(csi_payloads), -1, 2)
+    csi_val = np.zeros((raw.shape[0], 256), dtype=complex)
+    csi_val.real[:, :raw.shape[1]] = raw[:, :, 1]
+    csi_val.imag[:, :raw.shape[1]] = raw[:, :, 0]
+    if FFTlength < 256:
+        cmplx_bw = np.fft.fftshift(csi_val[:, 1:(FFTlength+1)], axes=1)
+    else:
+        cmplx_bw = np.fft.fftshift(csi_val[:, :-1], axes=1)
+    # set 0 to null carriers
+    for null_carriers in CSI_NULL_CARRIERS.get(bw, []):
+        cmplx_bw[:, null_carriers] = 0
+    return np.abs(cmplx_bw), np.angle(cmplx_bw)
+
+
+def format_csi_frames(frames, bw=20):
+    '''
+    format (time, time_rel, data.data) frames into csv lines
+    '''
+    tas = []
+    csi_payloads = []
+    for t, t_rel, data in frames:
+        ta, csi_data = split_csi_payload(data)
+        tas.append(ta)
+        csi_payloads.append(csi_data)
+    lines = []
+    # frames of one batch may carry different csi lengths
+    for length in sorted(set(len(x) for x in csi_payloads)):
+        idxs = [i for i, x in enumerate(csi_payloads) if len(x) == length]
+        amps, phases = decode_csi([csi_payloads[i] for i in idxs], bw)
+        values = np.empty((len(idxs), 2 * amps.shape[1]))
+        values[:, 0::2] = amps
+        values[:, 1::2] = phases
+        fmt = ",%.6f,%.4f" * amps.shape[1] + "\n"
+        for i, row in zip(idxs, values.tolist()):
+            lines.append((i, "%s,%.4f,%.4f" % (tas[i], frames[i][0], frames[i][1]) + fmt % tuple(row)))
+    return "".join(line for __, line in sorted(lines))
+
+
 class Tshark():
     def __init__(self):
         pass
 
-    def translateCSI(self, ifp, ofp, bw=20):
+    def translateCSI(self, ifp, ofp, bw=20, batch=CSI_BATCH_SIZE):
         '''
         extract csi from pcap file according to Nexmon hack
+        frames are decoded and written `batch` at a time
         '''
-        FFTlength = 64
-        if bw is 40:
-            FFTlength = 128
-        elif bw is 80:
-            FFTlength = 256
+        FFTlength = CSI_FFT_LENGTH.get(bw, 64)
         cmd = [
             '-r{0}'.format(ifp),
             '-Tfields',
@@ -36,6 +99,7 @@ class Tshark():
                 for i in range(1, FFTlength + 1):
                     f.write(",sub_{0}_amp,sub_{0}_phase".format(i))
                 f.write("\n")
+                frames = []
                 for line in p.stdout:
                     try:
                         t, t_rel, txMAC, frameLen, data = line.decode().rstrip().split(',')
@@ -44,53 +108,12 @@ class Tshark():
                         continue
                     if not frameLen == '1076':
                         continue
-                    t = float(t)
-                    t_rel = float(t_rel)
-                    data = data.split(':')
-                    if len(data) == 1058:
-                        ta = ':'.join(data[32:38])
-                        csi_data = data[42:]
-                    else:
-                        ta = ':'.join(data[8:14])
-                        csi_data = data[18:]
-                    csi_val = 1j * np.zeros(256)
-                    for i in range(0, len(csi_data), 4):
-                        real_p = int(
-                            "{0}{1}"
-                            .format(csi_data[i+3], csi_data[i+2]),
-                            16
-                        )
-                        if real_p > 0x7FFF:
-                            real_p -= 0x10000
-                        imag_p = int(
-                            "{0}{1}"
-                            .format(csi_data[i+1], csi_data[i+0]),
-                            16
-                        )
-                        if imag_p > 0x7FFF:
-                            imag_p -= 0x10000
-                        csi_val[i / 4] = np.complex(real_p, imag_p)
-                    if FFTlength < 256:
-                        cmplx_bw = np.fft.fftshift(csi_val[1:(FFTlength+1)])
-                    else:
-                        cmplx_bw = np.fft.fftshift(csi_val[:-1])
-                    # set 0 to null carriers
-                    if bw is 20:
-                        cmplx_bw[:4] = 0
-                        cmplx_bw[32] = 0
-                        cmplx_bw[61:64] = 0
-                    elif bw is 40:
-                        cmplx_bw[:6] = 0
-                        cmplx_bw[63:66] = 0
-                        cmplx_bw[123:128] = 0
-                    elif bw is 80:
-                        cmplx_bw[:6] = 0
-                        cmplx_bw[127:130] = 0
-                        cmplx_bw[251:256] = 0
-                    f.write("{0},{1:.4f},{2:.4f}".format(ta, t, t_rel))
-                    for each in zip(np.abs(cmplx_bw), np.angle(cmplx_bw)):
-                        f.write(",{0:.6f},{1:.4f}".format(each[0], each[1]))
-                    f.write("\n")
+                    frames.append((float(t), float(t_rel), data))
+                    if len(frames) >= batch:
+                        f.write(format_csi_frames(frames, bw))
+                        frames = []
+                if frames:
+                    f.write(format_csi_frames(frames, bw))
         except KeyboardInterrupt:
             p.kill()
         except Exception:
@@ -128,7 +151,77 @@ class Tshark():
             raise
 
 
+def _format_csi_frame_legacy(t, t_rel, data, bw=20):
+    '''
+    the original per-byte csi decoder, kept as the benchmark reference
+    '''
+    FFTlength = CSI_FFT_LENGTH.get(bw, 64)
+    data = data.split(':')
+    if len(data) == 1058:
+        ta = ':'.join(data[32:38])
+        csi_data = data[42:]
+    else:
+        ta = ':'.join(data[8:14])
+        csi_data = data[18:]
+    csi_val = 1j * np.zeros(256)
+    for i in range(0, len(csi_data), 4):
+        real_p = int("{0}{1}".format(csi_data[i+3], csi_data[i+2]), 16)
+        if real_p > 0x7FFF:
+            real_p -= 0x10000
+        imag_p = int("{0}{1}".format(csi_data[i+1], csi_data[i+0]), 16)
+        if imag_p > 0x7FFF:
+            imag_p -= 0x10000
+        csi_val[i // 4] = complex(real_p, imag_p)
+    if FFTlength < 256:
+        cmplx_bw = np.fft.fftshift(csi_val[1:(FFTlength+1)])
+    else:
+        cmplx_bw = np.fft.fftshift(csi_val[:-1])
+    for null_carriers in CSI_NULL_CARRIERS.get(bw, []):
+        cmplx_bw[null_carriers] = 0
+    line = "{0},{1:.4f},{2:.4f}".format(ta, t, t_rel)
+    for each in zip(np.abs(cmplx_bw), np.angle(cmplx_bw)):
+        line += ",{0:.6f},{1:.4f}".format(each[0], each[1])
+    return line + "\n"
+
+
+def bench_csi(num_frames=2000, seed=0):
+    '''
+    compare throughput and output of the batched csi decoder against the
+    original one on random Nexmon payloads
+    '''
+    rng = np.random.RandomState(seed)
+    frames = []
+    for i in range(num_frames):
+        # both payload layouts, 1058 bytes with headers and 1034 without
+        payload = rng.randint(0, 256, 1058 if i % 2 else 1034).astype(np.uint8)
+        frames.append((1557092022.0 + i * 0.01, i * 0.01, payload.tobytes().hex(':')))
+    for bw in [20, 40, 80]:
+        start = time.time()
+        legacy = "".join(_format_csi_frame_legacy(t, t_rel, data, bw) for t, t_rel, data in frames)
+        legacy_time = time.time() - start
+        start = time.time()
+        batched = "".join(
+            format_csi_frames(frames[i:i + CSI_BATCH_SIZE], bw)
+            for i in range(0, num_frames, CSI_BATCH_SIZE)
+        )
+        batched_time = time.time() - start
+        print(
+            "bw {}MHz: legacy {:.0f} frames/s, batched {:.0f} frames/s ({:.1f}x), output {}"
+            .format(
+                bw,
+                num_frames / legacy_time,
+                num_frames / batched_time,
+                legacy_time / batched_time,
+                "identical" if legacy == batched else "DIFFERENT"
+            )
+        )
+
+
 def test(args):
+    if args.bench_csi:
+        bench_csi(args.bench_csi)
+        return
+
     if args.outf is None:
         print("Must specify output filepath")
         return
@@ -170,6 +263,14 @@ if __name__ == "__main__":
         help='Specify output filepath'
     )
 
+    parser.add_argument(
+        '-bench-csi', '--bench-csi',
+        dest='bench_csi',
+        type=int,
+        default=None,
+        help='Benchmark csi decoding with the given number of random frames'
+    )
+
     args, __ = parser.parse_known_args()
 
     test(args)
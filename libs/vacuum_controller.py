@@ -3,11 +3,21 @@ import time
 import json
 import miio
 import codecs
-import socket
-import binascii
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
+from libs.env import get_env_var
 from libs.env import set_env_var
+from libs.discovery import DiscoveryCache
+from libs.discovery import discover_devices
+from libs.file_sync import FileSync
+from libs.file_sync import SYNC_INTERVAL
+from libs.pose_receiver import PoseReceiver
+from libs.pose_receiver import local_ip_towards
+from libs.ssh_session import SshConnection
+from libs.status_monitor import StatusMonitor
+from libs.status_monitor import start_cleaning
+from libs.status_monitor import REDISCOVER_ERRORS
 
 
 def config_help():
@@ -35,30 +45,22 @@ def control_help():
     print('quit/exit                    - exit controller (Ctrl + D does the same)')
 
 
-def run_ssh_command(cmd):
-    try:
-        output = subprocess.check_output(
-            "ssh -o ConnectTimeout=10 root@${{MIROBO_IP}} '{}'"
-            .format(cmd),
-            shell=True
-        ).decode()
-    except BaseException as e:
-        print("Err: {}".format(e))
-        return None
-    return output
-
-
-def fetch_file_from_vacuum(remote_fp, local_fp="./"):
-    try:
-        subprocess.check_output(
-            "scp -o ConnectTimeout=10 root@${{MIROBO_IP}}:{} {}"
-            .format(remote_fp, local_fp),
-            shell=True
-        )
-        return True
-    except BaseException as e:
-        print("Err: {}".format(e))
-    return False
+# one shared ssh connection per vacuum ip
+_ssh_connections = {}
+
+
+def ssh_connection():
+    '''
+    the shared SshConnection to the vacuum at $MIROBO_IP
+    '''
+    ip = get_env_var("MIROBO_IP")
+    if ip not in _ssh_connections:
+        _ssh_connections[ip] = SshConnection(ip)
+    return _ssh_connections[ip]
+
+
+def run_ssh_command(cmd, retry=True):
+    return ssh_connection().run(cmd, retry=retry)
 
 
 def export_ip_token(ip, token):
@@ -75,6 +77,8 @@ class VacuumController():
     def __init__(self, ip=None, token=None, forceScan=False):
         self.config = {}
         self.tmp = {}
+        self.receiver = None
+        self.sync = None
 
         # load old config if exist
         self.configuration(["load"])
@@ -93,9 +97,10 @@ class VacuumController():
         )
 
         if forceScan or self.get_ip() is None or self.get_token() is None:
-            self.discover()
-
-        export_ip_token(self.get_ip(), self.get_token())
+            if not self.discover():
+                exit(-1)
+        else:
+            export_ip_token(self.get_ip(), self.get_token())
 
     def get_ip(self):
         return self.config.get("ip", None)
@@ -112,57 +117,58 @@ class VacuumController():
     def get_remote_folder(self):
         return self.config.get("remote_script_folder", "/mnt/data/exp")
 
+    def get_stream_port(self):
+        '''
+        port to receive live poses from the vacuum on, None to not stream
+        '''
+        port = self.config.get("stream_port", None)
+        return None if port is None else int(port)
+
+    def get_trace_format(self):
+        '''
+        `csv` or `bin` for the packed binary trace of get_loc_est.py
+        '''
+        return self.config.get("trace_format", "csv")
+
+    def get_sync_interval(self):
+        '''
+        seconds between pulls of the growing trace while tracing, 0 to
+        only download it at the end
+        '''
+        return float(self.config.get("sync_interval", SYNC_INTERVAL))
+
     def set_config(self, key, val):
         self.config[key] = val
 
-    def _discover(self, timeout=5):
-        seen_devices = []
-        magic = '21310020ffffffffffffffffffffffffffffffffffffffffffffffffffffffff'
-        # broadcast magic handshake to find devices
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        s.settimeout(timeout)
-        s.sendto(bytes.fromhex(magic), ('<broadcast>', 54321))
-        while 1:
-            try:
-                data, addr = s.recvfrom(1024)
-                m = miio.protocol.Message.parse(data)
-                if addr[0] not in seen_devices:
-                    seen_device = (
-                        addr[0],
-                        binascii.hexlify(m.header.value.device_id).decode(),
-                        m.checksum
-                    )
-                    print(
-                        "IP {} (ID: {}) - token: {}"
-                        .format(
-                            seen_device[0],
-                            seen_device[1],
-                            codecs.encode(seen_device[2], 'hex').decode()
-                        )
-                    )
-                    seen_devices.append(seen_device)
-            except socket.timeout:
-                print("Discover done!")
-                break  # ignore timeouts on discover
-            except Exception as e:
-                print('Error while reading discover results: {}'.format(e))
-                break
-        return seen_devices
+    def _use_device(self, sighting):
+        ip, device_id, token = sighting
+        self.set_ip(ip)
+        self.set_token(token)
+        self.set_config("device_id", device_id)
+        self.vacuum = miio.Vacuum(ip=ip, token=token)
+        export_ip_token(ip, token)
+        # keep the sightings for the next discovery
+        self._config(["save"])
 
     def discover(self):
         '''
-        getting ip and token of device, e.g., vacuum
+        getting ip and token of device, e.g., vacuum, probing the cached
+        devices before broadcasting
+        returns whether one was found
         '''
-        seen_devices = self._discover()
+        seen_devices = discover_devices(
+            DiscoveryCache(self.config),
+            expected=self.config.get("device_id", None),
+            ips=[self.get_ip()] if self.get_ip() else []
+        )
+        for seen_device in seen_devices:
+            print("IP {} (ID: {}) - token: {}".format(*seen_device))
         if not seen_devices:
             print('Err: cannot find any devices')
-            exit(-1)
-        if len(seen_devices) == 1:
-            self.set_ip(seen_devices[0][0])
-            self.vacuum.token = seen_devices[0][2]
-            self.set_token(codecs.encode(seen_devices[0][2], 'hex').decode())
-            return
+            return False
+        if len(seen_devices) == 1 or seen_devices[0][1] == self.config.get("device_id", None):
+            self._use_device(seen_devices[0])
+            return True
         print('Found multiple IPs:')
         for i, seen_device in enumerate(seen_devices):
             print(
@@ -171,9 +177,7 @@ class VacuumController():
             )
         try:
             selected = input('Please select one by typing number (1-{}): '.format(len(seen_devices)))
-            self.set_ip(seen_devices[int(selected)-1][0])
-            self.vacuum.token = seen_devices[int(selected)-1][2]
-            self.set_token(codecs.encode(seen_devices[int(selected)-1][2], 'hex').decode())
+            self._use_device(seen_devices[int(selected)-1])
         except KeyboardInterrupt:
             print('User requested to exit')
             exit(0)
@@ -181,11 +185,12 @@ class VacuumController():
             print('Err: Please enter only one number')
             exit(-1)
         except IndexError:
-            print('Err: Please enter one number between 1-{}'.format(len(ips)))
+            print('Err: Please enter one number between 1-{}'.format(len(seen_devices)))
             exit(-1)
         except BaseException as e:
             print('Err: {}'.format(e))
             exit(-1)
+        return True
 
     def fetching_token(self):
         '''
@@ -209,7 +214,9 @@ class VacuumController():
         return False
 
     def update_script(self, filepath="init_vacuum.sh"):
-        subprocess.call("./{}".format(filepath, ), shell=True)
+        # the script's ssh/scp calls share the connection too
+        env = dict(os.environ, MIROBO_SSH_OPTS=ssh_connection().ssh_options())
+        subprocess.call("./{}".format(filepath, ), shell=True, env=env)
         return
 
     def _config(self, cmd):
@@ -267,39 +274,103 @@ class VacuumController():
         if status.battery < 50:
             print("Battery less than 50%, please charge till above 50% to continue")
             return False
+        if not ssh_connection().check() and run_ssh_command("true") is None:
+            print("Err: cannot reach the vacuum over ssh")
+            return False
         self._control(["trace", "on"])
-        self._control(["move", "auto"])
-        self._control(["fanspeed", "1"])  # set to lowest fan speed
-        while 1:
-            try:
-                status = self.vacuum.status()
-            except KeyboardInterrupt:
-                break
-            except BaseException as e:
-                print("Err: {}".format(e))
-                print("Wait for a bit..")
-                time.sleep(10)
-                continue
-            if status.error_code > 0 or status.state_code == 12:
-                print("Err: {}".format(status.error))
+        # the timeline shares the prefix of the downloads
+        prefix = self.tmp.setdefault(
+            "session_prefix", time.strftime("%Y%m%d_%H%M%S", time.localtime())
+        )
+        print("Recording status timeline into ./{}_status.csv".format(prefix))
+        monitor = StatusMonitor(self.vacuum, "./{}_status.csv".format(prefix))
+        try:
+            print("Starting..")
+            # set to lowest fan speed, the session goes on without
+            start_cleaning(monitor, 1)
+            while 1:
                 try:
-                    # try to pause
-                    print("Trying to pause due to the error")
-                    self.vacuum.pause()
-                except BaseException as e:
-                    print("Err: cannot pause due to {}".format(e))
-                    print("Wait for 30s and restart discovering mode")
-                    self.discover()
+                    time.sleep(monitor.next_interval())
+                    status = monitor.poll()
+                except KeyboardInterrupt:
+                    break
+                except Exception as e:
+                    print("Err: {}".format(e))
+                    self._rediscover(monitor)
                     continue
-                break
-            if status.state_code == 6:
-                print("Returning home.. stopping..")
-                break
-            print(status)
-            time.sleep(1)
+                if status.error_code > 0 or status.state_code == 12:
+                    print("Err: {}".format(status.error))
+                    try:
+                        # try to pause
+                        print("Trying to pause due to the error")
+                        monitor.call("pause", self.vacuum.pause)
+                    except Exception as e:
+                        print("Err: cannot pause due to {}".format(e))
+                        self._rediscover(monitor)
+                        continue
+                    break
+                if status.state_code == 6:
+                    print("Returning home.. stopping..")
+                    break
+                if monitor.changed:
+                    print("{}, battery {}%, cleaned {:.2f}m2".format(
+                        status.state, status.battery, status.clean_area
+                    ))
+                if self.receiver is not None:
+                    print(self.receiver.summary())
+        except Exception as e:
+            print("Err: {}".format(e))
+        finally:
+            monitor.close()
+            print(monitor.summary())
         self._control(["trace", "off"])
         self._control(["download"])
 
+    def _rediscover(self, monitor):
+        '''
+        after REDISCOVER_ERRORS failed miio calls in a row look for the
+        vacuum again, else wait out the backoff of `monitor`
+        '''
+        if monitor.errors % REDISCOVER_ERRORS == 0:
+            print("No response for {} calls, discovering the vacuum again".format(monitor.errors))
+            if self.discover():
+                monitor.vacuum = self.vacuum
+            return
+        print("Retrying in {:.0f}s..".format(monitor.next_interval()))
+
+    def _start_receiver(self):
+        '''
+        receive live poses into `<prefix>_loc.csv`, which `download` then
+        replaces with the complete trace
+        returns the `host:port` the vacuum reaches it by
+        '''
+        self._stop_receiver()
+        prefix = time.strftime("%Y%m%d_%H%M%S", time.localtime())
+        self.receiver = PoseReceiver(
+            "./{}_loc.csv".format(prefix), port=self.get_stream_port()
+        ).start()
+        self.tmp["session_prefix"] = prefix
+        return "{}:{}".format(
+            self.config.get("stream_host", None) or local_ip_towards(self.get_ip()),
+            self.receiver.address[1]
+        )
+
+    def _trace_sync(self, prefix):
+        '''
+        incremental download of the trace into `<prefix>_loc.<format>`
+        '''
+        ext = "bin" if self.get_trace_format() == "bin" else "csv"
+        return FileSync(
+            ssh_connection(),
+            "{}/tmp_slam.{}".format(self.get_remote_folder(), ext),
+            "./{}_loc.{}".format(prefix, ext),
+            interval=self.get_sync_interval()
+        )
+
+    def _stop_receiver(self):
+        if self.receiver is not None:
+            self.receiver.stop()
+            self.receiver = None
 
     def _control(self, cmd):
         if cmd[0] == 'help':
@@ -315,56 +386,87 @@ class VacuumController():
             if cmd[1] == 'on' or cmd[1] == 'start' or cmd[1] == 'enable':
                 print("Cleaning old data on device..")
                 run_ssh_command(
-                    "rm {0}/*.ppm && rm {0}/*.csv".format(self.get_remote_folder())
+                    "rm {0}/*.ppm && rm {0}/*.csv; rm -f {0}/*.bin".format(self.get_remote_folder())
                 )
                 print("Enabling trace on the vacuum..")
+                binary = self.get_trace_format() == "bin"
+                options = " --binary" if binary else ""
+                if self.sync is not None:
+                    self.sync.stop()
+                    self.sync = None
+                self.tmp.pop("session_prefix", None)
+                if self.get_stream_port() is not None:
+                    options += " --stream {}".format(self._start_receiver())
                 if run_ssh_command(
-                    "nohup /usr/bin/python3 {0}/get_loc_est.py {0}/{1} > /dev/null 2>&1 &"
-                    .format(self.get_remote_folder(), "tmp.csv")
+                    "nohup /usr/bin/python3 {0}/get_loc_est.py {0}/{1}{2} > /dev/null 2>&1 &"
+                    .format(self.get_remote_folder(), "tmp.bin" if binary else "tmp.csv", options),
+                    retry=False
                 ) is None:
+                    self._stop_receiver()
                     return False
+                prefix = self.tmp.setdefault(
+                    "session_prefix", time.strftime("%Y%m%d_%H%M%S", time.localtime())
+                )
+                if self.get_sync_interval() > 0:
+                    print("Pulling the trace every {:.0f}s..".format(self.get_sync_interval()))
+                    self.sync = self._trace_sync(prefix).start()
             elif cmd[1] == 'off' or cmd[1] == 'stop' or cmd[1] == 'disable':
                 print("Stopping trace collection on vacuum..")
-                if run_ssh_command("killall python3") is None:
+                # wait for the trace to be flushed, the sync pulls its end
+                result = run_ssh_command(
+                    "killall python3 && for i in $(seq 20); do pidof python3 > /dev/null || break; sleep 0.2; done",
+                    retry=False
+                )
+                self._stop_receiver()
+                if result is None:
                     return False
             else:
                 print("Unknown command: {}".format(cmd))
                 return False
         elif cmd[0] == 'download':
             print("Downloading..")
-            prefix = time.strftime("%Y%m%d_%H%M%S", time.localtime())
-            if len(cmd) == 1:
-                return (
-                    self._control(['download', 'map', prefix]) and
-                    self._control(['download', 'trace', prefix])
+            if len(cmd) > 2:
+                prefix = cmd[2]
+            else:
+                # replace the streamed trace with the complete one
+                prefix = self.tmp.pop(
+                    "session_prefix", time.strftime("%Y%m%d_%H%M%S", time.localtime())
                 )
+            if len(cmd) == 1:
+                # both at once over the shared ssh connection
+                with ThreadPoolExecutor(max_workers=2) as pool:
+                    return all(pool.map(self._control, [
+                        ['download', 'map', prefix], ['download', 'trace', prefix]
+                    ]))
             if cmd[1] == 'trace':
                 # download the file, after then we delete it 
-                if not fetch_file_from_vacuum(
-                    "{}/tmp_slam.csv"
-                    .format(self.get_remote_folder()),
-                    "./{}_loc.csv"
-                    .format(cmd[2] if len(cmd) > 2 else prefix)
-                ):
+                ext = "bin" if self.get_trace_format() == "bin" else "csv"
+                name = cmd[2] if len(cmd) > 2 else prefix
+                sync = self._trace_sync(name)
+                if self.sync is not None and self.sync.local_fp == sync.local_fp:
+                    # only the rest is left to pull
+                    sync = self.sync
+                if not sync.finish():
                     return False
+                self.sync = None
+                if ext == "bin" and os.path.isfile("./{}_loc.csv".format(name)):
+                    # the streamed trace is superseded
+                    os.remove("./{}_loc.csv".format(name))
             elif cmd[1] == 'map':
-                # find file first
+                # keep only the latest map, it is still updated in /run/shm
                 content = run_ssh_command(
-                    "cp /run/shm/*.ppm {0} && ls {0}/*.ppm"
+                    "f=$(ls /run/shm/*.ppm | tail -n 1) && cp $f {0}/ && echo {0}/$(basename $f)"
                     .format(self.get_remote_folder())
                 )
-                if not content:
-                    return False
-                files = content.rstrip().split('\n')
-                if len(files) == 0:
+                if not content or not content.strip():
                     print("Cannot find map file!")
                     return False
-                print("Found maps: {}".format(files))
-                # download only the latest ppm file
-                if not fetch_file_from_vacuum(
-                    files[-1],
+                print("Found map: {}".format(content.strip()))
+                if not FileSync(
+                    ssh_connection(),
+                    content.strip(),
                     "./{}_map.ppm".format(cmd[2] if len(cmd) > 2 else prefix)
-                ):
+                ).finish():
                     return False
             else:
                 print("Unknown command: {}".format(cmd))
@@ -450,8 +552,8 @@ class VacuumController():
 def init_controller(ip, token):
     c = VacuumController(ip=ip, token=token, forceScan=False)
     if not c.test_connection():
-        c = VacuumController(forceScan=True)
-        if not c.test_connection():
+        # the vacuum may have a new ip, look for it again
+        if not c.discover() or not c.test_connection():
             print("Cannot connect to vacuum!")
             exit(-1)
 
@@ -4,14 +4,28 @@ import os
 import sys
 import argparse
 
+import numpy as np
+
 from libs.parser_post import build_map
 from libs.parser_post import translate_pcap
 from libs.parser_post import combine_sig_loc
 from libs.parser_post import convert_to_pickle_rss
+from libs.parser_post import convert_to_pickle_samples
 from libs.parser_post import get_locs_from_slam_data
 from libs.parser_post import get_locs_from_parsed_sig_data
 from libs.parser_post import extract_dev_from_combined
 from libs.parser_post import get_groundtruth_dict
+from libs.sig_columns import macs_fp
+from libs.sig_columns import columns_fp
+from libs.dataset import ShardWriter
+from libs.stage_cache import StageCache
+from libs.pcap_reader import PCAP_READERS
+from libs.stage_cache import map_outputs
+from libs.rss_pool import batch_seed
+from libs.rss_pool import sampling_seed
+from libs.rss_pool import convert_to_pickle_parallel
+from libs.instrument import Instrument
+from libs.instrument import NO_INSTRUMENT
 
 
 def get_files(folder):
@@ -26,7 +40,7 @@ def get_files(folder):
             f_sig_data = "{0}/{1}".format(folder, file)
             if "csi" in file:
                 is_csi = True
-        elif 'loc.csv' in file:
+        elif 'loc.csv' in file or 'loc.bin' in file:
             f_loc_est = "{0}/{1}".format(folder, file)
         elif 'map.ppm' in file:
             f_map_image = "{0}/{1}".format(folder, file)
@@ -35,6 +49,17 @@ def get_files(folder):
     return f_map_image, f_loc_est, f_sig_data, f_groundtruth, is_csi
 
 
+def expand_filters(filters):
+    '''
+    `6` stands for all six heading filters, `7` for those plus unfiltered
+    '''
+    if filters == 6:
+        return list(range(0, 6))
+    if filters == 7:
+        return [None] + list(range(0, 6))
+    return filters
+
+
 def convert_to_pickle(
     filepaths, 
     orientation,
@@ -46,45 +71,131 @@ def convert_to_pickle(
     sampling=False, 
     sampling_num=5,
     map_dim=None,
-    map_res=0.1
+    map_res=0.1,
+    jobs=1,
+    seed=None,
+    batch_sampling=False,
+    stack_samples=False,
+    writer=None
 ):
     '''
+    with `batch_sampling` and unless `visualize`, each device is binned
+    once and draws all its samples in one go, written as one stacked pickle if `stack_samples`;
+    maps go to the shards of `writer` (libs.dataset) instead if given
+    returns the output paths without extension, None if not finished
     '''
     if is_csi:
         print("Err: not implemented for CSIs yet")
         return
-    for filepath in filepaths:
+    if jobs > 1 and not visualize:
+        return convert_to_pickle_parallel(
+            filepaths,
+            orientation,
+            groundtruth=groundtruth,
+            filters=expand_filters(filters),
+            output_map=output_map,
+            sampling=sampling,
+            sampling_num=sampling_num,
+            map_dim=map_dim,
+            map_res=map_res,
+            jobs=jobs,
+            seed=seed,
+            batch_sampling=batch_sampling,
+            stack_samples=stack_samples,
+            writer=writer
+        )
+    out_fps = []
+    # visualizing shows map by map
+    if sampling and batch_sampling and not visualize:
+        for dev_idx, filepath in enumerate(filepaths):
+            print("parsing file: {}".format(filepath))
+            try:
+                out_fps += convert_to_pickle_samples(
+                    filepath, orientation, sampling_num,
+                    labels=groundtruth.get(os.path.splitext(os.path.basename(filepath))[0], None),
+                    output_map=output_map,
+                    filters=expand_filters(filters),
+                    stack=stack_samples,
+                    map_dim=map_dim,
+                    map_res=map_res,
+                    rng=np.random.RandomState(batch_seed(seed, dev_idx)),
+                    writer=writer
+                )
+            except KeyboardInterrupt:
+                print("KeyboardInterrupt happened")
+                return
+        return out_fps
+    for dev_idx, filepath in enumerate(filepaths):
         print("parsing file: {}".format(filepath))
         if not sampling:
             sampling_num = 1
-        for __ in range(sampling_num):
+        for rep in range(sampling_num):
+            if sampling and seed is not None:
+                np.random.seed(sampling_seed(seed, dev_idx, rep))
             try:
-                if filters is 6:
-                    for fff in range(0, 6):
-                        convert_to_pickle_rss(
-                            filepath, orientation,
-                            labels=groundtruth.get(os.path.splitext(os.path.basename(filepath))[0], None),
-                            visualize=visualize,
-                            output_map=output_map,
-                            filters=fff,
-                            sampling=sampling,
-                            map_dim=map_dim,
-                            map_res=map_res
-                        )
-                else:
-                    convert_to_pickle_rss(
-                        filepath, orientation,
-                        labels=groundtruth.get(os.path.splitext(os.path.basename(filepath))[0], None),
-                        visualize=visualize,
-                        output_map=output_map,
-                        filters=filters,
-                        sampling=sampling,
-                        map_dim=map_dim,
-                        map_res=map_res
-                    )
+                out_fps += convert_to_pickle_rss(
+                    filepath, orientation,
+                    labels=groundtruth.get(os.path.splitext(os.path.basename(filepath))[0], None),
+                    visualize=visualize,
+                    output_map=output_map,
+                    filters=expand_filters(filters),
+                    sampling=sampling,
+                    map_dim=map_dim,
+                    map_res=map_res,
+                    writer=writer,
+                    sample=rep if sampling else None
+                )
             except KeyboardInterrupt:
                 print("KeyboardInterrupt happened")
                 return
+    return out_fps
+
+
+def sig_outputs(csv_fps):
+    '''
+    csv files and their cached columns
+    '''
+    return [fp for csv_fp in csv_fps for fp in [csv_fp, columns_fp(csv_fp), macs_fp(csv_fp)]]
+
+
+def prepare_sig(
+    cache,
+    f_sig,
+    f_loc,
+    is_csi,
+    interpolate=False,
+    minimalCounts=5000,
+    reader=None,
+    instrument=NO_INSTRUMENT
+):
+    '''
+    translate the pcap, add locations and split it per device, skipping
+    whatever `cache` has seen with the same inputs
+    returns the device files and the location bounds
+    '''
+    def translate():
+        # a changed pcap got its stale csv removed by the cache
+        with instrument.stage('translate_pcap', [f_sig]) as stage:
+            outputfp = translate_pcap(f_sig, is_csi, reader=reader)
+            stage.outputs([outputfp])
+        return outputfp, sig_outputs([outputfp])
+    f_sig_parsed = cache.run('translate', [f_sig], {'is_csi': is_csi, 'reader': reader}, translate)
+
+    def split():
+        with instrument.stage('combine_sig_loc', [f_sig_parsed, f_loc]) as stage:
+            f_sig_combined, minmax_xys = combine_sig_loc(f_sig_parsed, f_loc, interpolate=interpolate)
+            stage.outputs([f_sig_combined])
+        with instrument.stage('extract_dev_from_combined', [f_sig_combined]) as stage:
+            f_sig_extracted = extract_dev_from_combined(f_sig_combined, minimalCounts=minimalCounts)
+            stage.outputs(f_sig_extracted)
+        return (f_sig_extracted, minmax_xys), sig_outputs(f_sig_extracted)
+    f_sig_extracted, minmax_xys = cache.run(
+        'split',
+        [f_sig_parsed, f_loc],
+        {'interpolate': interpolate, 'minimalCounts': minimalCounts},
+        split
+    )
+    return f_sig_extracted, minmax_xys
 
 
 def main(args):
@@ -99,39 +210,113 @@ def main(args):
         print("Err: desired files not exist")
         sys.exit(2)
 
+    # stages only get skipped when nothing is shown interactively
+    cache = StageCache(args.folder, enabled=args.cache and not args.visualize)
+    instrument = Instrument(
+        enabled=args.report is not None,
+        profile_dir=args.profile,
+        trace_memory=args.trace_memory
+    )
+    try:
+        run_stages(args, cache, instrument, f_map, f_loc, f_sig, f_gt, is_csi)
+    finally:
+        if instrument.enabled:
+            instrument.stop()
+            print(instrument.summary())
+            if args.report is not None:
+                instrument.write(args.report)
+
+
+def run_stages(args, cache, instrument, f_map, f_loc, f_sig, f_gt, is_csi):
+
     # parse pcap into csv, and add location if it has one
-    f_sig_parsed = translate_pcap(f_sig, is_csi)
-    f_sig_combined, minmax_xys = combine_sig_loc(f_sig_parsed, f_loc)
-    f_sig_extracted = extract_dev_from_combined(f_sig_combined, minimalCounts=5000)
+    f_sig_extracted, minmax_xys = prepare_sig(
+        cache, f_sig, f_loc, is_csi,
+        interpolate=args.interpolate,
+        minimalCounts=5000,
+        reader=args.pcap_reader,
+        instrument=instrument
+    )
 
     gts = get_groundtruth_dict(f_gt)
+    gt_inputs = [] if f_gt is None else [f_gt]
 
     if args.pickle:
-        convert_to_pickle(
-            f_sig_extracted,
-            args.orientation,
-            groundtruth=gts,
-            filters=args.filters,
-            visualize=args.visualize,
-            is_csi=is_csi,
-            output_map=args.visualize_dump,
-            sampling=args.sampling,
-            sampling_num=args.sampling_num,
-            map_dim=args.dimension,
-            map_res=args.resolution
+        def maps():
+            writer = None
+            if args.shards is not None:
+                session = os.path.basename(args.folder.rstrip('/'))
+                writer = ShardWriter(args.shards, session, session=session, orientation=args.orientation)
+            with instrument.stage('convert_to_pickle', f_sig_extracted) as stage:
+                out_fps = convert_to_pickle(
+                    f_sig_extracted,
+                    args.orientation,
+                    groundtruth=gts,
+                    filters=args.filters,
+                    visualize=args.visualize,
+                    is_csi=is_csi,
+                    output_map=args.visualize_dump,
+                    sampling=args.sampling,
+                    sampling_num=args.sampling_num,
+                    map_dim=args.dimension,
+                    map_res=args.resolution,
+                    jobs=args.jobs,
+                    seed=args.seed,
+                    batch_sampling=args.batch_sampling,
+                    stack_samples=args.stack_samples,
+                    writer=writer
+                )
+                if out_fps is None:
+                    return None, None
+                outputs = map_outputs(out_fps) + ([] if writer is None else writer.close())
+                stage.outputs(outputs)
+            return None, outputs
+        cache.run(
+            'maps',
+            f_sig_extracted + gt_inputs,
+            {
+                'orientation': args.orientation,
+                'filters': args.filters,
+                'sampling': args.sampling,
+                'sampling_num': args.sampling_num,
+                'seed': args.seed,
+                'batch_sampling': args.batch_sampling,
+                'stack_samples': args.stack_samples,
+                'shards': args.shards,
+                'output_map': args.visualize_dump,
+                'dimension': args.dimension,
+                'resolution': args.resolution,
+            },
+            maps
         )
 
     # generate path in map for visualization
     if args.map:
-        build_map(
-            f_map,
-            args.orientation,
-            minmax_xys,
-            markers=gts,
-            visualize=args.visualize,
-            output_map=args.visualize_dump,
-            map_dim=args.dimension,
-            map_res=args.resolution
+        def floormap():
+            with instrument.stage('build_map', [f_map]) as stage:
+                outputs = build_map(
+                    f_map,
+                    args.orientation,
+                    minmax_xys,
+                    markers=gts,
+                    visualize=args.visualize,
+                    output_map=args.visualize_dump,
+                    map_dim=args.dimension,
+                    map_res=args.resolution
+                )
+                stage.outputs(outputs or [])
+            return None, outputs
+        cache.run(
+            'floormap',
+            [f_map],
+            {
+                'orientation': args.orientation,
+                'minmax_xys': minmax_xys,
+                'output_map': args.visualize_dump,
+                'dimension': args.dimension,
+                'resolution': args.resolution,
+            },
+            floormap
         )
 
 
@@ -162,7 +347,7 @@ if __name__ == '__main__':
         dest='filters',
         type=int,
         default=None,
-        help='Ignore the arg by default, set to x to extract only y `0: >`, `1: v`, `2: <`, `3: ^`, `4: <^>`, `5: <v>`, `6: all`'
+        help='Ignore the arg by default, set to x to extract only y `0: >`, `1: v`, `2: <`, `3: ^`, `4: <^>`, `5: <v>`, `6: all`, `7: unfiltered and all`'
     )
     parser.add_argument(
         '--sampling',
@@ -178,6 +363,40 @@ if __name__ == '__main__':
         default=10,
         help='If subsampling enabled, set the number of random samples performed'
     )
+    parser.add_argument(
+        '--batch-sampling',
+        dest='batch_sampling',
+        action='store_true',
+        default=False,
+        help='If subsampling enabled, bin each device once and draw all random samples at once, ignored with `--visualize`'
+    )
+    parser.add_argument(
+        '--stack-samples',
+        dest='stack_samples',
+        action='store_true',
+        default=False,
+        help='With `--batch-sampling`, write the samples of each device as one stacked `_samples<N>` pickle'
+    )
+    parser.add_argument(
+        '--shards',
+        dest='shards',
+        default=None,
+        help='Specify a folder to append maps into `.npy` shards with labels and metadata instead of writing pickles'
+    )
+    parser.add_argument(
+        '--seed',
+        dest='seed',
+        type=int,
+        default=None,
+        help='Specify random seed of subsampling for reproducible maps'
+    )
+    parser.add_argument(
+        '--jobs', '-j',
+        dest='jobs',
+        type=int,
+        default=1,
+        help='Specify number of processes to generate maps with, ignored with `--visualize`'
+    )
     parser.add_argument(
         '--visualize', '-v',
         dest='visualize',
@@ -199,6 +418,27 @@ if __name__ == '__main__':
         default=0,
         help='Specify orientation of the map'
     )
+    parser.add_argument(
+        '--interpolate',
+        dest='interpolate',
+        action='store_true',
+        default=False,
+        help='Enable to interpolate locations between slam estimates instead of taking the next one'
+    )
+    parser.add_argument(
+        '--pcap-reader',
+        dest='pcap_reader',
+        choices=PCAP_READERS,
+        default=None,
+        help='Specify how to read rss pcap files, default tshark if installed, otherwise native'
+    )
+    parser.add_argument(
+        '--cache',
+        dest='cache',
+        action='store_true',
+        default=False,
+        help='Enable to skip the stages whose input files and arguments did not change since the last run'
+    )
     parser.add_argument(
         '--dimension',
         dest='dimension',
@@ -212,6 +452,25 @@ if __name__ == '__main__':
         default=0.1,
         help='Specify resolution of the map, default 0.1m'
     )
+    parser.add_argument(
+        '--report',
+        dest='report',
+        default=None,
+        help='Specify a json file to report time, memory, rows and bytes of each stage into, also printed as a table'
+    )
+    parser.add_argument(
+        '--profile',
+        dest='profile',
+        default=None,
+        help='Specify a folder to dump a cProfile of each stage into'
+    )
+    parser.add_argument(
+        '--trace-memory',
+        dest='trace_memory',
+        action='store_true',
+        default=False,
+        help='Enable to track the peak python allocations of each stage with tracemalloc'
+    )
     args, __ = parser.parse_known_args()
 
     try: